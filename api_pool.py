@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+""" Rate limited, concurrent execution of AWS api calls
+
+Every api call goes through ApiPool.call, which waits for a token bucket and retries
+throttling and transient errors (connection failures, timeouts, 5xx responses) with exponential
+backoff. Each throttle also halves the bucket rate and each success slowly restores it, so the
+pool settles just under the api rate limit.
+ApiPool.map runs calls on a bounded thread pool and returns the results in input order.
+"""
+import logging, random, threading, time
+
+# Error codes the AWS apis return when a caller is over its rate limit
+throttling_codes = ['Throttling', 'ThrottlingException', 'TooManyRequestsException', 'RequestLimitExceeded']
+# Error codes of server side failures that usually succeed when retried
+transient_codes = ['InternalError', 'InternalFailure', 'InternalServerError', 'ServiceUnavailable',
+    'ServiceUnavailableException', 'RequestTimeout', 'RequestTimeoutException']
+# Exception classes (and their subclasses, ex. botocore EndpointConnectionError, ConnectionClosedError and
+# ReadTimeoutError) raised when a connection fails or times out
+connection_errors = ['ConnectionError', 'HTTPClientError', 'TimeoutError']
+
+
+def is_throttling(error):
+    """ Return True if an exception is an AWS throttling error
+
+    Args:
+        error (Exception): an exception raised by a boto3 client call
+    Returns:
+        bool: True if the error code is a throttling error code
+    """
+    response = getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code') in throttling_codes
+
+def is_transient(error):
+    """ Return True if an exception is a connection failure or a server side AWS error worth retrying
+
+    Args:
+        error (Exception): an exception raised by a boto3 client call
+    Returns:
+        bool: True if the error is a connection error, a transient error code or a 5xx response
+    """
+    if any(cls.__name__ in connection_errors for cls in type(error).__mro__):
+        return True
+    response = getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code') in transient_codes or \
+        response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) >= 500
+
+
+class TokenBucket(object):
+    """ Thread safe token bucket rate limiter
+    Called as a module
+
+    Example:
+        bucket = TokenBucket(rate=10)
+        bucket.acquire()  # blocks until a token is available
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        Args:
+            rate (float): tokens added per second
+            burst (float): bucket size. default = None (same as rate)
+        """
+        self.rate = float(rate)
+        self.burst = float(burst or max(rate, 1))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """ Take one token, sleeping until one is available """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ApiPool(object):
+    """ Bounded thread pool with rate limiting and adaptive backoff for AWS api calls
+    Called as a module
+
+    Example:
+        pool = ApiPool(max_workers=8, rate=10)
+        response = pool.call(client.get_products, ServiceCode='AmazonEC2', Filters=[])
+        results = pool.map(get_operation_description, [('AmazonEC2', 'RunInstances'), ('AmazonEC2', 'RunInstances:0002')])
+    """
+
+    def __init__(self, max_workers=8, rate=10, min_rate=0.5, max_retries=8, base_delay=0.25):
+        """
+        Args:
+            max_workers (int): most calls in flight at once. default = 8
+            rate (float): most api calls per second. default = 10
+            min_rate (float): the rate is never lowered below this by throttling. default = 0.5
+            max_retries (int): throttled or transient error retries before the error is raised. default = 8
+            base_delay (float): first backoff delay in seconds, doubled on each retry. default = 0.25
+        """
+        self.max_workers = max_workers
+        self.max_rate = float(rate)
+        self.min_rate = float(min_rate)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.bucket = TokenBucket(rate)
+        self.throttles = 0
+        self.executor = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def _throttled(self):
+        with self.lock:
+            self.throttles += 1
+            self.bucket.rate = max(self.min_rate, self.bucket.rate / 2)
+        logging.info(f"api call throttled. rate lowered to {self.bucket.rate:.2f}/s")
+
+    def _succeeded(self):
+        with self.lock:
+            if self.bucket.rate < self.max_rate:
+                self.bucket.rate = min(self.max_rate, self.bucket.rate + 0.1)
+
+    def call(self, func, *args, **kwargs):
+        """ Call an api function after waiting for the rate limiter, retrying throttling and transient errors.
+        Only throttling lowers the rate
+
+        Args:
+            func (callable): a boto3 client method or any function making one api call
+            args, kwargs: arguments for func
+        Returns:
+            the return value of func
+        """
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                throttled = is_throttling(e)
+                if not (throttled or is_transient(e)) or attempt == self.max_retries:
+                    raise
+                if throttled:
+                    self._throttled()
+                else:
+                    logging.info(f"api call failed, retrying: {e}")
+                time.sleep(self.base_delay * 2 ** attempt * random.uniform(0.5, 1.5))
+                continue
+            self._succeeded()
+            return result
+
+    def _run(self, func, args):
+        self.local.worker = True
+        return func(*args)
+
+    def map(self, func, items, return_exceptions=False):
+        """ Run func for every item on the thread pool and return the results in input order
+        Calls from inside a pool worker run in the calling thread so nested maps cannot deadlock
+
+        Args:
+            func (callable): the function to run
+            items (iterable): an argument tuple for each call (a non tuple item is passed as the only argument)
+            return_exceptions (bool): True/False. If true, a failed call returns its Exception in place of a result
+                instead of raising it. default = False
+        Returns:
+            list: the results of func for each item, in the order of items
+        """
+        items = [item if isinstance(item, tuple) else (item,) for item in items]
+        if self.max_workers <= 1 or len(items) <= 1 or getattr(self.local, 'worker', False):
+            futures = None
+        else:
+            with self.lock:
+                if self.executor is None:
+                    from concurrent.futures import ThreadPoolExecutor
+                    self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            futures = [self.executor.submit(self._run, func, args) for args in items]
+        results = []
+        for i, args in enumerate(items):
+            try:
+                results.append(futures[i].result() if futures else func(*args))
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                results.append(e)
+        return results
+
+    def shutdown(self):
+        """ Stop the worker threads """
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+""" asyncio versions of the aws_pricing lookups
+
+The blocking aws_pricing calls run on a managed thread pool. A semaphore shared by every call
+caps how many run at once, each call can be given a timeout, and cancelling the awaiting task
+returns control at once (the api call in flight is left to finish on its thread and its result
+dropped). get_pricing_batch fetches the validation lists once and then every distinct product
+query concurrently, so a whole matrix takes about as long as its slowest query.
+
+Example:
+    import asyncio, async_pricing
+    results = asyncio.run(async_pricing.get_pricing_batch(requests, timeout=30))
+"""
+import asyncio, itertools, weakref
+from concurrent.futures import ThreadPoolExecutor
+import aws_pricing
+
+max_concurrency = 8
+executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='async_pricing')
+# One semaphore per event loop, asyncio primitives cannot be shared between loops
+semaphores = weakref.WeakKeyDictionary()
+
+
+def set_concurrency(limit=8):
+    """ Set how many blocking pricing calls the async functions run at once
+    Called as a module
+
+    Args:
+        limit (int): most calls in flight at once. default = 8
+    """
+    global max_concurrency, executor
+    executor.shutdown(wait=False)
+    max_concurrency = limit
+    executor = ThreadPoolExecutor(max_workers=limit, thread_name_prefix='async_pricing')
+    semaphores.clear()
+
+async def _run(func, *args, timeout=None, **kwargs):
+    """ Run a blocking function on the executor, under the shared semaphore
+
+    Args:
+        func (callable): the blocking function
+        timeout (float): seconds to wait for the result. default = None (no limit)
+    Returns:
+        the return value of func. Raises asyncio.TimeoutError when the timeout expires
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in semaphores:
+        semaphores[loop] = asyncio.Semaphore(max_concurrency)
+    async with semaphores[loop]:
+        return await asyncio.wait_for(loop.run_in_executor(executor, lambda: func(*args, **kwargs)), timeout)
+
+async def get_attr_vals(service, attr, timeout=None):
+    """ async aws_pricing.get_attr_vals. timeout (float): seconds to wait. default = None """
+    return await _run(aws_pricing.get_attr_vals, service, attr, timeout=timeout)
+
+async def get_regions(timeout=None):
+    """ async aws_pricing.get_regions. timeout (float): seconds to wait. default = None """
+    return await _run(aws_pricing.get_regions, timeout=timeout)
+
+async def get_pricing(timeout=None, **kwargs):
+    """ async aws_pricing.get_pricing
+    Called as a module
+
+    Args:
+        timeout (float): seconds to wait for the result. default = None (no limit)
+        kwargs: get_pricing arguments
+    Return
+        dict: dictionary of pricing parameters
+    """
+    return await _run(aws_pricing.get_pricing, timeout=timeout, **kwargs)
+
+async def get_pricing_batch(requests, return_exceptions=False, timeout=None):
+    """ async aws_pricing.get_pricing_batch. Every distinct service / instanceType / operation / region
+    is queried concurrently
+    Called as a module
+
+    Args:
+        requests (list): a list of dicts of get_pricing keyword arguments
+        return_exceptions (bool): True/False. If true, a failed request returns its Exception in place of a result
+            instead of raising it. default = False
+        timeout (float): seconds to wait for each query. default = None (no limit)
+    Return:
+        list: a list of get_pricing result dicts in the order of requests
+    """
+    services = sorted({request.get('service') for request in requests} & {'AmazonEC2', 'AmazonRDS'})
+    lists = await asyncio.gather(get_regions(timeout=timeout),
+        *[get_attr_vals(service, 'operation', timeout=timeout) for service in services])
+    regions, operations = lists[0], dict(zip(services, lists[1:]))
+    groups = {}
+    for i, request in enumerate(requests):
+        key = tuple(request.get(name) for name in ['service', 'instanceType', 'operation', 'region'])
+        groups.setdefault(key, []).append(i)
+    group_results = await asyncio.gather(*[
+        _run(aws_pricing.get_pricing_batch, [requests[i] for i in indexes], return_exceptions=True,
+            operations=operations, regions=regions, timeout=timeout)
+        for indexes in groups.values()], return_exceptions=True)
+    results = [None] * len(requests)
+    for indexes, group_result in zip(groups.values(), group_results):
+        for j, i in enumerate(indexes):
+            results[i] = group_result if isinstance(group_result, BaseException) else group_result[j]
+    for result in results:
+        if isinstance(result, asyncio.CancelledError):
+            raise result
+        if isinstance(result, BaseException) and not return_exceptions:
+            raise result
+    return results
+
+async def iter_products(service, filters, page_size=100, timeout=None):
+    """ async aws_pricing.iter_products. Yields the decoded products, fetching page_size products per executor call
+    Called as a module
+
+    Args:
+        service (str): Valid AWS Service name
+        filters (list): pricing api filters
+        page_size (int): products fetched per executor call. default = 100
+        timeout (float): seconds to wait for each page. default = None (no limit)
+    Yields:
+        dict: a price list product
+    """
+    products = aws_pricing.iter_products(service, filters, prefetch=True)
+    try:
+        while True:
+            page = await _run(lambda: list(itertools.islice(products, page_size)), timeout=timeout)
+            if not page:
+                return
+            for product in page:
+                yield product
+    finally:
+        try:
+            products.close()
+        except ValueError:
+            # Still running on the executor after a timeout or cancel. It stops when that page is done
+            pass
@@ -1,8 +1,325 @@
 #!/usr/bin/env python3
-import boto3, json, begin, logging
+# boto3, begin and the offline store / response cache modules are imported when first used,
+# so module use and the metadata subcommands start without them
+import atexit, json, logging, os, threading, time
+from api_pool import ApiPool
+from price_record import decode_terms, loads, match_terms
+
+if __name__ == '__main__':
+    import begin, sys
+    # Modules imported by subcommands (ex. pricing_server) share this module's settings
+    sys.modules.setdefault('aws_pricing', sys.modules[__name__])
+else:
+    class begin(object):
+        """ The begin CLI decorators do nothing when imported as a module """
+        subcommand = staticmethod(lambda *args, **kwargs: lambda func: func)
+        start = logging = staticmethod(lambda func: func)
 
 region_name='us-east-1'
+# Operation descriptions fetched by the operations subcommand are kept here for metadata_ttl seconds (see metadata)
+metadata_file = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser(os.path.join('~', '.cache')),
+    'aws_pricing', 'metadata.json')
+metadata_ttl = 7 * 24 * 3600
 logging.getLogger('botocore').setLevel(logging.WARNING)
+# When set (see use_offline), queries are answered from local offer files instead of the api
+offline_store = None
+# Every api call goes through this pool for rate limiting and retries with backoff (see set_concurrency)
+api_pool = ApiPool()
+# (service, region, profile) -> shared boto3 client (see get_client)
+clients = {}
+sessions = {}
+clients_lock = threading.Lock()
+client_config = {'profile': None, 'max_pool_connections': 10}
+# When set (see use_cache), api responses are cached on disk
+response_cache = None
+# Services whose offer version this process has checked against the response cache (see _check_offer_version)
+checked_versions = set()
+versions_lock = threading.Lock()
+# When set (see use_instrumentation), api calls, decoding and term extraction are counted and timed
+instrumentation = None
+
+
+def configure_clients(profile=None, max_pool_connections=10):
+    """ Set the AWS profile and connection pool size of the shared boto3 clients.
+    Drops the existing clients so the next call creates them with the new settings
+    Called as a module
+
+    Args:
+        profile (str): AWS credentials profile name. default = None (default credential chain)
+        max_pool_connections (int): keep-alive connections per client. default = 10
+    """
+    with clients_lock:
+        client_config.update(profile=profile, max_pool_connections=max_pool_connections)
+        clients.clear()
+        sessions.clear()
+
+def get_client(service, region=None, profile=None):
+    """ Return the shared boto3 client for a service / region / profile, creating it on first use
+    Clients are thread safe, so every caller reuses one client and its keep-alive connections
+    Called as a module
+
+    Args:
+        service (str): boto3 service name. ex. 'pricing' | 'ec2'
+        region (str): AWS region name. default = None (region_name)
+        profile (str): AWS credentials profile name. default = None (set by configure_clients)
+    Returns:
+        botocore client: the shared client
+    """
+    key = (service, region or region_name, profile or client_config['profile'])
+    with clients_lock:
+        if key not in clients:
+            import boto3
+            from botocore.config import Config
+            # boto3 sessions are not thread safe, so clients are only created under the lock
+            if key[2] not in sessions:
+                sessions[key[2]] = boto3.session.Session(profile_name=key[2])
+            # One attempt per call (botocore retries off): api_pool retries throttling and transient errors
+            clients[key] = sessions[key[2]].client(service, region_name=key[1],
+                config=Config(max_pool_connections=client_config['max_pool_connections'], retries={'total_max_attempts': 1}))
+        return clients[key]
+
+def set_client(client, service, region=None, profile=None):
+    """ Use a client for a service / region / profile instead of creating one, ex. a client wrapped in a botocore Stubber
+    Called as a module
+
+    Args:
+        client (botocore client): the client to use
+        service (str): boto3 service name. ex. 'pricing' | 'ec2'
+        region (str): AWS region name. default = None (region_name)
+        profile (str): AWS credentials profile name. default = None (set by configure_clients)
+    """
+    with clients_lock:
+        clients[(service, region or region_name, profile or client_config['profile'])] = client
+
+def use_cache(path=None, max_bytes=512 * 1024 * 1024, ttls=None):
+    """ Cache api responses in a file, so repeated queries do not call the api.
+    Cache hit / miss counts are logged at exit
+    Called as a module
+
+    Args:
+        path (str): SQLite cache file. default = None (turns the cache off)
+        max_bytes (int): most bytes of responses to keep. default = 512MB
+        ttls (dict): api method -> seconds a response stays valid. ex. {'get_products': 3600}. default = None
+    Returns:
+        ResponseCache: the cache
+    """
+    global response_cache
+    from response_cache import ResponseCache
+    response_cache = ResponseCache(path, max_bytes=max_bytes, ttls=ttls) if path else None
+    with versions_lock:
+        checked_versions.clear()
+    return response_cache
+
+@atexit.register
+def _log_cache_stats():
+    if response_cache:
+        logging.info(f"response cache: {response_cache.stats()}")
+
+def use_instrumentation(path=None):
+    """ Count and time api calls (per method), product decoding and term extraction
+    Called as a module
+
+    Args:
+        path (str): json file the counters and timings are written to at exit. default = None (not written)
+    Returns:
+        Instrumentation: the counters and timings. Instrumentation.snapshot() returns them at any time
+    """
+    global instrumentation
+    from instrumentation import Instrumentation
+    instrumentation = Instrumentation()
+    if path:
+        atexit.register(instrumentation.export, path)
+    return instrumentation
+
+def _pool_call(method, **kwargs):
+    """ api_pool.call, timed when instrumentation is on """
+    if instrumentation is None:
+        return api_pool.call(method, **kwargs)
+    with instrumentation.timer(f"api.{method.__name__}"):
+        return api_pool.call(method, **kwargs)
+
+def _api_call(method, **kwargs):
+    """ Call a boto3 client method through the response cache and the api pool
+
+    Args:
+        method (callable): boto3 client method. ex. pricing.get_products
+        kwargs: arguments for method
+    Returns:
+        dict: the api response
+    """
+    if response_cache is None:
+        return _pool_call(method, **kwargs)
+    endpoint = method.__name__
+    response = response_cache.get(endpoint, kwargs)
+    if response is None:
+        response = _pool_call(method, **kwargs)
+        response_cache.put(endpoint, kwargs, response)
+    return response
+
+def _check_offer_version(method, service):
+    """ Check the live offer version of a service against the response cache, once per process per service,
+    so cached products of an older offer are dropped before they are read
+
+    Args:
+        method (callable): the pricing get_products client method
+        service (str): AWS service name
+    """
+    with versions_lock:
+        if service in checked_versions:
+            return
+        # One product is enough to read the offer version
+        response = _pool_call(method, ServiceCode=service, MaxResults=1)
+        if response['PriceList']:
+            response_cache.check_version(service, loads(response['PriceList'][0]).get('version'))
+        checked_versions.add(service)
+
+def use_offline(*paths, db=None):
+    """ Answer get_pricing, get_attr_vals, get_operation_description and get_regions
+    from local bulk offer files instead of the pricing api
+    Called as a module
+
+    Args:
+        paths (str): paths to bulk offer files (index.json or index.csv). No paths and no db turns offline mode off
+        db (str): SQLite file to keep the loaded offers in. default = None (in memory).
+            Offers already loaded in the file are reused without any paths
+    Returns:
+        OfferStore: the loaded store
+    """
+    global offline_store
+    from offer_store import OfferStore
+    offline_store = OfferStore(*paths, db=db or ':memory:') if paths or db else None
+    return offline_store
+
+def set_concurrency(max_workers=8, rate=10):
+    """ Set how many api calls get_pricing_batch, get_pricing_matrix and get_operation_descriptions
+    run at once, and the most api calls per second across all threads
+    Called as a module
+
+    Args:
+        max_workers (int): most api calls in flight at once. default = 8. 1 runs every call sequentially
+        rate (float): most api calls per second. Lowered automatically while the api is throttling. default = 10
+    Returns:
+        ApiPool: the new pool
+    """
+    global api_pool
+    api_pool.shutdown()
+    api_pool = ApiPool(max_workers=max_workers, rate=rate)
+    return api_pool
+
+def _store_pages(cache, endpoint, key, kwargs, items, complete):
+    """ Cache the items of the pages of a query read so far, as one response """
+    if endpoint == 'get_products' and items:
+        # The version of a freshly fetched query, for long running processes that outlive an offer
+        cache.check_version(kwargs['ServiceCode'], loads(items[0]).get('version'))
+    cache.put(endpoint, kwargs, {key: items, 'complete': complete})
+
+def _iter_pages(method, key, prefetch=False, **kwargs):
+    """ Yield the items of every page of a paginated pricing api call, following NextToken.
+    With the response cache on, the pages of a call are cached (and evicted) together as one response,
+    so a cached page never hands out a NextToken from an older query. A caller that stops early
+    (ex. get_operation_description) caches the pages it read as a partial response: a later call is
+    answered from it, and only asks the api again (skipping the cached items) if it reads past them
+
+    Args:
+        method (callable): boto3 client method. ex. pricing.get_products
+        key (str): response key holding the page items. ex. 'PriceList'
+        prefetch (bool): True/False. If true, the next page is fetched on a background thread
+            while the current page is consumed. default = False
+        kwargs: arguments for method
+    Yields:
+        the items of each page, in order
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    endpoint = method.__name__
+    # A generator closed early stores its pages in the cache it started with
+    cache, items, skip = response_cache, None, 0
+    if cache:
+        if endpoint == 'get_products':
+            _check_offer_version(method, kwargs['ServiceCode'])
+        cached = cache.get(endpoint, kwargs)
+        if cached is not None:
+            yield from cached[key]
+            if cached.get('complete', True):
+                return
+            skip = len(cached[key])
+        items = []
+    fetch = lambda token: _pool_call(method, **kwargs, **({'NextToken': token} if token else {}))
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    try:
+        response = fetch(None)
+        while True:
+            token = response.get('NextToken')
+            next_page = executor.submit(fetch, token) if executor and token else None
+            page = response[key]
+            if items is not None:
+                items.extend(page)
+            if skip:
+                # Items already yielded from a partial cached response
+                page, skip = page[skip:], max(0, skip - len(page))
+            yield from page
+            if not token:
+                break
+            response = next_page.result() if next_page else fetch(token)
+    except GeneratorExit:
+        if items is not None:
+            _store_pages(cache, endpoint, key, kwargs, items, complete=False)
+        raise
+    finally:
+        if executor:
+            executor.shutdown(wait=False)
+    if items is not None:
+        _store_pages(cache, endpoint, key, kwargs, items, complete=True)
+
+def iter_products(service, filters, prefetch=False):
+    """ Yield the decoded price list products matching the filters, one page at a time
+    Called as a module
+
+    Args:
+        service (str): Valid AWS Service name
+        filters (list): pricing api filters. ex. [{'Type': 'TERM_MATCH', 'Field': 'operation', 'Value': 'RunInstances'}]
+        prefetch (bool): True/False. If true, the next page is fetched while the current one is consumed. default = False
+    Yields:
+        dict: a price list product
+    """
+    if offline_store:
+        if instrumentation is None:
+            yield from offline_store.get_products(service, filters)
+        else:
+            with instrumentation.timer('offline.get_products'):
+                products = offline_store.get_products(service, filters)
+            yield from products
+        return
+    pricing = get_client('pricing')
+    for price in _iter_pages(pricing.get_products, 'PriceList', prefetch=prefetch,
+            ServiceCode=service, Filters=filters, MaxResults=100):
+        if instrumentation is None:
+            yield loads(price)
+        else:
+            with instrumentation.timer('decode'):
+                jprice = loads(price)
+            yield jprice
+
+def _iter_priced_products(service, filters, prefetch=False):
+    """ iter_products for pricing. Offline, the products come with their terms already decoded as PriceRecords
+    (see OfferStore.get_priced_products) instead of as product documents to decode
+    """
+    if offline_store is None:
+        return iter_products(service, filters, prefetch=prefetch)
+    if instrumentation is None:
+        return offline_store.get_priced_products(service, filters)
+    with instrumentation.timer('offline.get_priced_products'):
+        return offline_store.get_priced_products(service, filters)
+
+def _get_products(service, filters):
+    """ Return a list of decoded price list products matching the filters
+
+    Args:
+        service (str): Valid AWS Service name
+        filters (list): pricing api filters
+    Return:
+        list: a list of price list product dicts
+    """
+    return list(iter_products(service, filters))
 
 
 def get_services():
@@ -12,8 +329,10 @@ def get_services():
     Returns:
         list: alist of AWS Service names
     """
-    pricing = boto3.client('pricing', region_name=region_name)
-    response = pricing.describe_services()
+    if offline_store:
+        return offline_store.get_services()
+    pricing = get_client('pricing')
+    response = _api_call(pricing.describe_services)
     services = []
     for service in response['Services']:
         services.append(service['ServiceCode'])
@@ -39,8 +358,8 @@ def get_attrs(service):
     Returns:
         list: a list of pricing attribute names for the service
     """
-    pricing = boto3.client('pricing', region_name=region_name)
-    response = pricing.describe_services(ServiceCode=service)
+    pricing = get_client('pricing')
+    response = _api_call(pricing.describe_services, ServiceCode=service)
     return response['Services'][0]['AttributeNames']
 @begin.subcommand()
 def attrs(service):
@@ -55,6 +374,25 @@ def attrs(service):
     for attr in get_attrs(service):
         print(attr)
 
+def iter_attr_vals(service, attr, prefetch=False):
+    """ Yield the pricing attribute values, one page at a time
+    Called as a module
+
+    Args:
+        service (str): a string with a valid AWS service name
+        att (str): a string with a valid AWS Pricing attribute name for service
+        prefetch (bool): True/False. If true, the next page is fetched while the current one is consumed. default = False
+    Yields:
+        str: an attribute value for AWS Service / Pricing Attribute
+    """
+    if offline_store:
+        yield from offline_store.get_attr_vals(service, attr)
+        return
+    pricing = get_client('pricing')
+    for val in _iter_pages(pricing.get_attribute_values, 'AttributeValues', prefetch=prefetch,
+            ServiceCode=service, AttributeName=attr):
+        yield val['Value']
+
 def get_attr_vals(service, attr):
     """ Return a list of pricing attribute values
     Called as a module
@@ -65,12 +403,7 @@ def get_attr_vals(service, attr):
     Returns:
         list: a list of attribute values for AWS Service / Pricing Attribute
     """
-    pricing = boto3.client('pricing', region_name=region_name)
-    response = pricing.get_attribute_values(ServiceCode=service, AttributeName=attr)
-    vals = []
-    for val in response['AttributeValues']:
-        vals.append(val['Value'])
-    return vals
+    return list(iter_attr_vals(service, attr))
 @begin.subcommand()
 def attr_vals(service, attr):
     """Print a list values for a service/attribute
@@ -92,23 +425,123 @@ def get_regions():
     Return:
         list: a list of AWS region name strings
     """
-    ec2 = boto3.client('ec2', region_name=region_name)
-    response = ec2.describe_regions()
+    if offline_store:
+        # Only the regions that appear in the loaded offers
+        regions = []
+        for service in offline_store.get_services():
+            for location in offline_store.get_attr_vals(service, 'location'):
+                try:
+                    region = loc_to_reg(location=location)
+                except Exception:
+                    continue
+                if region not in regions:
+                    regions.append(region)
+        return regions
+    ec2 = get_client('ec2')
+    response = _api_call(ec2.describe_regions)
     regions = []
     for region in response['Regions']:
         regions.append(region['RegionName'])
     return regions
+def load_metadata(path=None):
+    """ Return the operation descriptions cached by the operations subcommand
+    Called as a module
+
+    Args:
+        path (str): cache file. default = None (metadata_file)
+    Return:
+        dict: {'operations': {service: {'time': float, 'complete': bool, 'descriptions': {operation: description}}}}.
+            Empty if there is no cache file
+    """
+    try:
+        with open(path or metadata_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'operations': {}}
+
+def _cached_descriptions(service, path=None):
+    """ Return the cached entry of a service's operation descriptions, or None if there is none younger than metadata_ttl """
+    entry = load_metadata(path).get('operations', {}).get(service)
+    if entry and time.time() - entry['time'] < metadata_ttl:
+        return entry
+    return None
+
+def save_descriptions(service, descriptions, complete=False, path=None):
+    """ Add operation descriptions of a service to the metadata cache.
+    They are merged into the service's entry while it is younger than metadata_ttl, and replace it after
+    Called as a module
+
+    Args:
+        service (str): AWS service name
+        descriptions (dict): operation -> description
+        complete (bool): True/False. True if descriptions holds every instance operation of the service. default = False
+        path (str): cache file. default = None (metadata_file)
+    """
+    path = path or metadata_file
+    snapshot = load_metadata(path)
+    entry = _cached_descriptions(service, path) or {'time': time.time(), 'complete': False, 'descriptions': {}}
+    entry['descriptions'].update(descriptions)
+    entry['complete'] = entry['complete'] or complete
+    snapshot.setdefault('operations', {})[service] = entry
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(snapshot, f, indent=2)
+    except OSError as e:
+        logging.warning(f"metadata cache not saved: {e}")
+
 @begin.subcommand()
-def regions():
+def metadata(services='AmazonEC2,AmazonRDS'):
+    """ Fetches the descriptions of every instance operation of services into the metadata cache,
+    so the operations subcommand answers without calling the api for metadata_ttl seconds
+    Called from CLI
+
+    Args:
+        services (str): comma separated service names. default = 'AmazonEC2,AmazonRDS'
+    Return:
+        bool: True
+    """
+    counts = []
+    for service in services.split(','):
+        descriptions = get_operation_descriptions(service, _instance_operations(service))
+        save_descriptions(service, descriptions, complete=True)
+        counts.append(f"{len(descriptions)} {service} operations")
+    print(f"saved {', '.join(counts)} to {metadata_file}")
+
+@begin.subcommand()
+def regions(refresh=False):
     """ Print a list of AWS regions
     Called from CLI
 
+    Args:
+        refresh (bool): True/False. If true, ask the api (describe_regions) instead of reading the location map
     Return:
         bool: True
     """
-    for region in get_regions():
+    for region in (get_regions() if refresh or offline_store else region_locations.values()):
         print(region)
 
+# AWS location name -> region name
+region_locations = {
+    "AWS GovCloud (US)" : "us-gov-west-1",
+    "Asia Pacific (Mumbai)" : "ap-south-1",
+    "Asia Pacific (Osaka-Local)" : "ap-northeast-3",
+    "Asia Pacific (Seoul)" : "ap-northeast-2",
+    "Asia Pacific (Singapore)" : "ap-southeast-1",
+    "Asia Pacific (Sydney)" : "ap-southeast-2",
+    "Asia Pacific (Tokyo)" : "ap-northeast-1",
+    "Canada (Central)" : "ca-central-1",
+    "EU (Frankfurt)" : "eu-central-1",
+    "EU (Ireland)" : "eu-west-1",
+    "EU (London)" : "eu-west-2",
+    "EU (Paris)" : "eu-west-3",
+    "South America (Sao Paulo)" : "sa-east-1",
+    "US East (N. Virginia)" : "us-east-1",
+    "US East (Ohio)" : "us-east-2",
+    "US West (N. California)" : "us-west-1",
+    "US West (Oregon)" : "us-west-2"
+}
+
 @begin.subcommand()
 def loc_to_reg(location=None, region=None):
     """ Converts aws region name to location and vice versa. Provide location or region
@@ -121,25 +554,7 @@ def loc_to_reg(location=None, region=None):
         str: the corresponding region or location string name
 
     """
-    map = {
-        "AWS GovCloud (US)" : "us-gov-west-1",
-        "Asia Pacific (Mumbai)" : "ap-south-1",
-        "Asia Pacific (Osaka-Local)" : "ap-northeast-3",
-        "Asia Pacific (Seoul)" : "ap-northeast-2",
-        "Asia Pacific (Singapore)" : "ap-southeast-1",
-        "Asia Pacific (Sydney)" : "ap-southeast-2",
-        "Asia Pacific (Tokyo)" : "ap-northeast-1",
-        "Canada (Central)" : "ca-central-1",
-        "EU (Frankfurt)" : "eu-central-1",
-        "EU (Ireland)" : "eu-west-1",
-        "EU (London)" : "eu-west-2",
-        "EU (Paris)" : "eu-west-3",
-        "South America (Sao Paulo)" : "sa-east-1",
-        "US East (N. Virginia)" : "us-east-1",
-        "US East (Ohio)" : "us-east-2",
-        "US West (N. California)" : "us-west-1",
-        "US West (Oregon)" : "us-west-2"
-    }
+    map = region_locations
     if location:
         if location in map.keys():
             return map[location]
@@ -163,26 +578,24 @@ def get_operation_description(service, operation):
     Return:
         str : the description string for a Service / Operation
     """
-    pricing = boto3.client('pricing', region_name=region_name)
     location = loc_to_reg(region=region_name)
     instanceType = 't2.micro'
-    response = pricing.get_products(
-         ServiceCode = service,
-         Filters = [
+    products = iter_products(service, [
              {'Type' :'TERM_MATCH', 'Field':'operation', 'Value': operation},
              {'Type' :'TERM_MATCH', 'Field':'location',  'Value': location}
-         ],
-         MaxResults=100
-    )
-    if len(response['PriceList']) == 0:
-            raise Exception("query returned zero results")
-    for price in response['PriceList']:
-        jprice = json.loads(price)
+         ])
+    description = None
+    # Stop at the first usable description rather than reading every page
+    for jprice in products:
         for key in jprice['terms']['OnDemand'].keys():
             for key2 in jprice['terms']['OnDemand'][key]['priceDimensions'].keys():
                 description = jprice['terms']['OnDemand'][key]['priceDimensions'][key2]['description']
         if service == 'AmazonEC2' and 'On Demand' in description:
             break
+        if service == 'AmazonRDS' and 'running' in description:
+            break
+    if description is None:
+            raise Exception("query returned zero results")
     if service == 'AmazonRDS':
         if 'running' in description:
             description = description.split('running')[1].strip()
@@ -190,8 +603,25 @@ def get_operation_description(service, operation):
         if 'On Demand' in description:
             description = description.split('On Demand')[1].split('.')[0][:-3].strip()
     return description
+
+def _instance_operations(service):
+    """ Return the instance operations of a service (RunInstances* / CreateDBInstance:*) """
+    return [op for op in get_attr_vals(service, 'operation') if 'RunInstances' in op or 'CreateDBInstance:' in op]
+
+def get_operation_descriptions(service, operations):
+    """ Return the descriptions of several operations for a service, looked up concurrently
+    Called as a module
+
+    Args:
+        service (str): Valid AWS Service name
+        operations (list): Valid AWS Operation names
+    Return:
+        dict : operation -> description string, in the order of operations
+    """
+    descriptions = api_pool.map(get_operation_description, [(service, operation) for operation in operations])
+    return dict(zip(operations, descriptions))
 @begin.subcommand()
-def operations(service, operation=None, json_out=False):
+def operations(service, operation=None, json_out=False, refresh=False):
     """Prints the operating system name for AmazonEC2 or Amazon RDS operation(s)
     Called from CLI
 
@@ -199,45 +629,48 @@ def operations(service, operation=None, json_out=False):
         service (str): Valid AWS Service Name. ex. AmazonEC2
         operation (str): AWS operation name. default = None (returns all operations). ex. RunInstances
         json_out (bool): True/False. If true, printed output is json format.
+        refresh (bool): True/False. If true, ask the api even when the descriptions are in the metadata cache
     Return:
         bool: True
     """
+    cached = None if refresh or offline_store else _cached_descriptions(service)
+    known = cached['descriptions'] if cached else {}
     if operation == None:
-        operations = []
-        ops = get_attr_vals(service, 'operation')
-        for op in ops:
-            if 'RunInstances' in op or 'CreateDBInstance:' in op:
-                operations.append(op)
-    elif type(operation) == 'str':
+        operations = list(known) if cached and cached['complete'] else _instance_operations(service)
+    elif isinstance(operation, str):
         operations = [operation]
-    elif type(operation) == 'list':
+    elif isinstance(operation, list):
         operations = operation
-    output = {}
-    for operation in operations:
-        result = get_operation_description(service, operation)
-        output[operation] = result
-        if json_out == False:
+    missing = [op for op in operations if op not in known]
+    if missing:
+        # Only the descriptions fetched here are added to the cache
+        fetched = get_operation_descriptions(service, missing)
+        if not offline_store:
+            save_descriptions(service, fetched, complete=operation == None)
+        known = dict(known, **fetched)
+    output = {op: known[op] for op in operations}
+    if json_out == False:
+        for operation, result in output.items():
             print(f"{service} - {operation} : {result}")
     if json_out == True:
         print(json.dumps(output, indent=2))
 
-def get_pricing(service=None, instanceType=None, operation=None, region=None, \
-        LeaseContractLength='1yr', OfferingClass='standard', PurchaseOption='No Upfront'):
-    """ Returns a dict of AWS pricing values for a set of parms
-    Called as a module
+lease_contract_lengths = ['1yr', '3yr']
+offering_classes = ['standard', 'convertible']
+purchase_options = ['All Upfront', 'Partial Upfront', 'No Upfront']
+
+
+def _check_pricing_args(service, operation, region, LeaseContractLength, OfferingClass, PurchaseOption,
+        operations=None, regions=None):
+    """ Validate get_pricing arguments. Raises an Exception for the first invalid argument
 
     Args:
-        service (str) : AWS service name. options 'AmazonEC2'|'AmazonRDS.
-        instanceType (str) : Instance Type. e.x. 't2.micro' | 'db.t2.micro'
-        operation (str) :  Operation. e.x. 'RunInstances' | 'RunINstances:0002' | 'CreateDBInstance:0014'
-        region (str) : AWS region name. e.x 'us-east-1'
-        LeaseContractLength (str) : RI contract length. default = '1yr'. options '1yr'|'3yr'
-        OfferingClass (str) : RI offering class. default = 'standard'. options: 'standard'|'convertible'
-        PurchaseOption (str) : RI purchase option. default = 'No Upfront'. options: 'All Upfront'|'Partial Upfront'|'No Upfront'
-    Return
-        dict: dictionary of pricing parameters
+        operations (list): valid operations for the service. default = None (fetched with get_attr_vals)
+        regions (list): valid region names. default = None (fetched with get_regions)
+        other args as for get_pricing
+    Return:
+        str: the location name of the region
     """
-
     services = ['AmazonEC2', 'AmazonRDS']
     if service not in services:
         raise Exception(f"service: '{service}' invalid. Must be one of {services}")
@@ -246,43 +679,115 @@ def get_pricing(service=None, instanceType=None, operation=None, region=None, \
     #if instanceType not in instanceTypes:
     #    raise Exception(f"instanceType: '{instanceType}' invalid. Must be one of {instanceTypes}")
 
-    operations = get_attr_vals(service, 'operation')
+    if operations is None:
+        operations = get_attr_vals(service, 'operation')
     if operation not in operations:
         raise Exception(f"operation: '{operation}' invalid. Must be one of {operations}")
 
-    regions = get_regions()
+    if regions is None:
+        regions = get_regions()
     if region not in regions:
         raise Exception(f"region: '{region}' invalid. Must be one of {regions}")
     location = loc_to_reg(region=region)
 
-    LeaseContractLengths = ['1yr', '3yr']
-    if LeaseContractLength not in LeaseContractLengths:
-        raise Exception(f"LeaseContractLength: '{LeaseContractLengths}' invalid. Must be one of {LeaseContractLengths}")
+    if LeaseContractLength not in lease_contract_lengths:
+        raise Exception(f"LeaseContractLength: '{LeaseContractLength}' invalid. Must be one of {lease_contract_lengths}")
 
-    OfferingClasses = ['standard', 'convertible']
-    if OfferingClass not in OfferingClasses:
-        raise Exception(f"OfferingClass: '{OfferingClass}' invalid. Must be one of {OfferingClasses}")
+    if OfferingClass not in offering_classes:
+        raise Exception(f"OfferingClass: '{OfferingClass}' invalid. Must be one of {offering_classes}")
 
-    PurchaseOptions = ['All Upfront', 'Partial Upfront', 'No Upfront']
-    if PurchaseOption not in PurchaseOptions:
-        raise Exception(f"PurchaseOption: '{PurchaseOption}' invalid. Must be one of {PurchaseOptions}")
+    if PurchaseOption not in purchase_options:
+        raise Exception(f"PurchaseOption: '{PurchaseOption}' invalid. Must be one of {purchase_options}")
 
     if service == 'AmazonRDS' and OfferingClass != 'standard':
         raise Exception(f"service: {service} only supports OfferingClass: 'standard'. Not '{OfferingClass}'")
+    return location
 
-    pricing = boto3.client('pricing', region_name=region_name)
-    response = pricing.get_products(
-         ServiceCode = service,
-         Filters = [
+def _get_pricing_products(service, instanceType, operation, location):
+    """ Return the decoded price list products for one instanceType / operation / location
+
+    Return:
+        list: a list of price list product dicts, or of offline products with decoded records (see _iter_priced_products)
+    """
+    products = list(_iter_priced_products(service, [
              {'Type' :'TERM_MATCH', 'Field':'instanceType', 'Value': instanceType},
              {'Type' :'TERM_MATCH', 'Field':'operation', 'Value': operation},
              {'Type' :'TERM_MATCH', 'Field':'location',  'Value': location}
-         ],
-         MaxResults=100
-    )
-    if len(response['PriceList']) == 0:
+         ]))
+    if len(products) == 0:
         raise Exception(f"pricing query returned 0 results. service {service}, instanceType {instanceType}, operation {operation}, location {location}")
+    return products
+
+def _parse_pricing_products(products, **termAttributes):
+    """ Pull the product attributes, the OnDemand price and the Reserved terms out of a list of products
+
+    Args:
+        products (list): price list product dicts for one instanceType / operation / location. Products with
+            'records' (offline) use those PriceRecords instead of decoding their terms
+        termAttributes (str): only decode Reserved terms with these LeaseContractLength / OfferingClass / PurchaseOption.
+            default = every Reserved term
+    Return:
+        tuple: (attributes dict, OnDemand PriceRecord, dict of (LeaseContractLength, OfferingClass, PurchaseOption) -> Reserved PriceRecord)
+    """
+    attributes = {}
+    ondemand = None
+    reserved = {}
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+    start = time.perf_counter()
+    for jprice in products:
+        if debug:
+            logging.debug(json.dumps(jprice, indent=2, default=repr))
+        attributes.update(jprice['product']['attributes'])
+        usagetype = jprice['product']['attributes']['usagetype']
+        if 'Multi-AZUsage' in usagetype or 'Mirror' in usagetype:
+            # Multi-AZ is always double
+            continue
+        records = match_terms(jprice['records'], **termAttributes) if 'records' in jprice else decode_terms(jprice, **termAttributes)
+        for record in records:
+            if record.termType == 'OnDemand':
+                ondemand = record
+            else:
+                reserved[record.option] = record
+    if instrumentation is not None:
+        instrumentation.add_time('extract', time.perf_counter() - start)
+        instrumentation.count('products_extracted', len(products))
+    return attributes, ondemand, reserved
+
+def _reserved_result(ondemand, reserved):
+    """ Return a copy of a Reserved term dict with the RI discount and payback period added
+
+    Args:
+        ondemand (PriceRecord): the OnDemand price
+        reserved (PriceRecord): the Reserved price. None if there is no matching term
+    Return:
+        dict: Reserved price dict
+    """
+    result = reserved.to_dict() if reserved else {}
+    if ondemand is None or not ondemand.hr_price:
+        # No OnDemand hourly price to compare with
+        return result
+    if 'hr_price' in result.keys():
+        result['discount'] = round(
+            1 - (result['hr_price'] / ondemand.hr_price)
+            ,2) *100
+    if 'uf_price' in result.keys() and ondemand.hr_price > result.get('hr_price', 0):
+        # Calculate RI payback period
+        result['payback_mos'] = round(result['uf_price'] / ((ondemand.hr_price-result['hr_price'])*750),1)
+    return result
+
+def _cell_result(service, instanceType, operation, region, location, parsed, options):
+    """ Build a get_pricing_cells result dict, with every RI option in options, from the output of _parse_pricing_products """
+    result = _pricing_result(service, instanceType, operation, region, location, None, None, None, parsed)
+    for attr in ['OfferingClass', 'PurchaseOption', 'LeaseContractLength']:
+        del result['attributes'][attr]
+    ondemand, reserved = parsed[1], parsed[2]
+    result['Reserved'] = {option: _reserved_result(ondemand, reserved[option]) for option in options
+        if option in reserved and (service != 'AmazonRDS' or option[1] == 'standard')}
+    return result
 
+def _pricing_result(service, instanceType, operation, region, location, LeaseContractLength, OfferingClass, PurchaseOption, parsed):
+    """ Build the get_pricing result dict from the output of _parse_pricing_products """
+    attributes, ondemand, reserved = parsed
     result = {}
     result['attributes'] = {}
     result['attributes']['service']= service
@@ -293,56 +798,223 @@ def get_pricing(service=None, instanceType=None, operation=None, region=None, \
     result['attributes']['OfferingClass']= OfferingClass
     result['attributes']['PurchaseOption']= PurchaseOption
     result['attributes']['LeaseContractLength']= LeaseContractLength
-    for price in response['PriceList']:
-        jprice = json.loads(price)
-        #print(json.dumps(jprice, indent=2))
-        logging.debug(json.dumps(jprice, indent=2))
-        for attribute in jprice['product']['attributes']:
-            result['attributes'][attribute] = jprice['product']['attributes'][attribute]
-        usagetype = jprice['product']['attributes']['usagetype']
-        if 'Multi-AZUsage' in usagetype or 'Mirror' in usagetype:
-            # Multi-AZ is always double
-            continue
-        for term in jprice['terms']:
-            if term == 'Reserved':
-                for key in jprice['terms'][term].keys():
-                    if jprice['terms'][term][key]['termAttributes']['LeaseContractLength'] == LeaseContractLength and \
-                       jprice['terms'][term][key]['termAttributes']['OfferingClass'] == OfferingClass and \
-                       jprice['terms'][term][key]['termAttributes']['PurchaseOption'] == PurchaseOption :
-                        result[term] = {}
-                        for key2 in jprice['terms'][term][key]['priceDimensions'].keys():
-                            unit  = jprice['terms'][term][key]['priceDimensions'][key2]['unit']
-                            if unit == "Quantity":
-                                result[term]['uf_price'] = \
-                                    float(jprice['terms'][term][key]['priceDimensions'][key2]['pricePerUnit']['USD'])
-                            elif unit == "Hrs":
-                                result[term]['hr_price'] = \
-                                    float(jprice['terms'][term][key]['priceDimensions'][key2]['pricePerUnit']['USD'])
-                            descr = jprice['terms'][term][key]['priceDimensions'][key2]['description']
-                            result[term]['description'] = descr
-            elif term == 'OnDemand':
-                for key in jprice['terms'][term].keys():
-                    for key2 in jprice['terms'][term][key]['priceDimensions'].keys():
-                        descr = jprice['terms'][term][key]['priceDimensions'][key2]['description']
-                        if "per On Demand" in descr or "per RDS db" in descr:
-                            unit  = jprice['terms'][term][key]['priceDimensions'][key2]['unit']
-                            result[term] = {}
-                            result[term]['unit'] = unit
-                            result[term]['description'] = descr
-                            if unit == "Hrs":
-                                result[term]['hr_price'] = \
-                                    float(jprice['terms'][term][key]['priceDimensions'][key2]['pricePerUnit']['USD'])
-    if 'Reserved' not in result.keys():
-        result['Reserved'] = {}
-    elif 'hr_price' in result['Reserved'].keys():
-        result['Reserved']['discount'] = round(
-            1 - (result['Reserved']['hr_price'] / result['OnDemand']['hr_price'])
-            ,2) *100
-    if 'uf_price' in result['Reserved'].keys():
-        # Calculate RI payback period
-        result['Reserved']['payback_mos'] = round(result['Reserved']['uf_price'] / ((result['OnDemand']['hr_price']-result['Reserved']['hr_price'])*750),1)
+    result['attributes'].update(attributes)
+    if ondemand is not None:
+        result['OnDemand'] = ondemand.to_dict()
+    result['Reserved'] = _reserved_result(ondemand, reserved.get((LeaseContractLength, OfferingClass, PurchaseOption)))
     return result
 
+def get_pricing(service=None, instanceType=None, operation=None, region=None, \
+        LeaseContractLength='1yr', OfferingClass='standard', PurchaseOption='No Upfront'):
+    """ Returns a dict of AWS pricing values for a set of parms
+    Called as a module
+
+    Args:
+        service (str) : AWS service name. options 'AmazonEC2'|'AmazonRDS.
+        instanceType (str) : Instance Type. e.x. 't2.micro' | 'db.t2.micro'
+        operation (str) :  Operation. e.x. 'RunInstances' | 'RunINstances:0002' | 'CreateDBInstance:0014'
+        region (str) : AWS region name. e.x 'us-east-1'
+        LeaseContractLength (str) : RI contract length. default = '1yr'. options '1yr'|'3yr'
+        OfferingClass (str) : RI offering class. default = 'standard'. options: 'standard'|'convertible'
+        PurchaseOption (str) : RI purchase option. default = 'No Upfront'. options: 'All Upfront'|'Partial Upfront'|'No Upfront'
+    Return
+        dict: dictionary of pricing parameters
+    """
+    operations, regions = None, None
+    if service in ['AmazonEC2', 'AmazonRDS']:
+        # Fetch both validation lists at the same time
+        operations, regions = api_pool.map(lambda func, *args: func(*args), [(get_attr_vals, service, 'operation'), (get_regions,)])
+    location = _check_pricing_args(service, operation, region, LeaseContractLength, OfferingClass, PurchaseOption,
+        operations=operations, regions=regions)
+    products = _get_pricing_products(service, instanceType, operation, location)
+    return _pricing_result(service, instanceType, operation, region, location,
+        LeaseContractLength, OfferingClass, PurchaseOption, _parse_pricing_products(products,
+        LeaseContractLength=LeaseContractLength, OfferingClass=OfferingClass, PurchaseOption=PurchaseOption))
+
+def _resolve_pricing(requests, operations=None, regions=None):
+    """ Validate a list of get_pricing requests and fetch and parse the products of each distinct
+    service / instanceType / operation / location once
+
+    Args:
+        requests (list): a list of dicts of get_pricing keyword arguments
+        operations (dict): service -> valid operations, already fetched. default = None
+        regions (list): valid region names, already fetched. default = None
+    Return:
+        list: (args dict, location, parsed products) per request, or the Exception raised for that request
+    """
+    operations = dict(operations or {})
+    checked = []
+    for request in requests:
+        args = dict(service=None, instanceType=None, operation=None, region=None,
+            LeaseContractLength='1yr', OfferingClass='standard', PurchaseOption='No Upfront')
+        try:
+            if not isinstance(request, dict):
+                raise Exception(f"request: {request!r} invalid. Must be a dict of get_pricing arguments")
+            unknown = [name for name in request if name not in args]
+            if unknown:
+                raise Exception(f"request arguments: {unknown} invalid. Must be some of {list(args)}")
+            args.update(request)
+            if args['service'] in ['AmazonEC2', 'AmazonRDS'] and args['service'] not in operations:
+                operations[args['service']] = get_attr_vals(args['service'], 'operation')
+            if regions is None:
+                regions = get_regions()
+            location = _check_pricing_args(args['service'], args['operation'], args['region'], args['LeaseContractLength'],
+                args['OfferingClass'], args['PurchaseOption'], operations=operations.get(args['service']), regions=regions)
+            checked.append((args, location))
+        except Exception as e:
+            checked.append(e)
+    # Fetch and parse each distinct product key once, concurrently
+    keys = list(dict.fromkeys((args['service'], args['instanceType'], args['operation'], location)
+        for args, location in [c for c in checked if not isinstance(c, Exception)]))
+    parsed = dict(zip(keys, api_pool.map(lambda *key: _parse_pricing_products(_get_pricing_products(*key)),
+        keys, return_exceptions=True)))
+    resolved = []
+    for c in checked:
+        if not isinstance(c, Exception):
+            args, location = c
+            c = parsed[(args['service'], args['instanceType'], args['operation'], location)]
+            if not isinstance(c, Exception):
+                c = (args, location, c)
+        resolved.append(c)
+    return resolved
+
+def get_pricing_batch(requests, return_exceptions=False, operations=None, regions=None):
+    """ Returns a list of get_pricing results for a list of requests
+    Requests for the same service / instanceType / operation / region share one product query,
+    whatever their RI options, and the operation / region validation lists are fetched once
+    Called as a module
+
+    Args:
+        requests (list): a list of dicts of get_pricing keyword arguments
+            ex. [{'service': 'AmazonEC2', 'instanceType': 't2.micro', 'operation': 'RunInstances', 'region': 'us-east-1',
+                  'PurchaseOption': 'All Upfront'}, ...]
+        return_exceptions (bool): True/False. If true, a failed request returns its Exception in place of a result
+            instead of raising it. default = False
+        operations (dict): service -> valid operations (get_attr_vals(service, 'operation')), when the caller
+            already has them. default = None (fetched)
+        regions (list): valid region names (get_regions()), when the caller already has them. default = None (fetched)
+    Return:
+        list: a list of get_pricing result dicts in the order of requests
+    """
+    results = []
+    for resolved in _resolve_pricing(requests, operations=operations, regions=regions):
+        if isinstance(resolved, Exception):
+            if not return_exceptions:
+                raise resolved
+            results.append(resolved)
+        else:
+            args, location, parsed = resolved
+            results.append(_pricing_result(location=location, parsed=parsed, **args))
+    return results
+
+def get_pricing_cells(cells, LeaseContractLengths=lease_contract_lengths, OfferingClasses=offering_classes, \
+        PurchaseOptions=purchase_options, operations=None, regions=None):
+    """ Returns the OnDemand price and every RI option price for each service / region / instanceType / operation
+    Each distinct cell costs one product query, whatever the number of RI options
+    Called as a module
+
+    Args:
+        cells (list) : (service, region, instanceType, operation) tuples. e.x. [('AmazonEC2', 'us-east-1', 't2.micro', 'RunInstances')]
+        LeaseContractLengths (list) : RI contract lengths. default = all. options '1yr'|'3yr'
+        OfferingClasses (list) : RI offering classes. default = all. AmazonRDS only uses 'standard'. options: 'standard'|'convertible'
+        PurchaseOptions (list) : RI purchase options. default = all. options: 'All Upfront'|'Partial Upfront'|'No Upfront'
+        operations (dict): service -> valid operations, when the caller already has them. default = None (fetched)
+        regions (list): valid region names, when the caller already has them. default = None (fetched)
+    Return
+        dict: (service, region, instanceType, operation) -> {'attributes': dict, 'OnDemand': dict,
+            'Reserved': {(LeaseContractLength, OfferingClass, PurchaseOption): dict}}.
+            Cells that fail (ex. no products for the instanceType) are logged and left out
+    """
+    options = [(length, klass, option) for length in LeaseContractLengths for klass in OfferingClasses for option in PurchaseOptions]
+    for length, klass, option in options:
+        if length not in lease_contract_lengths or klass not in offering_classes or option not in purchase_options:
+            raise Exception(f"RI option: {(length, klass, option)} invalid. Must be in {lease_contract_lengths}, {offering_classes}, {purchase_options}")
+    cells = list(dict.fromkeys(cells))
+    requests = [dict(service=service, instanceType=instanceType, operation=operation, region=region)
+        for service, region, instanceType, operation in cells]
+    results = {}
+    for cell, resolved in zip(cells, _resolve_pricing(requests, operations=operations, regions=regions)):
+        if isinstance(resolved, Exception):
+            logging.info(f"{cell}: {resolved}")
+            continue
+        args, location, parsed = resolved
+        try:
+            results[cell] = _cell_result(args['service'], args['instanceType'], args['operation'], args['region'],
+                location, parsed, options)
+        except Exception as e:
+            logging.info(f"{cell}: {e}")
+    return results
+
+def get_pricing_region(service=None, operation=None, region=None, filters=None, operations=None, regions=None):
+    """ Returns the OnDemand price and every RI option price of every instanceType of a region / operation,
+    from one product query
+    Called as a module
+
+    Args:
+        service (str) : AWS service name. options 'AmazonEC2'|'AmazonRDS.
+        operation (str) :  Operation. e.x. 'RunInstances' | 'CreateDBInstance:0014'
+        region (str) : AWS region name. e.x 'us-east-1'
+        filters (list): more pricing api filters. e.x. [{'Type': 'TERM_MATCH', 'Field': 'tenancy', 'Value': 'Shared'}]. default = None
+        operations (list): valid operations for the service, when the caller already has them. default = None (fetched)
+        regions (list): valid region names, when the caller already has them. default = None (fetched)
+    Return
+        dict: instanceType -> {'attributes': dict, 'OnDemand': dict,
+            'Reserved': {(LeaseContractLength, OfferingClass, PurchaseOption): dict}}.
+            Instance types without an OnDemand price are left out
+    """
+    location = _check_pricing_args(service, operation, region, '1yr', 'standard', 'No Upfront',
+        operations=operations, regions=regions)
+    options = [(length, klass, option) for length in lease_contract_lengths for klass in offering_classes
+        for option in purchase_options]
+    # Products are parsed one at a time as they stream in, merged per instanceType as _parse_pricing_products does
+    parsed = {}
+    for jprice in _iter_priced_products(service, [
+            {'Type': 'TERM_MATCH', 'Field': 'operation', 'Value': operation},
+            {'Type': 'TERM_MATCH', 'Field': 'location', 'Value': location}] + list(filters or []), prefetch=True):
+        instanceType = jprice['product']['attributes'].get('instanceType')
+        if instanceType is None:
+            continue
+        attributes, ondemand, reserved = _parse_pricing_products([jprice])
+        merged = parsed.setdefault(instanceType, ({}, [None], {}))
+        merged[0].update(attributes)
+        merged[1][0] = ondemand or merged[1][0]
+        merged[2].update(reserved)
+    results = {}
+    for instanceType, (attributes, ondemand, reserved) in parsed.items():
+        if ondemand[0] is None:
+            continue
+        try:
+            results[instanceType] = _cell_result(service, instanceType, operation, region, location,
+                (attributes, ondemand[0], reserved), options)
+        except Exception as e:
+            logging.info(f"{instanceType}: {e}")
+    return results
+
+def get_pricing_matrix(service=None, instanceTypes=None, operations=None, regions=None, \
+        LeaseContractLengths=lease_contract_lengths, OfferingClasses=offering_classes, PurchaseOptions=purchase_options):
+    """ Returns the OnDemand price and every RI option price for each region / instanceType / operation
+    Each cell costs one product query, whatever the number of RI options
+    Called as a module
+
+    Args:
+        service (str) : AWS service name. options 'AmazonEC2'|'AmazonRDS.
+        instanceTypes (list) : Instance Types. e.x. ['t2.micro', 'c5.large']
+        operations (list) :  Operations. e.x. ['RunInstances', 'RunInstances:0002']
+        regions (list) : AWS region names. e.x ['us-east-1']
+        LeaseContractLengths (list) : RI contract lengths. default = all. options '1yr'|'3yr'
+        OfferingClasses (list) : RI offering classes. default = all. AmazonRDS only uses 'standard'. options: 'standard'|'convertible'
+        PurchaseOptions (list) : RI purchase options. default = all. options: 'All Upfront'|'Partial Upfront'|'No Upfront'
+    Return
+        dict: (region, instanceType, operation) -> {'attributes': dict, 'OnDemand': dict,
+            'Reserved': {(LeaseContractLength, OfferingClass, PurchaseOption): dict}}.
+            Cells that fail (ex. no products for the instanceType) are logged and left out
+    """
+    cells = [(service, region, instanceType, operation)
+        for region in regions for instanceType in instanceTypes for operation in operations]
+    results = get_pricing_cells(cells, LeaseContractLengths=LeaseContractLengths, OfferingClasses=OfferingClasses,
+        PurchaseOptions=PurchaseOptions)
+    return {cell[1:]: result for cell, result in results.items()}
+
 @begin.subcommand()
 def pricing(service=None, instanceType=None, operation=None, region=None, \
         LeaseContractLength='1yr', OfferingClass='standard', PurchaseOption='No Upfront', json_out=False):
@@ -395,7 +1067,75 @@ def pricing(service=None, instanceType=None, operation=None, region=None, \
         if 'payback_mos' in result['Reserved'].keys():
             print(f"RI Payback Period (mos): {result['Reserved']['payback_mos']}")
 
+@begin.subcommand()
+def instances(service='AmazonEC2', region=None, operation='RunInstances', by='vcpu', top=10, min_vcpu=None, \
+        min_memory=None, family=None, LeaseContractLength=None, OfferingClass='standard', PurchaseOption='No Upfront', \
+        json_out=False):
+    """ Prints the instance types of a region / operation with the lowest price per vCPU, GiB, ECU or instance hour
+    Called from CLI
+
+    Args:
+        service (str) : AWS service name. options 'AmazonEC2'|'AmazonRDS.
+        region (str) : AWS region name. e.x 'eu-west-1'
+        operation (str) :  Operation. default = 'RunInstances'
+        by (str): rank by $/hour per 'vcpu' | 'memory' | 'ecu', or by 'price'. default = 'vcpu'
+        top (int): how many to print. default = 10
+        min_vcpu (float): least vCPUs. default = None
+        min_memory (float): least memory GiB. default = None
+        family (str): instanceFamily. e.x. 'General purpose'. default = None (all)
+        LeaseContractLength (str) : rank by this RI option's effective hourly price. default = None (OnDemand)
+        OfferingClass (str) : RI offering class. default = 'standard'
+        PurchaseOption (str) : RI purchase option. default = 'No Upfront'
+        json_out (bool): Print output as json
+    Return:
+        bool: True
+    """
+    import instance_index
+    conditions = {}
+    if min_vcpu:
+        conditions['vcpu'] = (float(min_vcpu), None)
+    if min_memory:
+        conditions['memory'] = (float(min_memory), None)
+    if family:
+        conditions['instanceFamily'] = family
+    option = (LeaseContractLength, OfferingClass, PurchaseOption) if LeaseContractLength else None
+    rows = instance_index.get_index(service, region, operation).top(int(top), by=by, option=option, **conditions)
+    if json_out:
+        print(json.dumps(rows, indent=2))
+        return
+    for row in rows:
+        per_unit = f" ${row[f'hr_price_per_{by}']:.5f}/{by}-hr" if by != 'price' else ''
+        print(f"{row['instanceType']:16} ${row['hr_price']:.4f}/hr{per_unit}  vcpu: {row['vcpu']}, memory: {row['memory']} GiB, "
+            f"ecu: {row['ecu']}, network: {row['networkPerformance']}")
+
+@begin.subcommand()
+def serve(host='127.0.0.1', port=8080):
+    """ Serves pricing, attr_vals, loc_to_reg, operations and regions lookups as a local HTTP/JSON api
+    Called from CLI
+
+    Args:
+        host (str): address to listen on. default = '127.0.0.1'
+        port (int): port to listen on. default = 8080
+    Return:
+        bool: True
+    """
+    import pricing_server
+    server = pricing_server.make_server(host=host, port=int(port))
+    logging.info(f"serving pricing api on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
 @begin.start
 @begin.logging
-def run():
-    "Extracts pricing data from AWS"
+def run(offline=None, offline_db=None, concurrency=8, rate=10, profile=None, cache=None, stats_out=None):
+    "Extracts pricing data from AWS. --offline takes a comma separated list of bulk offer files to use instead of the api"
+    if stats_out:
+        use_instrumentation(stats_out)
+    if cache:
+        use_cache(cache)
+    set_concurrency(max_workers=int(concurrency), rate=float(rate))
+    configure_clients(profile=profile, max_pool_connections=max(10, int(concurrency)))
+    if offline or offline_db:
+        use_offline(*(offline.split(',') if offline else []), db=offline_db)
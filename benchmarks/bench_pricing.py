@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+""" Benchmark of the get_pricing hot paths against a stubbed pricing api
+
+The pricing and ec2 clients are replaced (aws_pricing.set_client) by a client that replays price
+list products, either generated or read from a bulk offer file, with an optional per call latency.
+Reports:
+    lookups/sec of get_pricing end to end
+    time spent in api calls vs json decoding vs term extraction (from aws_pricing instrumentation)
+    allocations per decoded and extracted product (tracemalloc)
+    get_pricing_matrix sweep time for the configured matrix size
+
+Usage:
+    ./benchmarks/bench_pricing.py [--types 20] [--operations 4] [--lookups 200] [--latency 0] [--rate 10000] [--workers 8]
+        [--offer index.json]
+        [--json results.json] [--baseline results.json] [--tolerance 0.2]
+"""
+import argparse, json, os, sys, time, tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import aws_pricing
+
+region = 'us-east-1'
+location = 'US East (N. Virginia)'
+# Same shape as a real AmazonEC2 product (see the README c5.large example)
+product_attributes = {
+    'enhancedNetworkingSupported': 'Yes', 'memory': '4 GiB', 'dedicatedEbsThroughput': 'Upto 2250 Mbps', 'vcpu': '2',
+    'capacitystatus': 'Used', 'locationType': 'AWS Region', 'storage': 'EBS only', 'instanceFamily': 'Compute optimized',
+    'physicalProcessor': 'Intel Xeon Platinum 8124M', 'clockSpeed': '3.0 Ghz', 'ecu': '9',
+    'networkPerformance': 'Up to 10 Gigabit', 'servicename': 'Amazon Elastic Compute Cloud', 'tenancy': 'Shared',
+    'normalizationSizeFactor': '4', 'processorFeatures': 'Intel AVX, Intel AVX2, Intel AVX512, Intel Turbo',
+    'servicecode': 'AmazonEC2', 'licenseModel': 'No License required', 'currentGeneration': 'Yes',
+    'preInstalledSw': 'NA', 'processorArchitecture': '64-bit', 'location': location,
+}
+
+
+def generate_products(types, operations):
+    """ Return generated price list products, one per instance type / operation, with every RI option """
+    products = []
+    for t in range(types):
+        instanceType = f"c{t // 8 + 1}.{['large', 'xlarge', '2xlarge', '4xlarge', '8xlarge', '9xlarge', '12xlarge', '18xlarge'][t % 8]}"
+        for o in range(operations):
+            operation = 'RunInstances' if o == 0 else f"RunInstances:{o:04d}"
+            sku = f"SKU{t:04d}{o:04d}"
+            price = 0.05 * (t + 1) * (o + 1)
+            terms = {'OnDemand': {f"{sku}.JRTCKXETXF": {'offerTermCode': 'JRTCKXETXF', 'sku': sku, 'termAttributes': {},
+                'priceDimensions': {f"{sku}.JRTCKXETXF.6YS6EN2CT7": {'unit': 'Hrs', 'pricePerUnit': {'USD': f"{price:.4f}"},
+                    'description': f"${price:.4f} per On Demand Linux {instanceType} Instance Hour"}}}}, 'Reserved': {}}
+            for length in aws_pricing.lease_contract_lengths:
+                for klass in aws_pricing.offering_classes:
+                    for option in aws_pricing.purchase_options:
+                        code = f"{length}{klass}{option}".replace(' ', '')
+                        dimensions = {f"{sku}.{code}.H": {'unit': 'Hrs', 'description': 'Linux/UNIX (Amazon VPC), reserved instance applied',
+                            'pricePerUnit': {'USD': f"{price * (0 if option == 'All Upfront' else 0.6):.4f}"}}}
+                        if option != 'No Upfront':
+                            dimensions[f"{sku}.{code}.U"] = {'unit': 'Quantity', 'description': 'Upfront Fee',
+                                'pricePerUnit': {'USD': f"{price * 3000:.2f}"}}
+                        terms['Reserved'][f"{sku}.{code}"] = {'offerTermCode': code, 'sku': sku, 'priceDimensions': dimensions,
+                            'termAttributes': {'LeaseContractLength': length, 'OfferingClass': klass, 'PurchaseOption': option}}
+            attributes = dict(product_attributes, instanceType=instanceType, operation=operation,
+                usagetype=f"BoxUsage:{instanceType}")
+            products.append({'product': {'sku': sku, 'productFamily': 'Compute Instance', 'attributes': attributes},
+                'serviceCode': 'AmazonEC2', 'terms': terms, 'version': 'bench', 'publicationDate': '2019-07-13T00:00:00Z'})
+    return products
+
+def offer_products(path):
+    """ Return the products of a bulk offer file """
+    from offer_store import OfferStore
+    store = OfferStore(path)
+    return store.get_products(store.get_services()[0], [])
+
+
+class ReplayClient(object):
+    """ Stub pricing / ec2 client answering from a list of price list products """
+
+    def __init__(self, products, latency=0.0):
+        self.latency = latency
+        self.products = [(p['product']['attributes'], json.dumps(p)) for p in products]
+        self.regions = sorted({aws_pricing.loc_to_reg(location=a['location']) for a, _ in self.products})
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_products(self, ServiceCode, Filters, MaxResults=100, NextToken=None):
+        self._wait()
+        matches = [price for attributes, price in self.products
+            if all(attributes.get(f['Field']) == f['Value'] for f in Filters)]
+        start = int(NextToken or 0)
+        response = {'PriceList': matches[start:start + MaxResults], 'FormatVersion': 'aws_v1'}
+        if start + MaxResults < len(matches):
+            response['NextToken'] = str(start + MaxResults)
+        return response
+
+    def get_attribute_values(self, ServiceCode, AttributeName, NextToken=None):
+        self._wait()
+        values = sorted({attributes[AttributeName] for attributes, _ in self.products if AttributeName in attributes})
+        return {'AttributeValues': [{'Value': value} for value in values]}
+
+    def describe_regions(self):
+        self._wait()
+        return {'Regions': [{'RegionName': name} for name in self.regions]}
+
+
+def bench_lookups(keys, lookups):
+    """ Return get_pricing lookups/sec and the instrumentation snapshot of the run """
+    stats = aws_pricing.use_instrumentation()
+    start = time.perf_counter()
+    for i in range(lookups):
+        instanceType, operation = keys[i % len(keys)]
+        aws_pricing.get_pricing(service='AmazonEC2', instanceType=instanceType, operation=operation, region=region)
+    elapsed = time.perf_counter() - start
+    aws_pricing.instrumentation = None
+    return lookups / elapsed, stats.snapshot()
+
+def bench_allocations(client):
+    """ Return the bytes and blocks allocated per product by decoding and by term extraction """
+    prices = [price for _, price in client.products]
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    products = [aws_pricing.loads(price) for price in prices]
+    decoded = tracemalloc.take_snapshot()
+    parsed = [aws_pricing._parse_pricing_products([product]) for product in products]
+    extracted = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    def per_product(new, old):
+        diff = new.compare_to(old, 'filename')
+        return (sum(stat.size_diff for stat in diff) / len(prices), sum(stat.count_diff for stat in diff) / len(prices))
+    decode_bytes, decode_blocks = per_product(decoded, before)
+    extract_bytes, extract_blocks = per_product(extracted, decoded)
+    del products, parsed
+    return {'decode_bytes': decode_bytes, 'decode_blocks': decode_blocks,
+        'extract_bytes': extract_bytes, 'extract_blocks': extract_blocks}
+
+def bench_matrix(keys):
+    """ Return the seconds to sweep the full matrix with get_pricing_matrix """
+    instanceTypes = sorted({key[0] for key in keys})
+    operations = sorted({key[1] for key in keys})
+    start = time.perf_counter()
+    aws_pricing.get_pricing_matrix(service='AmazonEC2', instanceTypes=instanceTypes, operations=operations, regions=[region])
+    return time.perf_counter() - start
+
+def compare(results, baseline, tolerance):
+    """ Return the metrics that regressed by more than tolerance against a baseline """
+    higher_is_better = {'lookups_per_sec'}
+    regressions = []
+    for name, value in results['metrics'].items():
+        old = baseline.get('metrics', {}).get(name)
+        if not old:
+            continue
+        change = (value - old) / old
+        if (name in higher_is_better and change < -tolerance) or (name not in higher_is_better and change > tolerance):
+            regressions.append(f"{name}: {old:.4g} -> {value:.4g} ({change:+.0%})")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--types', type=int, default=20, help='instance types in the generated fixture')
+    parser.add_argument('--operations', type=int, default=4, help='operations in the generated fixture')
+    parser.add_argument('--lookups', type=int, default=200, help='get_pricing calls to time')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to each stubbed api call')
+    parser.add_argument('--rate', type=float, default=10000, help='api calls/sec allowed by the rate limiter')
+    parser.add_argument('--workers', type=int, default=8, help='concurrent api calls of the matrix sweep')
+    parser.add_argument('--offer', help='replay the products of this bulk offer file instead of generated ones')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='compare with results written by an earlier --json run')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed regression against the baseline')
+    args = parser.parse_args()
+
+    products = offer_products(args.offer) if args.offer else generate_products(args.types, args.operations)
+    products = [p for p in products if p['product']['attributes'].get('location') == location
+        and 'instanceType' in p['product']['attributes']]
+    client = ReplayClient(products, latency=args.latency)
+    aws_pricing.set_concurrency(max_workers=args.workers, rate=args.rate)
+    aws_pricing.set_client(client, 'pricing')
+    aws_pricing.set_client(client, 'ec2')
+    keys = sorted({(a['instanceType'], a['operation']) for a, _ in client.products})
+
+    lookups_per_sec, stages = bench_lookups(keys, args.lookups)
+    allocations = bench_allocations(client)
+    matrix_seconds = bench_matrix(keys)
+    api_seconds = sum(t['seconds'] for name, t in stages['timings'].items() if name.startswith('api.'))
+    results = {
+        'config': vars(args),
+        'metrics': dict({
+            'lookups_per_sec': lookups_per_sec,
+            'api_seconds_per_lookup': api_seconds / args.lookups,
+            'decode_seconds_per_lookup': stages['timings'].get('decode', {}).get('seconds', 0) / args.lookups,
+            'extract_seconds_per_lookup': stages['timings'].get('extract', {}).get('seconds', 0) / args.lookups,
+            'matrix_seconds': matrix_seconds,
+        }, **allocations),
+        'stages': stages,
+    }
+    print(f"products: {len(client.products)}, matrix cells: {len(keys)}")
+    for name, value in results['metrics'].items():
+        print(f"{name:30} {value:14.6g}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+""" Benchmark of aws_pricing import time and metadata subcommand latency
+
+Each case is run in a fresh python process, so the timings include interpreter start up and imports.
+regions is answered from the location map. operations is answered from the metadata cache once it holds the
+operations (fill it first with ./aws_pricing.py metadata).
+
+Usage:
+    ./benchmarks/bench_startup.py [--repeat 10]
+"""
+import argparse, os, statistics, subprocess, sys, time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+cases = {
+    'python startup': [sys.executable, '-c', 'pass'],
+    'import aws_pricing': [sys.executable, '-c', 'import aws_pricing'],
+    'import aws_pricing + boto3': [sys.executable, '-c', 'import aws_pricing, boto3'],
+    'loc_to_reg': [sys.executable, 'aws_pricing.py', 'loc_to_reg', '--region', 'us-east-1'],
+    'regions (location map)': [sys.executable, 'aws_pricing.py', 'regions'],
+    'operations AmazonEC2 (metadata cache)': [sys.executable, 'aws_pricing.py', 'operations', 'AmazonEC2'],
+}
+
+
+def time_case(cmd, repeat):
+    """ Return the run times in ms of a command, run repeat times """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=root, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+    print(f"{'case':45} {'median ms':>10} {'min ms':>10}")
+    for name, cmd in cases.items():
+        try:
+            times = time_case(cmd, args.repeat)
+        except subprocess.CalledProcessError:
+            print(f"{name:45} {'failed':>10}")
+            continue
+        print(f"{name:45} {statistics.median(times):10.1f} {min(times):10.1f}")
@@ -19,43 +19,31 @@ for ri_offering in ri_offerings.keys():
         print(f",{ri_offerings[ri_offering]}_{ri_options[ri_option]}_hr", end='')
         print(f",{ri_offerings[ri_offering]}_{ri_options[ri_option]}_uf", end='' )
 print('')
+instance_types = [f"{klass}.{size}" for klass in classes for size in sizes]
 for region in regions:
-    for klass in classes:
-        for size in sizes:
-            instance_type = f"{klass}.{size}"
-            for operation in operations.keys():
-                try:
-                    pricing = aws_pricing.get_pricing(
-                            service=service,
-                            instanceType=instance_type,
-                            operation=operations[operation],
-                            region=region,
-                            )
-                    od_hr = pricing['OnDemand']['hr_price']
-                except:
-                    od_hr = None
-                print(f"{region},{instance_type}-{operation},{ri_duration},{od_hr}", end='')
-                for ri_offering in ri_offerings.keys():
-                    for ri_option in ri_options.keys():
-                        try:
-                            pricing = aws_pricing.get_pricing(
-                                    service=service,
-                                    instanceType=instance_type,
-                                    operation=operations[operation],
-                                    region=region,
-                                    LeaseContractLength=ri_duration,
-                                    OfferingClass=ri_offering,
-                                    PurchaseOption=ri_option
-                                    )
-                            od_hr = pricing['OnDemand']['hr_price']
-                            ri_hr = pricing['Reserved']['hr_price']
-                            if 'uf_price' in pricing['Reserved']: 
-                                ri_uf = pricing['Reserved']['uf_price']
-                            else:
-                                ri_uf = 0.0
-                        except:
-                            ri_hr = None
-                            ri_uf = None
-                        print(f",{ri_hr},{ri_uf}", end='')
-                print('')
-
+    # One product query per instance type / operation returns the OnDemand and every RI price
+    matrix = aws_pricing.get_pricing_matrix(
+            service=service,
+            instanceTypes=instance_types,
+            operations=list(operations.values()),
+            regions=[region],
+            LeaseContractLengths=[ri_duration],
+            OfferingClasses=list(ri_offerings.keys()),
+            PurchaseOptions=list(ri_options.keys()),
+            )
+    for instance_type in instance_types:
+        for operation in operations.keys():
+            pricing = matrix.get((region, instance_type, operations[operation]), {})
+            od_hr = pricing.get('OnDemand', {}).get('hr_price')
+            print(f"{region},{instance_type}-{operation},{ri_duration},{od_hr}", end='')
+            for ri_offering in ri_offerings.keys():
+                for ri_option in ri_options.keys():
+                    reserved = pricing.get('Reserved', {}).get((ri_duration, ri_offering, ri_option))
+                    if reserved and 'hr_price' in reserved:
+                        ri_hr = reserved['hr_price']
+                        ri_uf = reserved.get('uf_price', 0.0)
+                    else:
+                        ri_hr = None
+                        ri_uf = None
+                    print(f",{ri_hr},{ri_uf}", end='')
+            print('')
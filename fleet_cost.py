@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+""" Bulk cost estimate of an instance inventory
+
+The inventory is read in chunks of rows. The distinct service / region / instanceType / operation
+keys of a chunk that are not priced yet are resolved together with aws_pricing.get_pricing_cells
+(one product query per key, every RI option read from it), and kept in a price table of one row
+per key. Row costs are then computed for the whole chunk at once by indexing the price table,
+so memory is bounded by the chunk size and the number of distinct keys, not the inventory size.
+
+Inventory columns (csv header, or json lines keys):
+    instanceType, operation, region   required
+    service                           default 'AmazonEC2'
+    count                             instances. default 1
+    hours                             hours per month each instance runs. default price_matrix.month_hours (730)
+    LeaseContractLength, OfferingClass, PurchaseOption   the RI option the row is priced with. optional
+
+Each output row is the inventory row plus od_hr, od_monthly, od_annual, and when it has an RI option,
+ri_hr, ri_uf, ri_monthly, ri_annual (the RI effective hourly cost, see price_matrix.effective_hr, for every
+one of the month_hours of a month, whatever the hours the row runs). The totals give the
+OnDemand, the inventory RI option and every RI option cost of the whole fleet.
+
+Requires numpy
+
+Usage:
+    ./fleet_cost.py INVENTORY [OUTPUT] [--cache FILE] [--offline FILES | --offline-db FILE] [--chunk-size 10000]
+        [--hours 730] > totals.json
+    INVENTORY and OUTPUT are csv, or json lines if they end with .jsonl. Without OUTPUT only the totals are printed
+"""
+import argparse, csv, itertools, json, logging
+import aws_pricing
+from price_matrix import effective_hr, month_hours, term_months
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Columns added to each inventory row
+cost_columns = ['od_hr', 'od_monthly', 'od_annual', 'ri_hr', 'ri_uf', 'ri_monthly', 'ri_annual']
+options = [(length, klass, option) for length in aws_pricing.lease_contract_lengths
+    for klass in aws_pricing.offering_classes for option in aws_pricing.purchase_options]
+
+
+class PriceTable(object):
+    """ OnDemand and every RI option price of each service / region / instanceType / operation key, as numpy arrays
+    Called as a module
+
+    Example:
+        table = PriceTable()
+        indexes = table.lookup([('AmazonEC2', 'us-east-1', 't2.micro', 'RunInstances')])
+        table.od_hr[indexes], table.ri_hr[indexes, table.option_index[('1yr', 'standard', 'No Upfront')]]
+    """
+
+    def __init__(self):
+        if np is None:
+            raise Exception("fleet_cost requires numpy. pip install numpy")
+        self.keys = {}
+        self.option_index = {option: i for i, option in enumerate(options)}
+        self.months = np.array([term_months[length] for length, _, _ in options], dtype=float)
+        self.od_hr = np.empty(0)
+        self.ri_hr = np.empty((0, len(options)))
+        self.ri_uf = np.empty((0, len(options)))
+        self.validation = {}
+
+    def _validation_lists(self, services):
+        """ Fetch the region and operation lists once for all chunks """
+        if 'regions' not in self.validation:
+            self.validation['regions'] = aws_pricing.get_regions()
+            self.validation['operations'] = {}
+        for service in set(services) - set(self.validation['operations']):
+            if service in ['AmazonEC2', 'AmazonRDS']:
+                self.validation['operations'][service] = aws_pricing.get_attr_vals(service, 'operation')
+        return self.validation['operations'], self.validation['regions']
+
+    def lookup(self, keys):
+        """ Return the price table row of each key, pricing the keys not in the table yet
+
+        Args:
+            keys (list): (service, region, instanceType, operation) tuples
+        Returns:
+            numpy array: row index per key. Keys that could not be priced have NaN prices
+        """
+        new = [key for key in dict.fromkeys(keys) if key not in self.keys]
+        if new:
+            operations, regions = self._validation_lists([key[0] for key in new])
+            priced = aws_pricing.get_pricing_cells(new, operations=operations, regions=regions)
+            od_hr = np.full(len(new), np.nan)
+            ri_hr = np.full((len(new), len(options)), np.nan)
+            ri_uf = np.full((len(new), len(options)), np.nan)
+            for i, key in enumerate(new):
+                self.keys[key] = len(self.keys)
+                cell = priced.get(key)
+                if cell is None:
+                    logging.warning(f"no price for {key}")
+                    continue
+                od_hr[i] = cell.get('OnDemand', {}).get('hr_price', np.nan)
+                for option, reserved in cell['Reserved'].items():
+                    if 'hr_price' in reserved:
+                        ri_hr[i, self.option_index[option]] = reserved['hr_price']
+                        ri_uf[i, self.option_index[option]] = reserved.get('uf_price', 0.0)
+            self.od_hr = np.concatenate([self.od_hr, od_hr])
+            self.ri_hr = np.concatenate([self.ri_hr, ri_hr])
+            self.ri_uf = np.concatenate([self.ri_uf, ri_uf])
+        return np.array([self.keys[key] for key in keys], dtype=np.intp)
+
+
+def _number(value, default):
+    return default if value in (None, '') else float(value)
+
+def price_chunk(table, rows, default_hours=month_hours):
+    """ Add the cost columns to a chunk of inventory rows and return the chunk totals
+
+    Args:
+        table (PriceTable): the price table, extended with the chunk's new keys
+        rows (list): inventory row dicts
+        default_hours (float): hours per month of rows without an hours value. default = month_hours (730)
+    Returns:
+        dict: the chunk totals, see estimate
+    """
+    keys = [(row.get('service') or 'AmazonEC2', row['region'], row['instanceType'], row['operation']) for row in rows]
+    index = table.lookup(keys)
+    count = np.array([_number(row.get('count'), 1) for row in rows])
+    hours = np.array([_number(row.get('hours'), default_hours) for row in rows])
+    # The RI option of each row, -1 for rows without one
+    option = np.array([table.option_index.get((row.get('LeaseContractLength'), row.get('OfferingClass'),
+        row.get('PurchaseOption')), -1) for row in rows], dtype=np.intp)
+    has_option = option >= 0
+
+    od_hr = table.od_hr[index]
+    od_monthly = od_hr * hours * count
+    # Every RI option for every row: (rows, options) monthly cost. An RI is billed for every hour of the month,
+    # whatever the hours the instance runs
+    all_ri_monthly = effective_hr(table.ri_hr[index], table.ri_uf[index], table.months) * month_hours * count[:, None]
+    picked = np.where(has_option, option, 0)
+    ri_hr = np.where(has_option, table.ri_hr[index, picked], np.nan)
+    ri_uf = np.where(has_option, table.ri_uf[index, picked], np.nan)
+    ri_monthly = np.where(has_option, all_ri_monthly[np.arange(len(rows)), picked], np.nan)
+
+    columns = {'od_hr': od_hr, 'od_monthly': od_monthly, 'od_annual': od_monthly * 12,
+        'ri_hr': ri_hr, 'ri_uf': ri_uf, 'ri_monthly': ri_monthly, 'ri_annual': ri_monthly * 12}
+    for i, row in enumerate(rows):
+        for name in cost_columns:
+            value = columns[name][i]
+            row[name] = None if value != value else round(float(value), 6)
+    return {
+        'rows': len(rows),
+        'instances': float(count.sum()),
+        'unpriced_rows': int(np.isnan(od_hr).sum()),
+        'od_monthly': float(np.nansum(od_monthly)),
+        'ri_rows': int(has_option.sum()),
+        'ri_unpriced_rows': int((has_option & np.isnan(ri_monthly)).sum()),
+        'ri_monthly': float(np.nansum(ri_monthly)),
+        'options_monthly': np.nansum(all_ri_monthly, axis=0),
+        'options_unpriced_rows': np.isnan(all_ri_monthly).sum(axis=0),
+    }
+
+def read_inventory(path):
+    """ Yield the rows of a csv or json lines inventory file """
+    with open(path, newline='') as f:
+        if path.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+def estimate(rows, output=None, chunk_size=10000, default_hours=month_hours):
+    """ Price a stream of inventory rows and return the fleet totals
+    Called as a module
+
+    Args:
+        rows (iterable): inventory row dicts. See the module doc for the columns
+        output (callable): called with each priced chunk (a list of rows with the cost columns added). default = None
+        chunk_size (int): rows priced at once. default = 10000
+        default_hours (float): hours per month of rows without an hours value. default = month_hours (730)
+    Return:
+        dict: {'rows', 'instances', 'unpriced_rows', 'keys',
+            'OnDemand': {'monthly', 'annual'}, 'inventory': {'rows', 'unpriced_rows', 'monthly', 'annual'},
+            'Reserved': {'LeaseContractLength/OfferingClass/PurchaseOption': {'monthly', 'annual', 'unpriced_rows'}}}
+            'inventory' is the cost with each row's own RI option, 'Reserved' the cost if every row used that option
+    """
+    table = PriceTable()
+    totals = None
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            break
+        chunk_totals = price_chunk(table, chunk, default_hours=default_hours)
+        if totals is None:
+            totals = chunk_totals
+        else:
+            for name, value in chunk_totals.items():
+                totals[name] = totals[name] + value
+        if output:
+            output(chunk)
+    if totals is None:
+        totals = price_chunk(table, [], default_hours=default_hours)
+    return {
+        'rows': totals['rows'],
+        'instances': totals['instances'],
+        'unpriced_rows': totals['unpriced_rows'],
+        'keys': len(table.keys),
+        'OnDemand': {'monthly': round(totals['od_monthly'], 2), 'annual': round(totals['od_monthly'] * 12, 2)},
+        'inventory': {'rows': totals['ri_rows'], 'unpriced_rows': totals['ri_unpriced_rows'],
+            'monthly': round(totals['ri_monthly'], 2), 'annual': round(totals['ri_monthly'] * 12, 2)},
+        'Reserved': {'/'.join(option): {'monthly': round(float(monthly), 2), 'annual': round(float(monthly) * 12, 2),
+            'unpriced_rows': int(unpriced)}
+            for option, monthly, unpriced in zip(options, totals['options_monthly'], totals['options_unpriced_rows'])},
+    }
+
+
+class RowWriter(object):
+    """ Writes priced chunks to a csv or json lines file. Passed to estimate as its output """
+
+    def __init__(self, f, jsonl=False):
+        self.f = f
+        self.jsonl = jsonl
+        self.writer = None
+
+    def __call__(self, chunk):
+        if self.jsonl:
+            self.f.writelines(json.dumps(row) + '\n' for row in chunk)
+            return
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.f, fieldnames=list(chunk[0].keys()), extrasaction='ignore')
+            self.writer.writeheader()
+        self.writer.writerows(chunk)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('inventory', help='inventory file, csv or .jsonl')
+    parser.add_argument('output', nargs='?', help='priced rows file, csv or .jsonl. default = None (only the totals)')
+    parser.add_argument('--chunk-size', type=int, default=10000, help='rows priced at once')
+    parser.add_argument('--hours', type=float, default=month_hours, help='hours per month of rows without an hours value')
+    parser.add_argument('--cache', help='response cache file')
+    parser.add_argument('--offline', help='comma separated bulk offer files to use instead of the api')
+    parser.add_argument('--offline-db', help='SQLite offer store to use instead of the api')
+    parser.add_argument('--loglvl', default='WARNING')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglvl)
+    if args.cache:
+        aws_pricing.use_cache(args.cache)
+    if args.offline or args.offline_db:
+        aws_pricing.use_offline(*(args.offline.split(',') if args.offline else []), db=args.offline_db)
+    if args.output:
+        with open(args.output, 'w', newline='') as out:
+            totals = estimate(read_inventory(args.inventory), output=RowWriter(out, jsonl=args.output.endswith('.jsonl')),
+                chunk_size=args.chunk_size, default_hours=args.hours)
+    else:
+        totals = estimate(read_inventory(args.inventory), chunk_size=args.chunk_size, default_hours=args.hours)
+    print(json.dumps(totals, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+""" In memory index of the numeric instance attributes and prices of a region / operation
+
+The products of every instance type of a region / operation are fetched with one query
+(aws_pricing.get_pricing_region), and the vcpu, memory, ecu, normalizationSizeFactor and
+networkPerformance attribute strings are parsed into numpy columns once. Range queries and
+price-performance rankings are then vector operations over those columns, with no api calls.
+
+Requires numpy
+
+Example:
+    import instance_index
+    index = instance_index.get_index('AmazonEC2', 'eu-west-1', 'RunInstances:0010')
+    index.top(5, by='vcpu', vcpu=(8, None), memory=(32, None))
+"""
+import math, re
+import aws_pricing
+from price_matrix import effective_hr, term_months
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# networkPerformance values without a bandwidth, slowest first
+network_tiers = ['Very Low', 'Low', 'Low to Moderate', 'Moderate', 'High']
+# Parsed numeric columns. network_gbps is NaN for the named tiers, network_tier orders every value
+numeric_columns = ['vcpu', 'memory', 'ecu', 'normalizationSizeFactor', 'network_gbps', 'network_tier']
+# Values ranked by: 'price' is $/hour, 'vcpu' $/vCPU-hour, 'memory' $/GiB-hour, 'ecu' $/ECU-hour
+rank_by = ['price', 'vcpu', 'memory', 'ecu']
+# Instance products priced by default, so each instance type gets its shared tenancy, on demand capacity price
+default_filters = {
+    'AmazonEC2': [{'Type': 'TERM_MATCH', 'Field': 'tenancy', 'Value': 'Shared'},
+                  {'Type': 'TERM_MATCH', 'Field': 'capacitystatus', 'Value': 'Used'}],
+}
+# (service, region, operation) -> InstanceIndex (see get_index)
+indexes = {}
+
+
+def parse_number(value):
+    """ Return the number at the start of an attribute string, or NaN. ex. '1,952 GiB' -> 1952.0, 'Variable' -> nan """
+    match = re.match(r'\s*([\d,]*\.?\d+)', value or '')
+    return float(match.group(1).replace(',', '')) if match else math.nan
+
+def parse_memory(value):
+    """ Return a memory attribute string in GiB, or NaN. ex. '15.25 GiB' -> 15.25, '512 MiB' -> 0.5 """
+    number = parse_number(value)
+    return number / 1024 if 'MiB' in (value or '') else number
+
+def parse_network(value):
+    """ Return (network_tier, network_gbps) of a networkPerformance string
+    Named tiers rank 0-4 with no bandwidth. 'N Gigabit' ranks 5 + N and 'Up to N Gigabit' just below it
+
+    Args:
+        value (str): ex. 'Moderate' | 'Up to 10 Gigabit' | '25 Gigabit'
+    Returns:
+        tuple: (float, float). (nan, nan) for unknown values
+    """
+    if value in network_tiers:
+        return float(network_tiers.index(value)), math.nan
+    match = re.match(r'\s*(Up to )?([\d.]+) Gigabit', value or '')
+    if not match:
+        return math.nan, math.nan
+    gbps = float(match.group(2))
+    return len(network_tiers) + gbps - (0.5 if match.group(1) else 0), gbps
+
+
+class InstanceIndex(object):
+    """ Numeric attribute and price columns of every instance type of a region / operation
+    Called as a module
+
+    Example:
+        index = InstanceIndex(aws_pricing.get_pricing_region('AmazonEC2', 'RunInstances', 'us-east-1'))
+        index.query(vcpu=(8, None), memory=(32, 64), instanceFamily='General purpose')
+        index.top(10, by='memory', option=('1yr', 'standard', 'No Upfront'))
+    """
+
+    def __init__(self, results):
+        """
+        Args:
+            results (dict): instanceType -> price dict, as returned by aws_pricing.get_pricing_region
+        """
+        if np is None:
+            raise Exception("instance_index requires numpy. pip install numpy")
+        self.instanceTypes = np.array(sorted(results), dtype=object)
+        attributes = [results[instanceType]['attributes'] for instanceType in self.instanceTypes]
+        self.attributes = {name: np.array([a.get(name) for a in attributes], dtype=object)
+            for name in ['instanceFamily', 'currentGeneration', 'physicalProcessor', 'processorArchitecture',
+                'networkPerformance', 'storage']}
+        network = [parse_network(a.get('networkPerformance')) for a in attributes]
+        self.columns = {
+            'vcpu': np.array([parse_number(a.get('vcpu')) for a in attributes]),
+            'memory': np.array([parse_memory(a.get('memory')) for a in attributes]),
+            'ecu': np.array([parse_number(a.get('ecu')) for a in attributes]),
+            'normalizationSizeFactor': np.array([parse_number(a.get('normalizationSizeFactor')) for a in attributes]),
+            'network_tier': np.array([tier for tier, _ in network]),
+            'network_gbps': np.array([gbps for _, gbps in network]),
+        }
+        self.od_hr = np.array([results[t]['OnDemand']['hr_price'] for t in self.instanceTypes])
+        # RI option -> (hourly price, upfront price) columns
+        self.reserved = {}
+        for i, instanceType in enumerate(self.instanceTypes):
+            for option, reserved in results[instanceType]['Reserved'].items():
+                if 'hr_price' not in reserved:
+                    continue
+                hr, uf = self.reserved.setdefault(option, (np.full(len(self), np.nan), np.full(len(self), np.nan)))
+                hr[i] = reserved['hr_price']
+                uf[i] = reserved.get('uf_price', 0.0)
+
+    def __len__(self):
+        return len(self.instanceTypes)
+
+    def price(self, option=None):
+        """ Return the hourly price column
+
+        Args:
+            option (tuple): (LeaseContractLength, OfferingClass, PurchaseOption) for the RI effective hourly price,
+                the upfront amortized over the hours of the term (see price_matrix.effective_hr). default = None (OnDemand)
+        Returns:
+            numpy array: $/hour per instance type, NaN where there is no price
+        """
+        if option is None:
+            return self.od_hr
+        if tuple(option) not in self.reserved:
+            return np.full(len(self), np.nan)
+        hr, uf = self.reserved[tuple(option)]
+        return effective_hr(hr, uf, term_months[option[0]])
+
+    def mask(self, **conditions):
+        """ Return the boolean mask of the instance types matching every condition
+
+        Args:
+            conditions: numeric column name -> (min, max) range, either end None for open. ex. vcpu=(8, None)
+                or attribute name -> value or list of values. ex. instanceFamily='General purpose'
+        Returns:
+            numpy array: bool per instance type
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for name, condition in conditions.items():
+            if name in self.columns:
+                low, high = condition
+                column = self.columns[name]
+                if low is not None:
+                    mask &= column >= low
+                if high is not None:
+                    mask &= column <= high
+            elif name in self.attributes:
+                values = condition if isinstance(condition, (list, tuple, set)) else [condition]
+                mask &= np.isin(self.attributes[name], list(values))
+            else:
+                raise Exception(f"condition: '{name}' invalid. Must be one of {numeric_columns + list(self.attributes)}")
+        return mask
+
+    def _rows(self, indexes, price, value=None, by=None):
+        rows = []
+        for i in indexes:
+            row = {'instanceType': self.instanceTypes[i], 'hr_price': float(price[i])}
+            if by and by != 'price':
+                row[f"hr_price_per_{by}"] = float(value[i])
+            row.update({name: None if math.isnan(column[i]) else float(column[i]) for name, column in self.columns.items()})
+            row.update({name: column[i] for name, column in self.attributes.items()})
+            rows.append(row)
+        return rows
+
+    def query(self, option=None, **conditions):
+        """ Return the instance types matching every condition, cheapest first
+        Called as a module
+
+        Args:
+            option (tuple): RI option to price with. default = None (OnDemand)
+            conditions: see mask
+        Returns:
+            list: a dict per instance type with its price, numeric columns and attributes
+        """
+        price = self.price(option)
+        indexes = np.flatnonzero(self.mask(**conditions) & ~np.isnan(price))
+        return self._rows(indexes[np.argsort(price[indexes], kind='stable')], price)
+
+    def top(self, k=10, by='vcpu', option=None, **conditions):
+        """ Return the k instance types with the lowest price per unit, among those matching every condition
+        Called as a module
+
+        Args:
+            k (int): how many to return. default = 10
+            by (str): 'price' ($/hour) | 'vcpu' ($/vCPU-hour) | 'memory' ($/GiB-hour) | 'ecu' ($/ECU-hour). default = 'vcpu'
+            option (tuple): RI option to price with. default = None (OnDemand)
+            conditions: see mask
+        Returns:
+            list: a dict per instance type, best first, with 'hr_price_per_<by>' added
+        """
+        if by not in rank_by:
+            raise Exception(f"by: '{by}' invalid. Must be one of {rank_by}")
+        price = self.price(option)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            value = price if by == 'price' else price / self.columns[by]
+        value = np.where(self.columns[by] > 0, value, np.nan) if by != 'price' else value
+        indexes = np.flatnonzero(self.mask(**conditions) & ~np.isnan(value))
+        if k < len(indexes):
+            indexes = indexes[np.argpartition(value[indexes], k)[:k]]
+        return self._rows(indexes[np.argsort(value[indexes], kind='stable')], price, value, by)
+
+
+def get_index(service, region, operation, filters=None, refresh=False):
+    """ Return the index of a region / operation, building it on first use
+    Called as a module
+
+    Args:
+        service (str): AWS service name. options 'AmazonEC2'|'AmazonRDS'
+        region (str): AWS region name. e.x 'eu-west-1'
+        operation (str): Operation. e.x. 'RunInstances:0010'
+        filters (list): pricing api filters selecting one product per instance type.
+            default = None (default_filters of the service)
+        refresh (bool): True/False. If true, rebuild the index. default = False
+    Returns:
+        InstanceIndex: the index
+    """
+    key = (service, region, operation)
+    if refresh or key not in indexes:
+        results = aws_pricing.get_pricing_region(service=service, operation=operation, region=region,
+            filters=default_filters.get(service, []) if filters is None else filters)
+        indexes[key] = InstanceIndex(results)
+    return indexes[key]
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+""" Opt in counters and timings for the pricing hot paths
+
+aws_pricing records each api call (per method), product decoding and term extraction in the
+Instrumentation set with aws_pricing.use_instrumentation. When none is set the hooks cost one
+None check, so this is cheap enough to leave on in production.
+"""
+import json, threading, time
+from contextlib import contextmanager
+
+
+class Instrumentation(object):
+    """ Thread safe counters and timings
+    Called as a module
+
+    Example:
+        stats = Instrumentation()
+        with stats.timer('api.get_products'):
+            response = client.get_products(...)
+        stats.count('products', len(response['PriceList']))
+        print(stats.to_json())
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Zero every counter and timing """
+        with self.lock:
+            self.counters = {}
+            self.timings = {}
+            self.started = time.time()
+
+    def count(self, name, n=1):
+        """ Add n to a counter
+
+        Args:
+            name (str): counter name. ex. 'products'
+            n (int): amount to add. default = 1
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_time(self, name, seconds):
+        """ Record one timed call of a stage
+
+        Args:
+            name (str): stage name. ex. 'api.get_products'
+            seconds (float): duration
+        """
+        with self.lock:
+            timing = self.timings.setdefault(name, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            timing['calls'] += 1
+            timing['seconds'] += seconds
+            timing['max_seconds'] = max(timing['max_seconds'], seconds)
+
+    @contextmanager
+    def timer(self, name):
+        """ Context manager timing the enclosed block as one call of a stage
+
+        Args:
+            name (str): stage name
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def snapshot(self):
+        """ Return the counters and timings
+
+        Returns:
+            dict: {'elapsed_seconds': float, 'counters': {name: int}, 'timings': {name: {'calls', 'seconds', 'max_seconds'}}}
+        """
+        with self.lock:
+            return {
+                'elapsed_seconds': time.time() - self.started,
+                'counters': dict(self.counters),
+                'timings': {name: dict(timing) for name, timing in self.timings.items()},
+            }
+
+    def to_json(self):
+        """ Return the snapshot as a json string """
+        return json.dumps(self.snapshot(), indent=2, sort_keys=True)
+
+    def export(self, path):
+        """ Write the snapshot as json to a file
+
+        Args:
+            path (str): output file
+        """
+        with open(path, 'w') as f:
+            f.write(self.to_json())
@@ -0,0 +1,533 @@
+#!/usr/bin/env python3
+""" Local store for the AWS bulk price list offer files
+
+The bulk offer files (https://pricing.us-east-1.amazonaws.com/offers/v1.0/aws/<service>/current/index.json
+or index.csv) contain every product and term for a service. Once loaded, the store answers
+the same queries as the pricing api get_products / get_attribute_values calls and returns
+products in the same shape as the decoded PriceList entries of the api.
+
+Offer files are streamed into the store in batches of products and terms, so loading one does not
+hold the whole offer in memory. Products are kept in a SQLite database (in memory by default, or a file
+so it persists between runs).
+The attributes get_pricing filters on have their own indexed columns, every other attribute is
+indexed in a name/value table, and the Reserved/OnDemand terms are decoded once, when an offer is
+loaded, to one row per term. Pricing lookups (get_priced_products) read the attribute and term rows
+back as PriceRecords, so they are index probes with no product documents to decode.
+"""
+import csv, itertools, json, logging, sqlite3, threading
+from price_record import PriceRecord, decode_terms, loads
+
+# CSV offer files use display names for the product attribute columns. Most of them
+# camel case to the api attribute name, these are the exceptions
+csv_attr_names = {
+    'vCPU': 'vcpu',
+    'ECU': 'ecu',
+    'usageType': 'usagetype',
+    'CapacityStatus': 'capacitystatus',
+    'serviceCode': 'servicecode',
+    'serviceName': 'servicename',
+    'Instance SKU': 'instancesku',
+    'Pre Installed S/W': 'preInstalledSw',
+}
+# CSV columns that describe the term/price dimension rather than the product
+csv_term_cols = ['SKU', 'OfferTermCode', 'RateCode', 'TermType', 'PriceDescription', 'EffectiveDate',
+    'StartingRange', 'EndingRange', 'Unit', 'PricePerUnit', 'Currency', 'LeaseContractLength',
+    'PurchaseOption', 'OfferingClass', 'Product Family']
+csv_term_attrs = ['LeaseContractLength', 'PurchaseOption', 'OfferingClass']
+# Product attributes with their own indexed column in the products table
+indexed_attrs = ['instanceType', 'operation', 'location', 'usagetype', 'tenancy', 'capacitystatus']
+# Products (or skus' terms) written to the store at once while an offer file is loaded
+batch_size = 5000
+
+schema = f"""
+CREATE TABLE IF NOT EXISTS offers (
+    service TEXT PRIMARY KEY, version TEXT, publicationDate TEXT);
+CREATE TABLE IF NOT EXISTS products (
+    service TEXT, sku TEXT, {', '.join(f'{attr} TEXT' for attr in indexed_attrs)}, doc TEXT,
+    PRIMARY KEY (service, sku));
+CREATE INDEX IF NOT EXISTS products_lookup ON products (service, instanceType, operation, location);
+{''.join(f'CREATE INDEX IF NOT EXISTS products_{attr} ON products (service, {attr});' for attr in indexed_attrs)}
+CREATE TABLE IF NOT EXISTS attrs (
+    service TEXT, sku TEXT, name TEXT, value TEXT);
+CREATE INDEX IF NOT EXISTS attrs_lookup ON attrs (service, name, value);
+CREATE INDEX IF NOT EXISTS attrs_sku ON attrs (service, sku);
+CREATE TABLE IF NOT EXISTS terms (
+    service TEXT, sku TEXT, termType TEXT, offerTermCode TEXT,
+    LeaseContractLength TEXT, OfferingClass TEXT, PurchaseOption TEXT,
+    unit TEXT, description TEXT, hr_price REAL, uf_price REAL);
+CREATE INDEX IF NOT EXISTS terms_sku ON terms (service, sku);
+CREATE TABLE IF NOT EXISTS term_docs (
+    service TEXT, sku TEXT, termType TEXT, doc TEXT);
+CREATE INDEX IF NOT EXISTS term_docs_sku ON term_docs (service, sku);
+"""
+# Staging table of the price dimension rows of a csv offer, read back in sku order to build the terms
+csv_schema = """
+CREATE TEMP TABLE IF NOT EXISTS csv_dimensions (
+    sku TEXT, termType TEXT, offerTermCode TEXT, effectiveDate TEXT,
+    LeaseContractLength TEXT, PurchaseOption TEXT, OfferingClass TEXT,
+    rateCode TEXT, description TEXT, beginRange TEXT, endRange TEXT, unit TEXT, currency TEXT, price TEXT);
+"""
+
+
+def csv_attr_name(col):
+    """ Convert a CSV offer file column name to the pricing api attribute name
+    ex. 'Instance Type' -> 'instanceType', 'Dedicated EBS Throughput' -> 'dedicatedEbsThroughput'
+
+    Args:
+        col (str): CSV column header
+    Returns:
+        str: api attribute name
+    """
+    if col in csv_attr_names:
+        return csv_attr_names[col]
+    words = col.split()
+    return words[0].lower() + ''.join(word.capitalize() for word in words[1:])
+
+
+def flatten_terms(service, sku, terms):
+    """ Flatten the terms of a price list product to one row per term, decoded as get_pricing decodes them
+    (see price_record.decode_terms)
+
+    Args:
+        service (str): AWS service name
+        sku (str): product sku
+        terms (dict): the 'terms' dict of a price list product
+    Returns:
+        list: a list of tuples matching the columns of the terms table
+    """
+    rows = []
+    for term_type in ['OnDemand', 'Reserved']:
+        for code, term in terms.get(term_type, {}).items():
+            for record in decode_terms({'product': {'sku': sku}, 'terms': {term_type: {code: term}}}):
+                rows.append((service, sku, term_type, term.get('offerTermCode'), record.LeaseContractLength,
+                    record.OfferingClass, record.PurchaseOption, record.unit, record.description,
+                    record.hr_price, record.uf_price))
+    return rows
+
+
+def batches(items, size=batch_size):
+    """ Yield lists of up to size items from an iterable """
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+class JsonStream(object):
+    """ Incremental reader of a json file, decoding one value at a time from a buffered window of the file """
+
+    def __init__(self, f, chunk_size=1 << 20):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        """ Append the next chunk of the file to the unread part of the buffer. Returns False at the end of the file """
+        chunk = self.f.read(self.chunk_size)
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return bool(chunk)
+
+    def peek(self):
+        """ Return the next non whitespace character, without consuming it. '' at the end of the file """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, chars):
+        """ Consume and return the next character, which must be one of chars """
+        char = self.peek()
+        if not char or char not in chars:
+            raise Exception(f"invalid offer json: expected one of {chars!r}, got {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """ Decode and return the next json value """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # The value runs past the buffer
+                if not self._fill():
+                    raise
+                continue
+            if end == len(self.buf) and isinstance(value, (int, float)) and self._fill():
+                # A number may go on in the next chunk
+                continue
+            self.pos = end
+            return value
+
+    def keys(self):
+        """ Yield the keys of the next json object. The caller reads each key's value before the next key """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+
+def iter_json_offer(f, chunk_size=1 << 20):
+    """ Yield the parts of a bulk offer index.json file one at a time, without loading the whole file
+
+    Args:
+        f (file): the open offer file
+        chunk_size (int): characters read from the file at once. default = 1M
+    Yields:
+        tuple: ('offer', field, value) for the top level fields (offerCode, version, ...),
+            ('products', sku, product entry) and ('terms', (termType, sku), {offerTermCode: term})
+    """
+    stream = JsonStream(f, chunk_size)
+    for key in stream.keys():
+        if key == 'products':
+            for sku in stream.keys():
+                yield 'products', sku, stream.value()
+        elif key == 'terms':
+            for term_type in stream.keys():
+                for sku in stream.keys():
+                    yield 'terms', (term_type, sku), stream.value()
+        else:
+            yield 'offer', key, stream.value()
+
+
+class OfferStore(object):
+    """ Indexed store of the products and terms from one or more bulk offer files
+    Called as a module
+
+    Example:
+        store = OfferStore(db='offers.db')
+        store.load('AmazonEC2.json')
+        store.get_products('AmazonEC2', [{'Type': 'TERM_MATCH', 'Field': 'instanceType', 'Value': 't2.micro'}])
+    """
+
+    def __init__(self, *paths, db=':memory:'):
+        """
+        Args:
+            paths (str): optional offer files (.json or .csv) to load
+            db (str): SQLite database file. default = ':memory:'. A file keeps the loaded offers between runs
+        """
+        self.db = sqlite3.connect(db, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.db:
+            self.db.executescript(schema)
+        for path in paths:
+            self.load(path)
+
+    @property
+    def versions(self):
+        """ dict: service -> version of the loaded offer """
+        with self.lock:
+            return dict(self.db.execute("SELECT service, version FROM offers"))
+
+    def load(self, path):
+        """ Load a bulk offer file. The format is chosen by the file extension
+
+        Args:
+            path (str): path to an offer index.json or index.csv file
+        Return:
+            str: the service code of the offer (ex. 'AmazonEC2')
+        """
+        if path.endswith('.csv'):
+            return self.load_csv(path)
+        return self.load_json(path)
+
+    def load_json(self, path):
+        """ Load a bulk offer index.json file, streaming its products and terms into the store in batches
+
+        Args:
+            path (str): path to the offer file
+        Return:
+            str: the service code of the offer
+        """
+        offer, products, terms, count = {}, [], [], 0
+        service = None
+        with open(path) as f, self.lock, self.db:
+            for section, key, value in iter_json_offer(f):
+                if section == 'offer':
+                    offer[key] = value
+                    continue
+                if service is None:
+                    # The offer fields come before the products and terms in the offer files
+                    if 'offerCode' not in offer:
+                        raise Exception(f"{path}: offerCode must come before the products and terms")
+                    service = offer['offerCode']
+                    self._replace_offer(service, offer.get('version'), offer.get('publicationDate'))
+                if section == 'products':
+                    products.append(value)
+                    count += 1
+                else:
+                    terms.append((key[1], key[0], value))
+                if len(products) >= batch_size:
+                    self._insert_products(service, products, offer.get('version'), offer.get('publicationDate'))
+                    products = []
+                if len(terms) >= batch_size:
+                    self._insert_terms(service, terms)
+                    terms = []
+            if service is None:
+                service = offer['offerCode']
+                self._replace_offer(service, offer.get('version'), offer.get('publicationDate'))
+            self._insert_products(service, products, offer.get('version'), offer.get('publicationDate'))
+            self._insert_terms(service, terms)
+        logging.info(f"loaded {count} {service} products from {path}")
+        return service
+
+    def load_csv(self, path):
+        """ Load a bulk offer index.csv file. Each row is one price dimension of one term.
+        Products are written in batches as they are read, and the price dimensions are staged in a temporary
+        table so the terms of each sku can be put together in sku order, wherever their rows are in the file
+
+        Args:
+            path (str): path to the offer file
+        Return:
+            str: the service code of the offer
+        """
+        meta = {}
+        with open(path, newline='') as f, self.lock, self.db:
+            reader = csv.reader(f)
+            # The file starts with key/value metadata rows followed by the column header row
+            for row in reader:
+                if row and row[0] == 'SKU':
+                    header = row
+                    break
+                if len(row) >= 2:
+                    meta[row[0]] = row[1]
+            service = meta['OfferCode']
+            version = meta.get('Version')
+            self._replace_offer(service, version, meta.get('Publication Date'))
+            self.db.executescript(csv_schema)
+            self.db.execute("DELETE FROM temp.csv_dimensions")
+            attr_cols = [(i, csv_attr_name(col)) for i, col in enumerate(header) if col not in csv_term_cols]
+            seen, products, dimensions = set(), [], []
+            for row in reader:
+                rec = dict(zip(header, row))
+                sku = rec['SKU']
+                if sku not in seen:
+                    seen.add(sku)
+                    attributes = {name: row[i] for i, name in attr_cols if row[i] != ''}
+                    products.append({'productFamily': rec['Product Family'], 'attributes': attributes, 'sku': sku})
+                    if len(products) >= batch_size:
+                        self._insert_products(service, products, version, meta.get('Publication Date'))
+                        products = []
+                dimensions.append((sku, rec['TermType'], rec['OfferTermCode'], rec['EffectiveDate'],
+                    *[rec.get(a, '') for a in csv_term_attrs], rec['RateCode'], rec['PriceDescription'],
+                    rec['StartingRange'], rec['EndingRange'], rec['Unit'], rec['Currency'], rec['PricePerUnit']))
+                if len(dimensions) >= batch_size:
+                    self.db.executemany(f"INSERT INTO temp.csv_dimensions VALUES ({', '.join('?' * 14)})", dimensions)
+                    dimensions = []
+            self._insert_products(service, products, version, meta.get('Publication Date'))
+            self.db.executemany(f"INSERT INTO temp.csv_dimensions VALUES ({', '.join('?' * 14)})", dimensions)
+            rows = self.db.execute("SELECT * FROM temp.csv_dimensions ORDER BY sku, termType, rowid")
+            for batch in batches(self._csv_terms(rows)):
+                self._insert_terms(service, batch)
+            self.db.execute("DROP TABLE temp.csv_dimensions")
+        logging.info(f"loaded {len(seen)} {service} products from {path}")
+        return service
+
+    @staticmethod
+    def _csv_terms(rows):
+        """ Yield (sku, termType, {offerTermCode: term}) from staged csv price dimension rows in sku / termType order """
+        for (sku, term_type), dimensions in itertools.groupby(rows, key=lambda row: (row[0], row[1])):
+            terms = {}
+            for (_, _, code, date, *term_attrs, rate, description, begin, end, unit, currency, price) in dimensions:
+                term_key = f"{sku}.{code}"
+                if term_key not in terms:
+                    terms[term_key] = {
+                        'offerTermCode': code,
+                        'sku': sku,
+                        'effectiveDate': date,
+                        'priceDimensions': {},
+                        'termAttributes': {a: value for a, value in zip(csv_term_attrs, term_attrs) if value},
+                    }
+                terms[term_key]['priceDimensions'][rate] = {
+                    'rateCode': rate,
+                    'description': description,
+                    'beginRange': begin,
+                    'endRange': end,
+                    'unit': unit,
+                    'pricePerUnit': {currency: price},
+                    'appliesTo': [],
+                }
+            yield sku, term_type, terms
+
+    def _replace_offer(self, service, version, publicationDate):
+        """ Drop the rows of a service and record its new offer. Called holding the lock, in a transaction """
+        for table in ['offers', 'products', 'attrs', 'terms', 'term_docs']:
+            self.db.execute(f"DELETE FROM {table} WHERE service = ?", (service,))
+        self.db.execute("INSERT INTO offers VALUES (?, ?, ?)", (service, version, publicationDate))
+
+    def _insert_products(self, service, products, version, publicationDate):
+        """ Write a batch of product entries (sku, productFamily, attributes) and their attributes
+
+        Args:
+            service (str): AWS service name
+            products (list): the 'product' dicts of price list products
+            version, publicationDate (str): the offer's, kept in each product document
+        """
+        product_rows, attr_rows = [], []
+        for product in products:
+            sku = product['sku']
+            attributes = product['attributes']
+            doc = {'product': product, 'serviceCode': service, 'version': version, 'publicationDate': publicationDate}
+            product_rows.append((service, sku, *[attributes.get(attr) for attr in indexed_attrs], json.dumps(doc)))
+            attr_rows.extend((service, sku, name, value) for name, value in attributes.items())
+            attr_rows.append((service, sku, 'productFamily', product.get('productFamily')))
+        self.db.executemany(f"INSERT INTO products VALUES ({', '.join('?' * (len(indexed_attrs) + 3))})", product_rows)
+        self.db.executemany("INSERT INTO attrs VALUES (?, ?, ?, ?)", attr_rows)
+
+    def _insert_terms(self, service, terms):
+        """ Write a batch of sku terms, as documents and decoded term rows
+
+        Args:
+            service (str): AWS service name
+            terms (list): (sku, termType, {offerTermCode: term}) tuples
+        """
+        doc_rows, term_rows = [], []
+        for sku, term_type, offers in terms:
+            doc_rows.append((service, sku, term_type, json.dumps(offers)))
+            term_rows.extend(flatten_terms(service, sku, {term_type: offers}))
+        self.db.executemany("INSERT INTO term_docs VALUES (?, ?, ?, ?)", doc_rows)
+        self.db.executemany(f"INSERT INTO terms VALUES ({', '.join('?' * 11)})", term_rows)
+
+    def add_products(self, service, products, version=None, publicationDate=None):
+        """ Replace the products of a service in the store
+
+        Args:
+            service (str): AWS service name
+            products (iterable): price list product dicts
+            version (str): offer version. default = None
+            publicationDate (str): offer publication date. default = None
+        """
+        with self.lock, self.db:
+            self._replace_offer(service, version, publicationDate)
+            for batch in batches(products):
+                self._insert_products(service, [product['product'] for product in batch], version, publicationDate)
+                self._insert_terms(service, [(product['product']['sku'], term_type, offers)
+                    for product in batch for term_type, offers in product['terms'].items()])
+
+    def get_services(self):
+        """ Return a list of the service names loaded in the store
+
+        Returns:
+            list: a list of AWS Service names
+        """
+        with self.lock:
+            return [row[0] for row in self.db.execute("SELECT service FROM offers ORDER BY service")]
+
+    def _check_service(self, service):
+        if service not in self.get_services():
+            raise Exception(f"service: '{service}' not loaded. Must be one of {self.get_services()}")
+
+    def _where(self, service, filters):
+        """ Build the sql where clause for a list of filters
+
+        Args:
+            service (str): AWS service name
+            filters (list): pricing api filters. A filter Value may be a list to match any of several values
+        Return:
+            tuple: (where clause str, list of parameters)
+        """
+        clauses, params = ['p.service = ?'], [service]
+        for f in filters:
+            values = f['Value'] if isinstance(f['Value'], (list, tuple, set)) else [f['Value']]
+            marks = ', '.join('?' * len(values))
+            if f['Field'] in indexed_attrs:
+                clauses.append(f"p.{f['Field']} IN ({marks})")
+                params.extend(values)
+            else:
+                clauses.append(f"p.sku IN (SELECT sku FROM attrs WHERE service = ? AND name = ? AND value IN ({marks}))")
+                params.extend([service, f['Field'], *values])
+        return ' AND '.join(clauses), params
+
+    def get_products(self, service, filters):
+        """ Return the products for a service matching all filters
+
+        Args:
+            service (str): a string with a valid AWS service name
+            filters (list): pricing api filters. ex. [{'Type': 'TERM_MATCH', 'Field': 'operation', 'Value': 'RunInstances'}]
+                A filter Value may be a list to match any of several values
+        Return:
+            list: a list of price list product dicts
+        """
+        self._check_service(service)
+        where, params = self._where(service, filters)
+        with self.lock:
+            rows = self.db.execute(f"SELECT p.sku, p.doc FROM products p WHERE {where} ORDER BY p.rowid", params).fetchall()
+            term_rows = self.db.execute(f"""SELECT t.sku, t.termType, t.doc FROM products p
+                JOIN term_docs t ON t.service = p.service AND t.sku = p.sku WHERE {where} ORDER BY t.rowid""", params).fetchall()
+        products = {}
+        for sku, doc in rows:
+            products[sku] = loads(doc)
+            products[sku].setdefault('terms', {})
+        for sku, term_type, doc in term_rows:
+            products[sku]['terms'][term_type] = loads(doc)
+        return list(products.values())
+
+    def get_priced_products(self, service, filters, LeaseContractLength=None, OfferingClass=None, PurchaseOption=None):
+        """ Return the products matching all filters with their terms already decoded, read from the
+        attribute and term rows instead of the product documents
+
+        Args:
+            service (str): a string with a valid AWS service name
+            filters (list): pricing api filters, as for get_products
+            LeaseContractLength, OfferingClass, PurchaseOption (str): only return Reserved terms with these attributes.
+                default = None (any)
+        Return:
+            list: a list of {'product': {'sku', 'productFamily', 'attributes'}, 'serviceCode', 'records'} dicts,
+                records being the PriceRecords decode_terms yields for the product
+        """
+        self._check_service(service)
+        where, params = self._where(service, filters)
+        term_where, term_params = [], []
+        for name, value in [('LeaseContractLength', LeaseContractLength), ('OfferingClass', OfferingClass),
+                ('PurchaseOption', PurchaseOption)]:
+            if value:
+                term_where.append(f"t.{name} = ?")
+                term_params.append(value)
+        term_where = f" AND (t.termType = 'OnDemand' OR ({' AND '.join(term_where)}))" if term_where else ''
+        record_cols = ['termType', 'LeaseContractLength', 'OfferingClass', 'PurchaseOption', 'unit', 'description',
+            'hr_price', 'uf_price']
+        with self.lock:
+            skus = [row[0] for row in self.db.execute(f"SELECT p.sku FROM products p WHERE {where} ORDER BY p.rowid", params)]
+            attrs = self.db.execute(f"""SELECT a.sku, a.name, a.value FROM products p
+                JOIN attrs a ON a.service = p.service AND a.sku = p.sku WHERE {where} ORDER BY a.rowid""", params).fetchall()
+            terms = self.db.execute(f"""SELECT t.sku, {', '.join('t.' + col for col in record_cols)} FROM products p
+                JOIN terms t ON t.service = p.service AND t.sku = p.sku WHERE {where}{term_where} ORDER BY t.rowid""",
+                params + term_params).fetchall()
+        products = {sku: {'product': {'sku': sku, 'attributes': {}}, 'serviceCode': service, 'records': []} for sku in skus}
+        for sku, name, value in attrs:
+            if name == 'productFamily':
+                products[sku]['product']['productFamily'] = value
+            else:
+                products[sku]['product']['attributes'][name] = value
+        for sku, *record in terms:
+            products[sku]['records'].append(PriceRecord(sku, *record))
+        return list(products.values())
+
+    def get_attr_vals(self, service, attr):
+        """ Return the sorted list of distinct values of a product attribute
+
+        Args:
+            service (str): a string with a valid AWS service name
+            attr (str): a product attribute name. ex. 'operation'
+        Returns:
+            list: a list of attribute values
+        """
+        self._check_service(service)
+        with self.lock:
+            rows = self.db.execute("SELECT DISTINCT value FROM attrs WHERE service = ? AND name = ? ORDER BY value",
+                (service, attr)).fetchall()
+        return [row[0] for row in rows]
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+""" Columnar export of the region x instanceType x operation x RI option price matrix
+
+get_price_columns returns one row per cell and RI option as a dict of numpy arrays, with NaN
+where there is no price. add_derived_columns computes the effective hourly cost, discounts and
+payback period for every row in one vector operation. The columns can be written to CSV, or to
+a pandas DataFrame / Parquet file when pandas (and pyarrow) are installed.
+
+Requires numpy. pandas and pyarrow are only needed for to_dataframe and write_parquet
+"""
+import csv
+import aws_pricing
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Key columns, then price columns, in output order
+key_columns = ['region', 'instanceType', 'operation', 'LeaseContractLength', 'OfferingClass', 'PurchaseOption']
+price_columns = ['od_hr', 'ri_hr', 'ri_uf']
+term_months = {'1yr': 12, '3yr': 36}
+# Hours in an average calendar month, 8760 / 12. An RI is billed for every hour of its term
+month_hours = 730
+
+
+def effective_hr(ri_hr, ri_uf, months):
+    """ Return the RI effective hourly cost: the hourly price plus the upfront price spread over every hour of the
+    term (8760 a year). Shared by price_matrix, instance_index, ri_planner and fleet_cost so they agree
+
+    Args:
+        ri_hr, ri_uf (float or numpy array): RI hourly and upfront prices
+        months (float or numpy array): term length in months, see term_months
+    Returns:
+        float or numpy array: $/hour
+    """
+    return ri_hr + ri_uf / (months * month_hours)
+
+def _require_numpy():
+    if np is None:
+        raise Exception("price_matrix requires numpy. pip install numpy")
+
+
+def matrix_to_columns(matrix, regions, instanceTypes, operations, options):
+    """ Convert a get_pricing_matrix result to columns, with a row for every requested cell and RI option
+
+    Args:
+        matrix (dict): output of aws_pricing.get_pricing_matrix
+        regions, instanceTypes, operations (list): the cells requested
+        options (list): (LeaseContractLength, OfferingClass, PurchaseOption) tuples requested
+    Returns:
+        dict: column name -> numpy array. Missing prices are NaN
+    """
+    _require_numpy()
+    rows = [(region, instanceType, operation) + option
+        for region in regions for instanceType in instanceTypes for operation in operations for option in options]
+    prices = np.full((len(rows), len(price_columns)), np.nan)
+    for i, row in enumerate(rows):
+        cell = matrix.get(row[:3])
+        if cell is None:
+            continue
+        prices[i, 0] = cell.get('OnDemand', {}).get('hr_price', np.nan)
+        reserved = cell['Reserved'].get(row[3:], {})
+        prices[i, 1] = reserved.get('hr_price', np.nan)
+        if 'hr_price' in reserved:
+            prices[i, 2] = reserved.get('uf_price', 0.0)
+    columns = {name: np.array([row[j] for row in rows], dtype=object) for j, name in enumerate(key_columns)}
+    columns.update({name: prices[:, j] for j, name in enumerate(price_columns)})
+    return columns
+
+def get_price_columns(service=None, instanceTypes=None, operations=None, regions=None, \
+        LeaseContractLengths=aws_pricing.lease_contract_lengths, OfferingClasses=aws_pricing.offering_classes, \
+        PurchaseOptions=aws_pricing.purchase_options, hours_per_month=750):
+    """ Returns the price matrix as columns with the derived cost columns added
+    Called as a module
+
+    Args:
+        service (str) : AWS service name. options 'AmazonEC2'|'AmazonRDS.
+        instanceTypes (list) : Instance Types. e.x. ['t2.micro', 'c5.large']
+        operations (list) :  Operations. e.x. ['RunInstances', 'RunInstances:0002']
+        regions (list) : AWS region names. e.x ['us-east-1']
+        LeaseContractLengths, OfferingClasses, PurchaseOptions (list): RI options. default = all
+        hours_per_month (float): hours a month used for payback_mos. default = 750, as get_pricing
+    Returns:
+        dict: column name -> numpy array. See key_columns, price_columns and add_derived_columns
+    """
+    matrix = aws_pricing.get_pricing_matrix(service=service, instanceTypes=instanceTypes, operations=operations,
+        regions=regions, LeaseContractLengths=LeaseContractLengths, OfferingClasses=OfferingClasses,
+        PurchaseOptions=PurchaseOptions)
+    options = [(length, klass, option) for length in LeaseContractLengths for klass in OfferingClasses
+        for option in PurchaseOptions if service != 'AmazonRDS' or klass == 'standard']
+    columns = matrix_to_columns(matrix, regions, instanceTypes, operations, options)
+    return add_derived_columns(columns, hours_per_month=hours_per_month)
+
+def add_derived_columns(columns, hours_per_month=750):
+    """ Add the derived cost columns, computed for all rows at once
+        eff_hr: RI hourly price plus the upfront price amortized over the hours of the term (see effective_hr)
+        hr_discount: RI hourly price discount % (the get_pricing 'discount')
+        eff_discount: effective hourly cost discount %
+        payback_mos: months for the hourly savings to repay the upfront price (the get_pricing 'payback_mos')
+
+    Args:
+        columns (dict): column name -> numpy array, with the key and price columns
+        hours_per_month (float): hours a month used for payback_mos. default = 750, as get_pricing
+    Returns:
+        dict: the columns with the derived columns added
+    """
+    _require_numpy()
+    od_hr, ri_hr, ri_uf = columns['od_hr'], columns['ri_hr'], columns['ri_uf']
+    months = np.array([term_months.get(length, np.nan) for length in columns['LeaseContractLength']], dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        columns['eff_hr'] = effective_hr(ri_hr, ri_uf, months)
+        columns['hr_discount'] = (1 - ri_hr / od_hr) * 100
+        columns['eff_discount'] = (1 - columns['eff_hr'] / od_hr) * 100
+        payback = ri_uf / ((od_hr - ri_hr) * hours_per_month)
+        columns['payback_mos'] = np.where(ri_uf > 0, payback, np.nan)
+    return columns
+
+def to_dataframe(columns):
+    """ Return the columns as a pandas DataFrame. Requires pandas
+
+    Args:
+        columns (dict): column name -> numpy array
+    Returns:
+        pandas.DataFrame: one row per cell and RI option
+    """
+    import pandas
+    return pandas.DataFrame(columns)
+
+def write_csv(columns, path):
+    """ Write the columns to a CSV file with a header row. Missing prices are written as empty values
+
+    Args:
+        columns (dict): column name -> numpy array
+        path (str): output file
+    """
+    names = list(columns.keys())
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(names)
+        for row in zip(*(columns[name] for name in names)):
+            writer.writerow(['' if isinstance(value, float) and value != value else value for value in row])
+
+def write_parquet(columns, path):
+    """ Write the columns to a Parquet file. Requires pandas and pyarrow
+
+    Args:
+        columns (dict): column name -> numpy array
+        path (str): output file
+    """
+    to_dataframe(columns).to_parquet(path, index=False)
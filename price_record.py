@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+""" Compact decoding of price list products
+
+loads decodes PriceList json with orjson when it is installed, falling back to the json module.
+decode_terms pulls only the requested terms of a decoded product out as PriceRecords, reading
+each term and price dimension once instead of indexing back into the product for every field.
+match_terms applies the same term filters to records that are already decoded (ex. by the offer store).
+"""
+import json
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+
+class PriceRecord(object):
+    """ One OnDemand or Reserved term of a product, with its hourly and upfront prices
+    Called as a module
+    """
+    __slots__ = ['sku', 'termType', 'LeaseContractLength', 'OfferingClass', 'PurchaseOption',
+        'unit', 'description', 'hr_price', 'uf_price']
+
+    def __init__(self, sku, termType, LeaseContractLength=None, OfferingClass=None, PurchaseOption=None,
+            unit=None, description=None, hr_price=None, uf_price=None):
+        self.sku = sku
+        self.termType = termType
+        self.LeaseContractLength = LeaseContractLength
+        self.OfferingClass = OfferingClass
+        self.PurchaseOption = PurchaseOption
+        self.unit = unit
+        self.description = description
+        self.hr_price = hr_price
+        self.uf_price = uf_price
+
+    def __repr__(self):
+        return f"PriceRecord({', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)})"
+
+    @property
+    def option(self):
+        """ tuple: (LeaseContractLength, OfferingClass, PurchaseOption) """
+        return (self.LeaseContractLength, self.OfferingClass, self.PurchaseOption)
+
+    def to_dict(self):
+        """ Return the term as the OnDemand / Reserved dict of a get_pricing result
+
+        Returns:
+            dict: OnDemand: unit, description, hr_price. Reserved: hr_price, uf_price, description
+        """
+        result = {}
+        if self.termType == 'OnDemand':
+            result['unit'] = self.unit
+            result['description'] = self.description
+        if self.hr_price is not None:
+            result['hr_price'] = self.hr_price
+        if self.uf_price is not None:
+            result['uf_price'] = self.uf_price
+        if self.termType == 'Reserved':
+            result['description'] = self.description
+        return result
+
+
+def decode_terms(jprice, termType=None, LeaseContractLength=None, OfferingClass=None, PurchaseOption=None):
+    """ Yield the OnDemand and Reserved terms of a decoded price list product as PriceRecords.
+    OnDemand terms only count the instance hour price dimension
+
+    Args:
+        jprice (dict): a decoded price list product
+        termType (str): only yield this term type. default = None (both). options 'OnDemand'|'Reserved'
+        LeaseContractLength, OfferingClass, PurchaseOption (str): only yield Reserved terms with these attributes.
+            default = None (any)
+    Yields:
+        PriceRecord: one record per matching term
+    """
+    sku = jprice['product'].get('sku')
+    terms = jprice['terms']
+    if termType in (None, 'OnDemand'):
+        for term in terms.get('OnDemand', {}).values():
+            for dimension in term['priceDimensions'].values():
+                description = dimension['description']
+                if "per On Demand" in description or "per RDS db" in description:
+                    unit = dimension['unit']
+                    yield PriceRecord(sku, 'OnDemand', unit=unit, description=description,
+                        hr_price=float(dimension['pricePerUnit']['USD']) if unit == "Hrs" else None)
+    if termType in (None, 'Reserved'):
+        for term in terms.get('Reserved', {}).values():
+            attributes = term['termAttributes']
+            if (LeaseContractLength and attributes['LeaseContractLength'] != LeaseContractLength) or \
+               (OfferingClass and attributes['OfferingClass'] != OfferingClass) or \
+               (PurchaseOption and attributes['PurchaseOption'] != PurchaseOption):
+                continue
+            record = PriceRecord(sku, 'Reserved', attributes['LeaseContractLength'], attributes['OfferingClass'],
+                attributes['PurchaseOption'])
+            for dimension in term['priceDimensions'].values():
+                unit = dimension['unit']
+                if unit == "Quantity":
+                    record.uf_price = float(dimension['pricePerUnit']['USD'])
+                elif unit == "Hrs":
+                    record.unit = unit
+                    record.hr_price = float(dimension['pricePerUnit']['USD'])
+                record.description = dimension['description']
+            yield record
+
+def match_terms(records, termType=None, LeaseContractLength=None, OfferingClass=None, PurchaseOption=None):
+    """ Yield the PriceRecords matching the decode_terms filters, from already decoded records
+
+    Args:
+        records (iterable): PriceRecords
+        termType, LeaseContractLength, OfferingClass, PurchaseOption (str): see decode_terms
+    Yields:
+        PriceRecord: the matching records
+    """
+    for record in records:
+        if termType and record.termType != termType:
+            continue
+        if record.termType == 'Reserved' and (
+                (LeaseContractLength and record.LeaseContractLength != LeaseContractLength) or
+                (OfferingClass and record.OfferingClass != OfferingClass) or
+                (PurchaseOption and record.PurchaseOption != PurchaseOption)):
+            continue
+        yield record
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+""" Versioned price snapshots and the diff between two of them
+
+A snapshot keeps, for every SKU of a service, a hash of its product attributes, a hash of its
+OnDemand / Reserved prices and the flattened price rows. Diffing two snapshots compares the
+hashes SKU by SKU, so only the added, removed and repriced SKUs are passed on downstream.
+
+Usage:
+    ./price_snapshot.py OLD_SNAPSHOT OFFER_FILE NEW_SNAPSHOT > changes.csv
+    loads OFFER_FILE (a bulk offer index.json/.csv), saves its snapshot to NEW_SNAPSHOT and prints
+    the price rows of the SKUs added or repriced since OLD_SNAPSHOT. A missing OLD_SNAPSHOT counts as empty
+"""
+import csv, gzip, hashlib, json, os, sys
+from offer_store import OfferStore
+from price_record import decode_terms
+
+# Columns of a flattened price row
+row_columns = ['sku', 'instanceType', 'operation', 'location', 'termType',
+    'LeaseContractLength', 'OfferingClass', 'PurchaseOption', 'hr_price', 'uf_price']
+
+
+def _hash(obj):
+    return hashlib.blake2b(json.dumps(obj, sort_keys=True).encode(), digest_size=8).hexdigest()
+
+
+def take_snapshot(service, products, version=None):
+    """ Return the snapshot of a list of price list products
+    Called as a module
+
+    Args:
+        service (str): AWS service name. ex. 'AmazonEC2'
+        products (iterable): decoded price list products. ex. aws_pricing.iter_products(service, [])
+        version (str): offer version. default = None (the version of the first product)
+    Returns:
+        dict: {'service', 'version', 'skus': {sku: {'product': hash, 'prices': hash, 'rows': [price rows]}}}
+    """
+    skus = {}
+    for jprice in products:
+        version = version or jprice.get('version')
+        product = jprice['product']
+        attributes = product['attributes']
+        key = [attributes.get('instanceType'), attributes.get('operation'), attributes.get('location')]
+        rows = sorted(([record.termType, record.LeaseContractLength, record.OfferingClass, record.PurchaseOption,
+            record.hr_price, record.uf_price] for record in decode_terms(jprice)), key=json.dumps)
+        skus[product['sku']] = {
+            'product': _hash(attributes),
+            'prices': _hash(rows),
+            'rows': [[product['sku']] + key + row for row in rows],
+        }
+    return {'service': service, 'version': version, 'skus': skus}
+
+def snapshot_offer(path):
+    """ Return the snapshot of a bulk offer file
+    Called as a module
+
+    Args:
+        path (str): offer index.json or index.csv file
+    Returns:
+        dict: the snapshot
+    """
+    store = OfferStore(path)
+    service = store.get_services()[0]
+    return take_snapshot(service, store.get_products(service, []), store.versions[service])
+
+def save_snapshot(snapshot, path):
+    """ Write a snapshot to a gzipped json file
+
+    Args:
+        snapshot (dict): the snapshot
+        path (str): output file
+    """
+    with gzip.open(path, 'wt') as f:
+        json.dump(snapshot, f, separators=(',', ':'))
+
+def load_snapshot(path):
+    """ Read a snapshot written by save_snapshot
+
+    Args:
+        path (str): snapshot file
+    Returns:
+        dict: the snapshot
+    """
+    with gzip.open(path, 'rt') as f:
+        return json.load(f)
+
+def diff_snapshots(old, new):
+    """ Return the SKUs that changed between two snapshots of a service
+    Called as a module
+
+    Args:
+        old (dict): the earlier snapshot
+        new (dict): the later snapshot
+    Returns:
+        dict: {'added': [sku], 'removed': [sku], 'repriced': [sku], 'changed': [sku]}. 'changed' SKUs have new
+            product attributes but the same prices
+    """
+    if old['service'] != new['service']:
+        raise Exception(f"snapshots are for different services: {old['service']} and {new['service']}")
+    old_skus, new_skus = old['skus'], new['skus']
+    diff = {'added': [], 'removed': [], 'repriced': [], 'changed': []}
+    for sku, entry in new_skus.items():
+        previous = old_skus.get(sku)
+        if previous is None:
+            diff['added'].append(sku)
+        elif previous['prices'] != entry['prices']:
+            diff['repriced'].append(sku)
+        elif previous['product'] != entry['product']:
+            diff['changed'].append(sku)
+    diff['removed'] = [sku for sku in old_skus if sku not in new_skus]
+    return diff
+
+def changed_rows(new, diff):
+    """ Return the price rows of the added and repriced SKUs
+
+    Args:
+        new (dict): the later snapshot
+        diff (dict): output of diff_snapshots
+    Returns:
+        list: price rows, see row_columns
+    """
+    rows = []
+    for sku in diff['added'] + diff['repriced']:
+        rows.extend(new['skus'][sku]['rows'])
+    return rows
+
+def write_csv(rows, f):
+    """ Write price rows as CSV with a header row
+
+    Args:
+        rows (list): price rows, see row_columns
+        f (file): open text file
+    """
+    writer = csv.writer(f)
+    writer.writerow(row_columns)
+    writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4:
+        sys.exit(__doc__)
+    new = snapshot_offer(sys.argv[2])
+    if os.path.exists(sys.argv[1]):
+        old = load_snapshot(sys.argv[1])
+    else:
+        old = {'service': new['service'], 'version': None, 'skus': {}}
+    save_snapshot(new, sys.argv[3])
+    diff = diff_snapshots(old, new)
+    print(f"{new['service']} {old['version']} -> {new['version']}: " +
+        ', '.join(f"{len(skus)} {kind}" for kind, skus in diff.items()), file=sys.stderr)
+    write_csv(changed_rows(new, diff), sys.stdout)
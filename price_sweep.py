@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+""" Multi region price sweep sharded across processes, with checkpoint / resume
+
+The regions and operations of a sweep are expanded from the live (or cached / offline) attribute
+values, then split into one shard per service / region. Shards run on a process pool, each one a
+get_pricing_region query per operation in its own aws_pricing, which prices every instance type
+the region has for that operation at once. Their price rows are appended to the output as soon as
+each shard finishes.
+
+The checkpoint file records the expanded matrix and, after each shard is written and flushed,
+the shard and the output size. A resumed sweep reuses the recorded matrix, cuts the output back
+to the last checkpointed size (dropping the rows of a shard that was being written when the
+sweep stopped) and only runs the shards not yet recorded.
+
+Usage:
+    ./price_sweep.py --out prices.csv [--checkpoint prices.ckpt] [--services AmazonEC2,AmazonRDS] [--regions us-east-1,eu-west-1]
+        [--instance-types c5.large,m5.large] [--operations RunInstances] [--all-generations] [--processes 4]
+        [--cache FILE] [--offline FILES | --offline-db FILE] [--profile NAME] [--concurrency 8] [--rate 10]
+    The output is csv, or json lines if --out ends with .jsonl
+"""
+import argparse, csv, json, logging, os, sys
+import aws_pricing
+
+# Columns of a price row. RI columns are empty on the OnDemand row
+row_columns = ['service', 'region', 'instanceType', 'operation', 'termType',
+    'LeaseContractLength', 'OfferingClass', 'PurchaseOption', 'hr_price', 'uf_price']
+# Filter selecting the current generation instance types of a region
+current_generation_filter = {'Type': 'TERM_MATCH', 'Field': 'currentGeneration', 'Value': 'Yes'}
+
+
+def expand_matrix(service, regions=None, instanceTypes=None, operations=None, current_generation=True):
+    """ Return the regions, instance types and operations of a sweep, looking up the ones not given
+    Called as a module
+
+    Args:
+        service (str): AWS service name. options 'AmazonEC2'|'AmazonRDS'
+        regions (list): AWS region names. default = None (every region from get_regions)
+        instanceTypes (list): instance types. default = None (every instance type each region has)
+        operations (list): operations. default = None (every RunInstances / CreateDBInstance operation)
+        current_generation (bool): True/False. If true and instanceTypes is None, only the current generation
+            instance types of each region are priced. default = True
+    Return:
+        dict: {'regions': list, 'instanceTypes': list or None, 'operations': list, 'current_generation': bool}
+    """
+    regions = list(regions or aws_pricing.get_regions())
+    if operations is None:
+        operations = [op for op in aws_pricing.get_attr_vals(service, 'operation')
+            if 'RunInstances' in op or 'CreateDBInstance:' in op]
+    return {'regions': regions, 'instanceTypes': list(instanceTypes) if instanceTypes else None,
+        'operations': list(operations), 'current_generation': current_generation}
+
+
+def matrix_rows(service, matrix):
+    """ Yield the price rows of a price matrix
+
+    Args:
+        service (str): AWS service name
+        matrix (dict): (region, instanceType, operation) -> get_pricing_region cell
+    Yields:
+        dict: a row with the row_columns keys
+    """
+    for (region, instanceType, operation), cell in sorted(matrix.items()):
+        base = {'service': service, 'region': region, 'instanceType': instanceType, 'operation': operation}
+        ondemand = cell.get('OnDemand', {})
+        yield dict(base, termType='OnDemand', hr_price=ondemand.get('hr_price'))
+        for (length, klass, option), reserved in sorted(cell['Reserved'].items()):
+            yield dict(base, termType='Reserved', LeaseContractLength=length, OfferingClass=klass,
+                PurchaseOption=option, hr_price=reserved.get('hr_price'), uf_price=reserved.get('uf_price'))
+
+
+def _init_worker(settings):
+    """ Set up the aws_pricing of a pool process from the sweep settings """
+    logging.basicConfig(level=settings.get('loglvl', logging.WARNING))
+    if settings.get('cache'):
+        aws_pricing.use_cache(settings['cache'])
+    aws_pricing.set_concurrency(max_workers=settings.get('concurrency', 8), rate=settings.get('rate', 10))
+    aws_pricing.configure_clients(profile=settings.get('profile'), max_pool_connections=max(10, settings.get('concurrency', 8)))
+    if settings.get('offline') or settings.get('offline_db'):
+        aws_pricing.use_offline(*settings.get('offline', []), db=settings.get('offline_db'))
+
+def sweep_shard(service, region, instanceTypes, operations, current_generation=True):
+    """ Return the price rows of one service / region shard, from one get_pricing_region query per operation
+    Called as a module
+
+    Args:
+        service (str): AWS service name
+        region (str): AWS region name
+        instanceTypes (list): instance types. None for every instance type of the region
+        operations (list): operations
+        current_generation (bool): True/False. If true and instanceTypes is None, only price the current
+            generation instance types. Offers without the currentGeneration attribute are priced whole. default = True
+    Return:
+        list: price rows (dicts with the row_columns keys)
+    """
+    valid_operations = aws_pricing.get_attr_vals(service, 'operation')
+    regions = aws_pricing.get_regions()
+    wanted = set(instanceTypes) if instanceTypes else None
+    matrix = {}
+    for operation in operations:
+        args = dict(service=service, operation=operation, region=region, operations=valid_operations, regions=regions)
+        results = {}
+        if wanted is None and current_generation:
+            results = aws_pricing.get_pricing_region(filters=[current_generation_filter], **args)
+        if not results:
+            results = aws_pricing.get_pricing_region(**args)
+        for instanceType, cell in results.items():
+            if wanted is None or instanceType in wanted:
+                matrix[(region, instanceType, operation)] = cell
+    return list(matrix_rows(service, matrix))
+
+
+def _read_checkpoint(path):
+    """ Return the matrices, the finished shards and the output size recorded in a checkpoint file """
+    matrices, done, size = None, set(), 0
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A record cut off by the interruption
+                break
+            if 'matrices' in record:
+                matrices = record['matrices']
+            else:
+                done.add((record['service'], record['region']))
+                size = record['size']
+    return matrices, done, size
+
+def _write_record(f, record):
+    f.write(json.dumps(record) + '\n')
+    f.flush()
+    os.fsync(f.fileno())
+
+def sweep(out, services=('AmazonEC2',), regions=None, instanceTypes=None, operations=None, current_generation=True,
+        checkpoint=None, processes=None, settings=None):
+    """ Price every service / region / instance type / operation, writing the rows to a file as shards finish
+    Called as a module
+
+    Args:
+        out (str): output file. csv, or json lines if it ends with .jsonl
+        services (list): AWS service names. default = ('AmazonEC2',)
+        regions, instanceTypes, operations, current_generation: see expand_matrix
+        checkpoint (str): checkpoint file. default = None (out + '.ckpt'). An existing checkpoint resumes its sweep
+        processes (int): pool processes. default = None (one per cpu)
+        settings (dict): aws_pricing set up for each process, keys 'cache', 'offline', 'offline_db', 'profile',
+            'concurrency' and 'rate' (the rate of the whole sweep, split between the processes). 'offline' files are
+            loaded once into 'offline_db' (default out + '.offers.db') for the processes to share. default = None
+    Return:
+        dict: {'shards': int, 'resumed': int, 'rows': int, 'failed': list of (service, region)}
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    import multiprocessing
+    checkpoint = checkpoint or out + '.ckpt'
+    settings = dict(settings or {})
+    processes = processes or os.cpu_count() or 1
+    matrices, done, size = _read_checkpoint(checkpoint) if os.path.exists(checkpoint) else (None, set(), 0)
+    if settings.get('offline'):
+        # The offer files are parsed once, here, into a db file that the pool processes only open.
+        # A resumed sweep reuses the db file it loaded before
+        paths = settings.pop('offline')
+        settings['offline_db'] = settings.get('offline_db') or out + '.offers.db'
+        if matrices is None or not os.path.exists(settings['offline_db']):
+            aws_pricing.use_offline(*paths, db=settings['offline_db'])
+    if matrices is not None and done and not os.path.exists(out):
+        # The rows of the finished shards went with the output file, so every shard runs again
+        logging.warning(f"{out} not found, restarting the sweep of {checkpoint}")
+        done, size = set(), 0
+        ckpt = open(checkpoint, 'w')
+        _write_record(ckpt, {'matrices': matrices})
+    else:
+        ckpt = open(checkpoint, 'a')
+    if matrices is None:
+        # New sweep. The matrix is expanded here once, with the settings of the sweep
+        _init_worker(settings)
+        matrices = {service: expand_matrix(service, regions=regions, instanceTypes=instanceTypes,
+            operations=operations, current_generation=current_generation) for service in services}
+        _write_record(ckpt, {'matrices': matrices})
+        done, size = set(), 0
+    elif done:
+        logging.info(f"resuming {checkpoint}: {len(done)} shards done")
+    shards = [(service, region) for service, matrix in matrices.items() for region in matrix['regions']]
+    todo = [shard for shard in shards if shard not in done]
+    settings['rate'] = float(settings.get('rate', 10)) / min(processes, max(1, len(todo)))
+
+    jsonl = out.endswith('.jsonl')
+    output = open(out, 'r+' if size else 'w', newline='')
+    output.seek(size)
+    output.truncate()
+    writer = None if jsonl else csv.DictWriter(output, fieldnames=row_columns)
+    if writer and not size:
+        writer.writeheader()
+    rows, failed = 0, []
+    # spawn, so the pool processes do not inherit the threads and sqlite connections of this one
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=_init_worker, initargs=(settings,)) as pool:
+        futures = {pool.submit(sweep_shard, service, region, matrices[service]['instanceTypes'],
+            matrices[service]['operations'], matrices[service].get('current_generation', True)): (service, region)
+            for service, region in todo}
+        for future in as_completed(futures):
+            service, region = futures[future]
+            try:
+                shard_rows = future.result()
+            except Exception as e:
+                logging.warning(f"shard {service} {region} failed: {e}")
+                failed.append((service, region))
+                continue
+            for row in shard_rows:
+                if jsonl:
+                    output.write(json.dumps(row) + '\n')
+                else:
+                    writer.writerow(row)
+            output.flush()
+            os.fsync(output.fileno())
+            rows += len(shard_rows)
+            _write_record(ckpt, {'service': service, 'region': region, 'rows': len(shard_rows), 'size': output.tell()})
+            logging.info(f"shard {service} {region}: {len(shard_rows)} rows")
+    output.close()
+    ckpt.close()
+    return {'shards': len(shards), 'resumed': len(shards) - len(todo), 'rows': rows, 'failed': failed}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', required=True, help='output file, csv or .jsonl')
+    parser.add_argument('--checkpoint', help='checkpoint file. default = OUT.ckpt')
+    parser.add_argument('--services', default='AmazonEC2', help='comma separated service names')
+    parser.add_argument('--regions', help='comma separated regions. default = every region')
+    parser.add_argument('--instance-types', help='comma separated instance types. default = every current generation type')
+    parser.add_argument('--operations', help='comma separated operations. default = every RunInstances / CreateDBInstance operation')
+    parser.add_argument('--all-generations', action='store_true', help='include previous generation instance types')
+    parser.add_argument('--processes', type=int, help='pool processes. default = one per cpu')
+    parser.add_argument('--cache', help='response cache file shared by the processes')
+    parser.add_argument('--offline', help='comma separated bulk offer files to use instead of the api')
+    parser.add_argument('--offline-db', help='SQLite offer store to use instead of the api')
+    parser.add_argument('--profile', help='AWS profile')
+    parser.add_argument('--concurrency', type=int, default=8, help='api calls in flight per process')
+    parser.add_argument('--rate', type=float, default=10, help='most api calls per second for the whole sweep')
+    parser.add_argument('--loglvl', default='INFO')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglvl)
+    split = lambda value: value.split(',') if value else None
+    result = sweep(args.out, services=split(args.services), regions=split(args.regions),
+        instanceTypes=split(args.instance_types), operations=split(args.operations),
+        current_generation=not args.all_generations, checkpoint=args.checkpoint, processes=args.processes,
+        settings={'cache': args.cache, 'offline': split(args.offline) or [], 'offline_db': args.offline_db,
+            'profile': args.profile, 'concurrency': args.concurrency, 'rate': args.rate, 'loglvl': args.loglvl})
+    print(f"{result['rows']} rows from {result['shards'] - result['resumed']} shards "
+        f"({result['resumed']} resumed, {len(result['failed'])} failed)", file=sys.stderr)
+    sys.exit(1 if result['failed'] else 0)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+""" Long running HTTP/JSON pricing query service
+
+Keeps the clients, the price data and the metadata lists warm in one process, so callers do not
+pay the python / boto3 start up and validation round trips on every lookup. Api responses are
+kept in the response cache (in memory unless aws_pricing.use_cache was given a file), and
+concurrent identical lookups are coalesced so they share one fetch. The requests of a batch
+that only differ by RI option share one product query.
+
+Endpoints:
+    POST /pricing       body: get_pricing arguments, or {"requests": [get_pricing arguments, ...]}
+    GET  /attr_vals     ?service=AmazonEC2&attr=operation
+    GET  /loc_to_reg    ?location=US East (N. Virginia)  or  ?region=us-east-1
+    GET  /operations    ?service=AmazonEC2[&operation=RunInstances]
+    GET  /regions
+    GET  /stats
+"""
+import json, logging, threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import aws_pricing
+
+
+class Coalescer(object):
+    """ Runs concurrent calls with the same key once, handing every caller the same result
+    Called as a module
+
+    Example:
+        coalescer = Coalescer()
+        regions = coalescer.call(('regions',), aws_pricing.get_regions)
+    """
+
+    def __init__(self):
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def call(self, key, func, *args, **kwargs):
+        """ Return func(*args, **kwargs), or wait for the result of a call with the same key already in flight
+
+        Args:
+            key (hashable): identifies identical calls
+            func (callable): the function to call
+        Returns:
+            the return value of func. Exceptions are raised in every waiting caller
+        """
+        with self.lock:
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self.in_flight[key] = Future()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        if owner:
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self.lock:
+                    del self.in_flight[key]
+        return future.result()
+
+
+class PricingService(object):
+    """ The lookups served by the HTTP handler, with coalescing
+    Called as a module
+    """
+
+    def __init__(self):
+        self.coalescer = Coalescer()
+
+    def pricing(self, request):
+        key = ('pricing', json.dumps(request, sort_keys=True))
+        return self.coalescer.call(key, aws_pricing.get_pricing, **request)
+
+    def pricing_batch(self, requests):
+        """ Returns get_pricing results for a list of requests, with {'error': message} for failed requests
+        Requests for the same service / instanceType / operation / region share one product query (see aws_pricing.get_pricing_batch)
+        """
+        services = {request.get('service') for request in requests if isinstance(request, dict)} & {'AmazonEC2', 'AmazonRDS'}
+        operations = {service: self.attr_vals(service, 'operation') for service in services}
+        results = aws_pricing.get_pricing_batch(requests, return_exceptions=True, operations=operations, regions=self.regions())
+        return [{'error': str(result)} if isinstance(result, Exception) else result for result in results]
+
+    def attr_vals(self, service, attr):
+        return self.coalescer.call(('attr_vals', service, attr), aws_pricing.get_attr_vals, service, attr)
+
+    def regions(self):
+        return self.coalescer.call(('regions',), aws_pricing.get_regions)
+
+    def loc_to_reg(self, location=None, region=None):
+        return aws_pricing.loc_to_reg(location=location, region=region)
+
+    def operations(self, service, operation=None):
+        if operation is None:
+            operations = [op for op in self.attr_vals(service, 'operation')
+                if 'RunInstances' in op or 'CreateDBInstance:' in op]
+        else:
+            operations = [operation]
+        return self.coalescer.call(('operations', service, tuple(operations)),
+            aws_pricing.get_operation_descriptions, service, operations)
+
+    def stats(self):
+        stats = {'calls': self.coalescer.calls, 'coalesced': self.coalescer.coalesced}
+        if aws_pricing.response_cache:
+            stats['response_cache'] = aws_pricing.response_cache.stats()
+        return stats
+
+
+class PricingHandler(BaseHTTPRequestHandler):
+    """ HTTP handler mapping the endpoints to the PricingService of the server """
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, func):
+        try:
+            self._reply(200, func())
+        except Exception as e:
+            self._reply(400, {'error': str(e)})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        args = {name: values[0] for name, values in parse_qs(url.query).items()}
+        service = self.server.service
+        routes = {
+            '/attr_vals': lambda: service.attr_vals(args['service'], args['attr']),
+            '/loc_to_reg': lambda: service.loc_to_reg(location=args.get('location'), region=args.get('region')),
+            '/operations': lambda: service.operations(args['service'], args.get('operation')),
+            '/regions': service.regions,
+            '/stats': service.stats,
+        }
+        if url.path not in routes:
+            return self._reply(404, {'error': f"unknown path {url.path}. Must be one of {list(routes) + ['/pricing']}"})
+        self._handle(routes[url.path])
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/pricing':
+            return self._reply(404, {'error': f"unknown path {self.path}. Must be /pricing"})
+        def pricing():
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if 'requests' in body:
+                return self.server.service.pricing_batch(body['requests'])
+            return self.server.service.pricing(body)
+        self._handle(pricing)
+
+    def log_message(self, format, *args):
+        logging.info(f"{self.address_string()} {format % args}")
+
+
+def make_server(host='127.0.0.1', port=8080, service=None):
+    """ Return a threaded HTTP server for the pricing service. Call serve_forever() on it to serve
+
+    Args:
+        host (str): address to listen on. default = '127.0.0.1'
+        port (int): port to listen on. default = 8080. 0 picks a free port
+        service (PricingService): default = None (a new PricingService)
+    Returns:
+        ThreadingHTTPServer: the server
+    """
+    if aws_pricing.response_cache is None:
+        aws_pricing.use_cache(':memory:')
+    server = ThreadingHTTPServer((host, int(port)), PricingHandler)
+    server.service = service or PricingService()
+    return server
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+""" Persistent on disk cache of AWS api responses
+
+Responses are stored in a SQLite file keyed by a hash of the api method and its normalized
+parameters. Each api method has its own time to live, the file is kept under a size limit by
+evicting the least recently used responses, and SQLite locking makes it safe to share between
+processes. The pages of a paginated call are stored as one response, so they expire and are
+evicted together. When a get_products response shows a new offer version for a service, every
+cached response for that service is dropped.
+"""
+import hashlib, json, logging, sqlite3, threading, time
+
+day = 24 * 60 * 60
+# Seconds a response stays valid, per api method
+default_ttls = {
+    'describe_regions': 7 * day,
+    'describe_services': day,
+    'get_attribute_values': day,
+    'get_products': day,
+}
+
+schema = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY, endpoint TEXT, service TEXT, created REAL, accessed REAL, size INTEGER, body TEXT);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+CREATE INDEX IF NOT EXISTS responses_service ON responses (service);
+CREATE TABLE IF NOT EXISTS versions (
+    service TEXT PRIMARY KEY, version TEXT);
+"""
+
+
+def cache_key(endpoint, params):
+    """ Return the cache key of an api call. Filters are sorted so their order does not matter
+
+    Args:
+        endpoint (str): api method name. ex. 'get_products'
+        params (dict): api call parameters
+    Returns:
+        str: hex digest key
+    """
+    params = dict(params)
+    if 'Filters' in params:
+        params['Filters'] = sorted(params['Filters'], key=lambda f: (f['Field'], json.dumps(f['Value'])))
+    return hashlib.sha256(json.dumps([endpoint, params], sort_keys=True).encode()).hexdigest()
+
+
+class ResponseCache(object):
+    """ Size bounded LRU cache of api responses with per method TTLs
+    Called as a module
+
+    Example:
+        cache = ResponseCache('pricing_cache.db')
+        response = cache.get('get_products', params)
+        if response is None:
+            response = client.get_products(**params)
+            cache.put('get_products', params, response)
+    """
+
+    def __init__(self, path, max_bytes=512 * 1024 * 1024, ttls=None):
+        """
+        Args:
+            path (str): SQLite cache file
+            max_bytes (int): most bytes of responses to keep. default = 512MB
+            ttls (dict): api method -> seconds, merged over default_ttls. default = None
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttls = dict(default_ttls, **(ttls or {}))
+        self.hits = {}
+        self.misses = {}
+        self.lock = threading.Lock()
+        # The timeout waits out other processes holding the write lock
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        with self.lock:
+            self.db.executescript(schema)
+
+    def get(self, endpoint, params):
+        """ Return a cached response, or None if it is missing or expired
+
+        Args:
+            endpoint (str): api method name. ex. 'get_products'
+            params (dict): api call parameters
+        Returns:
+            dict: the cached response or None
+        """
+        key = cache_key(endpoint, params)
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT created, body FROM responses WHERE key = ?", (key,)).fetchone()
+            if row and now - row[0] < self.ttls.get(endpoint, day):
+                self.db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                self.hits[endpoint] = self.hits.get(endpoint, 0) + 1
+                return json.loads(row[1])
+            self.misses[endpoint] = self.misses.get(endpoint, 0) + 1
+        return None
+
+    def put(self, endpoint, params, response):
+        """ Store a response, evicting the least recently used responses when the cache is over max_bytes
+
+        Args:
+            endpoint (str): api method name. ex. 'get_products'
+            params (dict): api call parameters
+            response (dict): the api response. ResponseMetadata is not stored
+        """
+        body = json.dumps({k: v for k, v in response.items() if k != 'ResponseMetadata'})
+        now = time.time()
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (cache_key(endpoint, params), endpoint, params.get('ServiceCode'), now, now, len(body), body))
+                total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+                if total > self.max_bytes:
+                    evict = []
+                    for key, size in self.db.execute("SELECT key, size FROM responses ORDER BY accessed"):
+                        if total <= self.max_bytes:
+                            break
+                        evict.append((key,))
+                        total -= size
+                    self.db.executemany("DELETE FROM responses WHERE key = ?", evict)
+                    logging.debug(f"response cache evicted {len(evict)} responses")
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def check_version(self, service, version):
+        """ Record the current offer version of a service. If it changed, drop every cached response for the service
+
+        Args:
+            service (str): AWS service name. ex. 'AmazonEC2'
+            version (str): offer version from a price list product. ex. '20190712024233'
+        Returns:
+            bool: True if cached responses were dropped
+        """
+        if not version:
+            return False
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            row = self.db.execute("SELECT version FROM versions WHERE service = ?", (service,)).fetchone()
+            changed = row is not None and row[0] != version
+            if changed:
+                self.db.execute("DELETE FROM responses WHERE service = ?", (service,))
+                logging.info(f"{service} offer version changed from {row[0]} to {version}. cached responses dropped")
+            self.db.execute("INSERT OR REPLACE INTO versions VALUES (?, ?)", (service, version))
+            self.db.execute("COMMIT")
+        return changed
+
+    def clear(self):
+        """ Drop every cached response """
+        with self.lock:
+            self.db.execute("DELETE FROM responses")
+            self.db.execute("DELETE FROM versions")
+
+    def stats(self):
+        """ Return the hit / miss counts of this process and the size of the cache
+
+        Returns:
+            dict: {'hits': {endpoint: count}, 'misses': {endpoint: count}, 'entries': int, 'bytes': int}
+        """
+        with self.lock:
+            entries, size = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            return {'hits': dict(self.hits), 'misses': dict(self.misses), 'entries': entries, 'bytes': size}
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+""" Reserved instance planning for a fleet, with size flexible coverage
+
+A fleet is a list of instance types with a count and the hours per month each instance runs. Its
+prices come from the instance_index of the region / operation (one query, then no api calls), and
+every LeaseContractLength x OfferingClass x PurchaseOption is evaluated for every fleet row at once
+as (rows x options) numpy arrays.
+
+Rows are grouped for coverage. Size flexible RIs (by default EC2 Linux, RunInstances) cover any size
+of their family, so a group is a family and RIs are counted in normalized units (normalizationSizeFactor,
+ex. 1 m5.xlarge = 8 units = 2 m5.large). Other RIs only cover their own instance type.
+
+How the hours of the instances in a group line up is set by overlap:
+    'stacked': the instances all run at the same time, the longest running ones first. An RI unit is worth
+        buying for the instances whose utilization (hours / hours_per_month) is at least the break even
+        utilization. This is the conservative assumption
+    'pooled': the group's usage can be packed onto fully used RI units (ex. day and night shifts of the
+        same family), so its normalized unit-hours / hours_per_month units are bought
+
+The break even utilization of an RI option is its effective hourly price (upfront amortized over the
+term) divided by the OnDemand hourly price: an RI used less than that is dearer than OnDemand.
+The optimal mix picks, for each group, the cheapest of OnDemand and each RI option.
+
+Requires numpy
+
+Usage:
+    ./ri_planner.py FLEET --region us-east-1 [--service AmazonEC2] [--operation RunInstances] [--overlap stacked]
+        [--hours-per-month 730] [--cache FILE] [--offline FILES | --offline-db FILE] > plan.json
+    FLEET is a csv or json lines file with instanceType, count (default 1) and hours (default hours_per_month) columns
+"""
+import argparse, json, logging
+import aws_pricing, instance_index
+from fleet_cost import _number
+from price_matrix import effective_hr, month_hours, term_months
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+options = [(length, klass, option) for length in aws_pricing.lease_contract_lengths
+    for klass in aws_pricing.offering_classes for option in aws_pricing.purchase_options]
+overlaps = ['stacked', 'pooled']
+# Calendar hours in a month, 8760 / 12
+hours_per_month = month_hours
+
+
+def is_size_flexible(service, operation):
+    """ Return True if the RIs of a service / operation cover every size of their instance family
+    Regional EC2 Linux/UNIX RIs are size flexible. Windows, RHEL, SUSE and the other licensed operations are not
+    """
+    return service == 'AmazonEC2' and operation == 'RunInstances'
+
+def _group_sum(group, groups, values):
+    """ Sum the rows of a (rows,) or (rows, options) array per group """
+    sums = np.zeros((groups,) + values.shape[1:])
+    np.add.at(sums, group, values)
+    return sums
+
+def evaluate(od_hr, ri_hr, ri_uf, months, nsf, count, hours, group, overlap='stacked', hours_per_month=hours_per_month):
+    """ Evaluate every RI option for every fleet row and group in one vectorized pass
+    Called as a module
+
+    Args:
+        od_hr (array): (rows,) OnDemand hourly price
+        ri_hr, ri_uf (array): (rows, options) RI hourly and upfront prices, NaN where the option is not offered
+        months (array): (options,) term of each option in months
+        nsf (array): (rows,) normalization size factor. Use 1 for groups of one instance type
+        count (array): (rows,) instances
+        hours (array): (rows,) hours per month each instance runs
+        group (array): (rows,) group number of each row, 0 to groups - 1
+        overlap (str): 'stacked' | 'pooled'. default = 'stacked'
+        hours_per_month (float): hours in a month. default = 730
+    Returns:
+        dict: (groups, options) arrays 'monthly' (cost with the option), 'upfront', 'units' (normalized units bought),
+            'break_even' (utilization), and (groups,) arrays 'od_monthly', 'unit_hours' (normalized usage)
+    """
+    if overlap not in overlaps:
+        raise Exception(f"overlap: '{overlap}' invalid. Must be one of {overlaps}")
+    groups = int(group.max()) + 1 if len(group) else 0
+    hours = np.minimum(hours, hours_per_month)
+    # RI price per hour with the upfront amortized over the hours of the term
+    eff_hr = effective_hr(ri_hr, ri_uf, months)
+    od_monthly = od_hr * hours * count
+    unit_hours = nsf * count * hours
+    g_od = _group_sum(group, groups, od_monthly)
+    g_unit_hours = _group_sum(group, groups, unit_hours)
+    # Usage weighted price per normalized unit-hour of each group
+    offered = ~np.isnan(eff_hr)
+    weights = np.where(offered, unit_hours[:, None], 0.0)
+    g_weights = _group_sum(group, groups, weights)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        g_od_unit = g_od / g_unit_hours
+        g_eff_unit = _group_sum(group, groups, np.where(offered, eff_hr / nsf[:, None], 0.0) * weights) / g_weights
+        g_uf_unit = _group_sum(group, groups, np.where(offered, ri_uf / nsf[:, None], 0.0) * weights) / g_weights
+        break_even = g_eff_unit / g_od_unit[:, None]
+
+    if overlap == 'stacked':
+        # Each row is covered when its utilization reaches its own break even utilization
+        with np.errstate(invalid='ignore'):
+            covered = offered & ((hours / hours_per_month)[:, None] >= eff_hr / od_hr[:, None])
+        monthly = np.where(covered, eff_hr * hours_per_month * count[:, None], od_monthly[:, None])
+        upfront = np.where(covered, ri_uf * count[:, None], 0.0)
+        units = np.where(covered, (nsf * count)[:, None], 0.0)
+        g_monthly = _group_sum(group, groups, monthly)
+        g_upfront = _group_sum(group, groups, upfront)
+        g_units = _group_sum(group, groups, units)
+    else:
+        # Whole smallest size units, fully used, with the rest of the usage OnDemand
+        smallest = np.full(groups, np.inf)
+        np.minimum.at(smallest, group, nsf)
+        full_units = np.floor(g_unit_hours / hours_per_month / smallest) * smallest
+        buy = g_eff_unit < g_od_unit[:, None]
+        g_units = np.where(buy, full_units[:, None], 0.0)
+        g_monthly = np.where(buy, g_units * g_eff_unit * hours_per_month
+            + (g_unit_hours[:, None] - g_units * hours_per_month) * g_od_unit[:, None], g_od[:, None])
+        g_upfront = np.where(buy, g_units * g_uf_unit, 0.0)
+    # Options not offered for any row of a group cannot be bought
+    not_offered = g_weights == 0
+    g_monthly[not_offered] = np.nan
+    return {'monthly': g_monthly, 'upfront': g_upfront, 'units': g_units, 'break_even': break_even,
+        'od_monthly': g_od, 'unit_hours': g_unit_hours}
+
+
+def plan(fleet, service='AmazonEC2', region=None, operation='RunInstances', overlap='stacked',
+        size_flexible=None, hours_per_month=hours_per_month):
+    """ Return the RI plan of a fleet: every option's cost and break even utilization, and the optimal mix
+    Called as a module
+
+    Args:
+        fleet (list): dicts with 'instanceType', 'count' (default 1) and 'hours' per month per instance (default hours_per_month)
+        service (str): AWS service name. options 'AmazonEC2'|'AmazonRDS'. default = 'AmazonEC2'
+        region (str): AWS region name. e.x 'us-east-1'
+        operation (str): Operation. default = 'RunInstances'
+        overlap (str): 'stacked' | 'pooled', see the module doc. default = 'stacked'
+        size_flexible (bool): True/False. Group by family in normalized units. default = None (is_size_flexible)
+        hours_per_month (float): hours in a month. default = 730
+    Return:
+        dict: {'options': {'L/C/P': {'monthly', 'annual', 'upfront', 'savings_pct'}},
+            'groups': {group: {'od_monthly', 'units_used', 'option', 'units', 'monthly', 'upfront', 'break_even': {'L/C/P': float}}},
+            'optimal': {'od_monthly', 'monthly', 'annual', 'upfront', 'savings_pct'}, 'unpriced': list of instance types}
+    """
+    if np is None:
+        raise Exception("ri_planner requires numpy. pip install numpy")
+    if size_flexible is None:
+        size_flexible = is_size_flexible(service, operation)
+    index = instance_index.get_index(service, region, operation)
+    positions = {instanceType: i for i, instanceType in enumerate(index.instanceTypes)}
+    unpriced = sorted({row['instanceType'] for row in fleet if row['instanceType'] not in positions})
+    if unpriced:
+        logging.warning(f"no price for {unpriced} in {region} {operation}")
+    fleet = [row for row in fleet if row['instanceType'] in positions]
+    rows = np.array([positions[row['instanceType']] for row in fleet], dtype=np.intp)
+    count = np.array([_number(row.get('count'), 1) for row in fleet])
+    hours = np.array([_number(row.get('hours'), hours_per_month) for row in fleet])
+
+    nsf = index.columns['normalizationSizeFactor'][rows]
+    names = [instanceType.rsplit('.', 1)[0] if size_flexible and not np.isnan(factor) else instanceType
+        for instanceType, factor in zip(index.instanceTypes[rows], nsf)]
+    if not size_flexible:
+        nsf = np.ones(len(rows))
+    nsf = np.where(np.isnan(nsf), 1.0, nsf)
+    group_names, group = np.unique(np.array(names, dtype=object), return_inverse=True) if names else ([], np.zeros(0, dtype=np.intp))
+    nan = np.full(len(index), np.nan)
+    ri_hr = np.stack([index.reserved.get(option, (nan, nan))[0][rows] for option in options], axis=1)
+    ri_uf = np.stack([index.reserved.get(option, (nan, nan))[1][rows] for option in options], axis=1)
+    months = np.array([term_months[option[0]] for option in options], dtype=float)
+
+    result = evaluate(index.od_hr[rows], ri_hr, ri_uf, months, nsf, count, hours, np.asarray(group, dtype=np.intp),
+        overlap=overlap, hours_per_month=hours_per_month)
+    # The cheapest of OnDemand (column 0) and each option, per group
+    choices = np.concatenate([result['od_monthly'][:, None], result['monthly']], axis=1)
+    best = np.argmin(np.where(np.isnan(choices), np.inf, choices), axis=1)
+    picked = np.arange(len(group_names))
+    best_monthly = choices[picked, best]
+    best_upfront = np.where(best > 0, result['upfront'][picked, np.maximum(best - 1, 0)], 0.0)
+    best_units = np.where(best > 0, result['units'][picked, np.maximum(best - 1, 0)], 0.0)
+    od_total = float(result['od_monthly'].sum())
+
+    def savings_pct(monthly):
+        return round((1 - monthly / od_total) * 100, 2) if od_total else 0.0
+    option_names = ['/'.join(option) for option in options]
+    return {
+        'options': {name: {'monthly': round(float(monthly), 2), 'annual': round(float(monthly) * 12, 2),
+            'upfront': round(float(upfront), 2), 'savings_pct': savings_pct(float(monthly))}
+            for name, monthly, upfront in zip(option_names, np.nansum(np.where(np.isnan(result['monthly']),
+                result['od_monthly'][:, None], result['monthly']), axis=0), result['upfront'].sum(axis=0))},
+        'groups': {name: {
+            'od_monthly': round(float(result['od_monthly'][g]), 2),
+            'units_used': round(float(result['unit_hours'][g]) / hours_per_month, 2),
+            'option': 'OnDemand' if best[g] == 0 else option_names[best[g] - 1],
+            'units': float(best_units[g]),
+            'monthly': round(float(best_monthly[g]), 2),
+            'upfront': round(float(best_upfront[g]), 2),
+            'break_even': {option: round(float(value), 3) for option, value in zip(option_names, result['break_even'][g])
+                if value == value},
+            } for g, name in enumerate(group_names)},
+        'optimal': {'od_monthly': round(od_total, 2), 'monthly': round(float(best_monthly.sum()), 2),
+            'annual': round(float(best_monthly.sum()) * 12, 2), 'upfront': round(float(best_upfront.sum()), 2),
+            'savings_pct': savings_pct(float(best_monthly.sum()))},
+        'unpriced': unpriced,
+    }
+
+
+if __name__ == '__main__':
+    from fleet_cost import read_inventory
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('fleet', help='fleet file, csv or .jsonl')
+    parser.add_argument('--region', required=True)
+    parser.add_argument('--service', default='AmazonEC2')
+    parser.add_argument('--operation', default='RunInstances')
+    parser.add_argument('--overlap', default='stacked', choices=overlaps)
+    parser.add_argument('--hours-per-month', type=float, default=hours_per_month)
+    parser.add_argument('--cache', help='response cache file')
+    parser.add_argument('--offline', help='comma separated bulk offer files to use instead of the api')
+    parser.add_argument('--offline-db', help='SQLite offer store to use instead of the api')
+    parser.add_argument('--loglvl', default='WARNING')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglvl)
+    if args.cache:
+        aws_pricing.use_cache(args.cache)
+    if args.offline or args.offline_db:
+        aws_pricing.use_offline(*(args.offline.split(',') if args.offline else []), db=args.offline_db)
+    result = plan(list(read_inventory(args.fleet)), service=args.service, region=args.region, operation=args.operation,
+        overlap=args.overlap, hours_per_month=args.hours_per_month)
+    print(json.dumps(result, indent=2))
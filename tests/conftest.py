@@ -0,0 +1,13 @@
+import os, sys
+import pytest
+
+# The modules live at the repository root
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+fixtures = os.path.join(root, 'tests', 'fixtures')
+
+
+@pytest.fixture
+def fixture_path():
+    """ Return the path of a file in tests/fixtures """
+    return lambda name: os.path.join(fixtures, name)
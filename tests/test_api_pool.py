@@ -0,0 +1,92 @@
+""" ApiPool retries, backoff and rate lowering against a stubbed pricing client, and map ordering """
+import random, time
+import pytest
+import boto3
+from botocore.exceptions import ClientError, EndpointConnectionError, ReadTimeoutError
+from botocore.stub import Stubber
+import api_pool
+
+response = {'FormatVersion': 'aws_v1', 'PriceList': []}
+
+
+@pytest.fixture
+def stubbed():
+    client = boto3.client('pricing', region_name='us-east-1', aws_access_key_id='key', aws_secret_access_key='secret')
+    with Stubber(client) as stubber:
+        yield client, stubber
+        stubber.assert_no_pending_responses()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """ Record the backoff delays instead of sleeping """
+    delays = []
+    monkeypatch.setattr(api_pool.time, 'sleep', delays.append)
+    monkeypatch.setattr(api_pool.random, 'uniform', lambda low, high: 1.0)
+    return delays
+
+
+def test_throttling_backoff(stubbed, sleeps):
+    client, stubber = stubbed
+    for _ in range(3):
+        stubber.add_client_error('get_products', service_error_code='ThrottlingException', http_status_code=400)
+    stubber.add_response('get_products', response, {'ServiceCode': 'AmazonEC2'})
+    pool = api_pool.ApiPool(rate=1000, min_rate=100)
+    assert pool.call(client.get_products, ServiceCode='AmazonEC2') == response
+    assert sleeps == [0.25, 0.5, 1.0]
+    # Each throttle halves the rate down to min_rate, and the success starts restoring it
+    assert pool.throttles == 3
+    assert pool.bucket.rate == 125 + 0.1
+
+
+def test_transient_retry(stubbed, sleeps):
+    client, stubber = stubbed
+    stubber.add_client_error('get_products', service_error_code='ServiceUnavailable', http_status_code=503)
+    stubber.add_client_error('get_products', service_error_code='InternalError', http_status_code=500)
+    stubber.add_response('get_products', response, {'ServiceCode': 'AmazonEC2'})
+    pool = api_pool.ApiPool(rate=1000)
+    assert pool.call(client.get_products, ServiceCode='AmazonEC2') == response
+    # Transient errors back off without lowering the rate
+    assert sleeps == [0.25, 0.5]
+    assert pool.throttles == 0 and pool.bucket.rate == 1000
+
+
+def test_connection_errors(sleeps):
+    errors = [EndpointConnectionError(endpoint_url='https://api.pricing.us-east-1.amazonaws.com'),
+        ReadTimeoutError(endpoint_url='https://api.pricing.us-east-1.amazonaws.com'), ConnectionResetError()]
+    def call():
+        if errors:
+            raise errors.pop(0)
+        return response
+    assert api_pool.ApiPool(rate=1000).call(call) == response
+    assert len(sleeps) == 3
+
+
+def test_errors_not_retried(stubbed, sleeps):
+    client, stubber = stubbed
+    stubber.add_client_error('get_products', service_error_code='AccessDeniedException', http_status_code=400)
+    with pytest.raises(ClientError, match='AccessDeniedException'):
+        api_pool.ApiPool(rate=1000).call(client.get_products, ServiceCode='AmazonEC2')
+    assert sleeps == []
+
+
+def test_retries_exhausted(stubbed, sleeps):
+    client, stubber = stubbed
+    for _ in range(3):
+        stubber.add_client_error('get_products', service_error_code='ThrottlingException', http_status_code=400)
+    with pytest.raises(ClientError, match='ThrottlingException'):
+        api_pool.ApiPool(rate=1000, max_retries=2).call(client.get_products, ServiceCode='AmazonEC2')
+    assert len(sleeps) == 2
+
+
+def test_map_order():
+    def slow(i):
+        time.sleep(random.uniform(0, 0.02))
+        return i * 2
+    pool = api_pool.ApiPool(max_workers=8, rate=1000)
+    try:
+        assert pool.map(slow, range(40)) == [i * 2 for i in range(40)]
+        results = pool.map(lambda i: 1 / i, [1, 0, 2], return_exceptions=True)
+        assert results[0] == 1 and isinstance(results[1], ZeroDivisionError) and results[2] == 0.5
+    finally:
+        pool.shutdown()
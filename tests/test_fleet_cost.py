@@ -0,0 +1,42 @@
+""" Fleet cost estimate of a small inventory priced from the fixture offer """
+import pytest
+import aws_pricing, fleet_cost
+
+np = pytest.importorskip('numpy')
+
+
+@pytest.fixture
+def offline(fixture_path):
+    yield aws_pricing.use_offline(fixture_path('AmazonEC2.json'))
+    aws_pricing.use_offline()
+
+
+def test_estimate(offline):
+    rows = [
+        {'instanceType': 't2.micro', 'operation': 'RunInstances', 'region': 'us-east-1', 'count': 2},
+        {'instanceType': 't2.micro', 'operation': 'RunInstances', 'region': 'us-east-1', 'hours': 100,
+            'LeaseContractLength': '1yr', 'OfferingClass': 'standard', 'PurchaseOption': 'No Upfront'},
+        {'instanceType': 't2.micro', 'operation': 'RunInstances', 'region': 'us-east-1', 'hours': 0,
+            'LeaseContractLength': '1yr', 'OfferingClass': 'standard', 'PurchaseOption': 'All Upfront'},
+        {'instanceType': 'x1.huge', 'operation': 'RunInstances', 'region': 'us-east-1'},
+    ]
+    totals = fleet_cost.estimate(rows, chunk_size=2)
+    assert rows[0]['od_monthly'] == pytest.approx(0.0116 * 730 * 2)
+    assert rows[1]['od_monthly'] == pytest.approx(1.16)
+    # RIs are billed for every hour of the month, whatever the hours the row runs
+    assert rows[1]['ri_monthly'] == pytest.approx(0.0072 * 730)
+    assert rows[2]['od_monthly'] == 0.0
+    assert rows[2]['ri_monthly'] == pytest.approx(5.0)
+    assert rows[3]['od_hr'] is None
+    assert totals['rows'] == 4 and totals['keys'] == 2 and totals['unpriced_rows'] == 1
+    assert totals['inventory'] == {'rows': 2, 'unpriced_rows': 0, 'monthly': 10.26, 'annual': 123.07}
+    assert totals['Reserved']['1yr/standard/All Upfront']['monthly'] == 20.0
+
+
+def test_row_writer(tmp_path):
+    path = tmp_path / 'rows.csv'
+    with open(path, 'w', newline='') as f:
+        writer = fleet_cost.RowWriter(f)
+        writer([{'instanceType': 't2.micro', 'od_hr': 0.0116}])
+        writer([{'instanceType': 'c5.large', 'od_hr': 0.085}])
+    assert path.read_text().splitlines() == ['instanceType,od_hr', 't2.micro,0.0116', 'c5.large,0.085']
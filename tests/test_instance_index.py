@@ -0,0 +1,31 @@
+""" Instance index of the fixture offer's us-east-1 RunInstances instance types """
+import pytest
+import aws_pricing, instance_index, price_matrix
+
+np = pytest.importorskip('numpy')
+
+
+@pytest.fixture
+def index(fixture_path):
+    aws_pricing.use_offline(fixture_path('AmazonEC2.json'))
+    yield instance_index.get_index('AmazonEC2', 'us-east-1', 'RunInstances', refresh=True)
+    aws_pricing.use_offline()
+
+
+def test_query(index):
+    assert [row['instanceType'] for row in index.query()] == ['t2.micro', 'c5.large']
+    assert [row['instanceType'] for row in index.query(vcpu=(2, None))] == ['c5.large']
+
+
+def test_top_by_vcpu(index):
+    rows = index.top(2, by='vcpu')
+    assert [row['instanceType'] for row in rows] == ['t2.micro', 'c5.large']
+    assert rows[1]['hr_price_per_vcpu'] == pytest.approx(0.085 / 2)
+
+
+def test_reserved_price(index):
+    # The same effective hourly cost as price_matrix and ri_planner
+    option = ('1yr', 'standard', 'All Upfront')
+    rows = index.query(option=option)
+    assert [row['instanceType'] for row in rows] == ['t2.micro']
+    assert rows[0]['hr_price'] == pytest.approx(price_matrix.effective_hr(0.0, 60.0, 12)) == pytest.approx(60.0 / 8760)
@@ -0,0 +1,53 @@
+""" regions from the location map and the operations subcommand's metadata cache, without the api """
+import pytest
+import aws_pricing
+
+
+@pytest.fixture
+def api(monkeypatch, tmp_path):
+    """ Record the operations described instead of calling the api, with the metadata cache in tmp_path """
+    calls = []
+    monkeypatch.setattr(aws_pricing, 'metadata_file', str(tmp_path / 'cache' / 'metadata.json'))
+    monkeypatch.setattr(aws_pricing, 'get_client', lambda *args, **kwargs: pytest.fail('api called'))
+    monkeypatch.setattr(aws_pricing, '_instance_operations', lambda service: ['RunInstances', 'RunInstances:0002'])
+    def describe(service, operations):
+        calls.append(list(operations))
+        return {op: f"{op} os" for op in operations}
+    monkeypatch.setattr(aws_pricing, 'get_operation_descriptions', describe)
+    return calls
+
+
+def test_regions(api, capsys):
+    aws_pricing.regions()
+    printed = capsys.readouterr().out.split()
+    assert printed == list(aws_pricing.region_locations.values()) and 'us-east-1' in printed
+
+
+def test_operations_cache(api, capsys):
+    aws_pricing.operations('AmazonEC2', 'RunInstances')
+    assert api == [['RunInstances']]
+    # Only the fetched description is cached, so listing every operation fetches the rest
+    aws_pricing.operations('AmazonEC2')
+    assert api == [['RunInstances'], ['RunInstances:0002']]
+    aws_pricing.operations('AmazonEC2')
+    aws_pricing.operations('AmazonEC2', 'RunInstances:0002')
+    assert len(api) == 2
+    assert capsys.readouterr().out.splitlines()[-1] == 'AmazonEC2 - RunInstances:0002 : RunInstances:0002 os'
+    entry = aws_pricing.load_metadata()['operations']['AmazonEC2']
+    assert entry['complete'] and list(entry['descriptions']) == ['RunInstances', 'RunInstances:0002']
+
+
+def test_operations_ttl(api, monkeypatch):
+    aws_pricing.operations('AmazonEC2')
+    monkeypatch.setattr(aws_pricing, 'metadata_ttl', 0)
+    aws_pricing.operations('AmazonEC2')
+    assert len(api) == 2
+
+
+def test_operations_unwritable(api, monkeypatch, tmp_path):
+    (tmp_path / 'file').write_text('')
+    monkeypatch.setattr(aws_pricing, 'metadata_file', str(tmp_path / 'file' / 'metadata.json'))
+    aws_pricing.operations('AmazonEC2', 'RunInstances')
+    aws_pricing.operations('AmazonEC2', 'RunInstances')
+    # Nothing is cached, but only the requested operation is fetched each time
+    assert api == [['RunInstances'], ['RunInstances']]
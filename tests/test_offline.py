@@ -0,0 +1,87 @@
+""" Offline mode: get_pricing, get_attr_vals and get_operation_description answered from the fixture offer,
+loaded from its json and its csv file """
+import json
+import pytest
+import aws_pricing, offer_store
+
+
+@pytest.fixture(params=['AmazonEC2.json', 'AmazonEC2.csv'])
+def offline(request, fixture_path):
+    store = aws_pricing.use_offline(fixture_path(request.param))
+    yield store
+    aws_pricing.use_offline()
+
+
+def test_get_pricing(offline):
+    result = aws_pricing.get_pricing(service='AmazonEC2', instanceType='t2.micro', operation='RunInstances',
+        region='us-east-1')
+    assert result['OnDemand'] == {'unit': 'Hrs', 'hr_price': 0.0116,
+        'description': '$0.0116 per On Demand Linux t2.micro Instance Hour'}
+    assert result['Reserved']['hr_price'] == 0.0072
+    assert 'uf_price' not in result['Reserved']
+    assert result['Reserved']['discount'] == 38.0
+    assert result['attributes']['operatingSystem'] == 'Linux'
+
+
+def test_get_pricing_upfront(offline):
+    result = aws_pricing.get_pricing(service='AmazonEC2', instanceType='t2.micro', operation='RunInstances',
+        region='us-east-1', LeaseContractLength='3yr', OfferingClass='convertible', PurchaseOption='Partial Upfront')
+    assert result['Reserved']['hr_price'] == 0.0029
+    assert result['Reserved']['uf_price'] == 75.0
+    assert result['Reserved']['payback_mos'] == 11.5
+
+
+def test_get_pricing_region(offline):
+    result = aws_pricing.get_pricing(service='AmazonEC2', instanceType='t2.micro', operation='RunInstances',
+        region='eu-west-1')
+    assert result['OnDemand']['hr_price'] == 0.0126
+    assert result['Reserved'] == {}
+
+
+def test_get_pricing_invalid(offline):
+    with pytest.raises(Exception, match="region: 'ap-south-1' invalid"):
+        aws_pricing.get_pricing(service='AmazonEC2', instanceType='t2.micro', operation='RunInstances',
+            region='ap-south-1')
+
+
+def test_get_attr_vals(offline):
+    assert aws_pricing.get_attr_vals('AmazonEC2', 'operation') == ['RunInstances', 'RunInstances:0002']
+    assert aws_pricing.get_attr_vals('AmazonEC2', 'instanceType') == ['c5.large', 't2.micro']
+    assert aws_pricing.get_regions() == ['eu-west-1', 'us-east-1']
+
+
+def test_get_operation_description(offline):
+    assert aws_pricing.get_operation_description('AmazonEC2', 'RunInstances') == 'Linux'
+    assert aws_pricing.get_operation_description('AmazonEC2', 'RunInstances:0002') == 'Windows'
+
+
+@pytest.mark.parametrize('name', ['AmazonEC2.json', 'AmazonEC2.csv'])
+def test_load_in_batches(name, fixture_path, monkeypatch):
+    whole = offer_store.OfferStore(fixture_path(name))
+    monkeypatch.setattr(offer_store, 'batch_size', 1)
+    batched = offer_store.OfferStore(fixture_path(name))
+    assert batched.versions == whole.versions == {'AmazonEC2': '20190701000000'}
+    assert batched.get_products('AmazonEC2', []) == whole.get_products('AmazonEC2', [])
+    products = whole.get_products('AmazonEC2', [{'Type': 'TERM_MATCH', 'Field': 'instanceType', 'Value': 't2.micro'}])
+    assert sorted(product['product']['sku'] for product in products) == ['SKU1', 'SKU2', 'SKU3']
+    assert len(products[0]['terms']['Reserved']) == 3
+
+
+def test_json_stream(fixture_path):
+    with open(fixture_path('AmazonEC2.json')) as f:
+        offer = json.load(f)
+    with open(fixture_path('AmazonEC2.json')) as f:
+        parts = list(offer_store.iter_json_offer(f, chunk_size=64))
+    assert ('offer', 'offerCode', 'AmazonEC2') in parts
+    assert [key for section, key, _ in parts if section == 'products'] == list(offer['products'])
+    assert {key: value for section, key, value in parts if section == 'terms'} == \
+        {(term_type, sku): terms for term_type, skus in offer['terms'].items() for sku, terms in skus.items()}
+
+
+def test_get_pricing_batch_bad_request(offline):
+    request = {'service': 'AmazonEC2', 'instanceType': 't2.micro', 'operation': 'RunInstances', 'region': 'us-east-1'}
+    results = aws_pricing.get_pricing_batch([request, {'Region': 'us-east-1'}, dict(request, PurchaseOption='All Upfront')],
+        return_exceptions=True)
+    assert results[0]['Reserved']['hr_price'] == 0.0072
+    assert isinstance(results[1], Exception) and "['Region'] invalid" in str(results[1])
+    assert results[2]['Reserved']['uf_price'] == 60.0
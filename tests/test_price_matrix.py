@@ -0,0 +1,31 @@
+""" Derived cost columns of the price matrix, from the fixture offer """
+import pytest
+import aws_pricing, price_matrix
+
+np = pytest.importorskip('numpy')
+
+
+@pytest.fixture
+def offline(fixture_path):
+    yield aws_pricing.use_offline(fixture_path('AmazonEC2.json'))
+    aws_pricing.use_offline()
+
+
+def test_effective_hr():
+    # The upfront is spread over 8760 hours a year
+    assert price_matrix.effective_hr(0.0, 8760.0, 12) == 1.0
+    assert price_matrix.effective_hr(0.5, 8760.0 * 3, 36) == 1.5
+    assert np.allclose(price_matrix.effective_hr(np.array([0.0, 0.1]), np.array([87.6, 0.0]), np.array([12, 36])),
+        [0.01, 0.1])
+
+
+def test_get_price_columns(offline):
+    columns = price_matrix.get_price_columns(service='AmazonEC2', instanceTypes=['t2.micro'], operations=['RunInstances'],
+        regions=['us-east-1'], LeaseContractLengths=['1yr'], OfferingClasses=['standard'],
+        PurchaseOptions=['All Upfront', 'No Upfront'])
+    assert list(columns['PurchaseOption']) == ['All Upfront', 'No Upfront']
+    assert np.allclose(columns['eff_hr'], [60.0 / 8760, 0.0072])
+    assert np.allclose(columns['eff_discount'], [(1 - 60.0 / 8760 / 0.0116) * 100, 37.931034])
+    # payback_mos keeps get_pricing's 750 hour month
+    assert columns['payback_mos'][0] == pytest.approx(60.0 / (0.0116 * 750))
+    assert np.isnan(columns['payback_mos'][1])
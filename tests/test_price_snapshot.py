@@ -0,0 +1,33 @@
+""" Snapshots of two versions of the fixture offer and the diff between them """
+import io
+import price_snapshot
+
+
+def test_diff_snapshots(fixture_path):
+    old = price_snapshot.snapshot_offer(fixture_path('AmazonEC2.json'))
+    new = price_snapshot.snapshot_offer(fixture_path('AmazonEC2-20190712.json'))
+    assert (old['version'], new['version']) == ('20190701000000', '20190712000000')
+    diff = price_snapshot.diff_snapshots(old, new)
+    assert diff == {'added': ['SKU5'], 'removed': ['SKU3'], 'repriced': ['SKU4'], 'changed': ['SKU2']}
+    assert price_snapshot.changed_rows(new, diff) == [
+        ['SKU5', 'm5.large', 'RunInstances', 'US East (N. Virginia)', 'OnDemand', None, None, None, 0.096, None],
+        ['SKU4', 'c5.large', 'RunInstances', 'US East (N. Virginia)', 'OnDemand', None, None, None, 0.08, None],
+        ['SKU4', 'c5.large', 'RunInstances', 'US East (N. Virginia)', 'Reserved', '1yr', 'standard', 'No Upfront', 0.054, None],
+    ]
+
+
+def test_diff_unchanged(fixture_path):
+    snapshot = price_snapshot.snapshot_offer(fixture_path('AmazonEC2.json'))
+    diff = price_snapshot.diff_snapshots(snapshot, snapshot)
+    assert diff == {'added': [], 'removed': [], 'repriced': [], 'changed': []}
+    assert price_snapshot.changed_rows(snapshot, diff) == []
+
+
+def test_save_load(fixture_path, tmp_path):
+    snapshot = price_snapshot.snapshot_offer(fixture_path('AmazonEC2.csv'))
+    price_snapshot.save_snapshot(snapshot, str(tmp_path / 'snapshot.json.gz'))
+    assert price_snapshot.load_snapshot(str(tmp_path / 'snapshot.json.gz')) == snapshot
+    out = io.StringIO()
+    price_snapshot.write_csv(snapshot['skus']['SKU1']['rows'], out)
+    assert out.getvalue().splitlines()[0] == ','.join(price_snapshot.row_columns)
+    assert len(out.getvalue().splitlines()) == 5
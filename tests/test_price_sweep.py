@@ -0,0 +1,52 @@
+""" Price sweep shards and checkpoint / resume against the fixture offer """
+import csv, json
+import pytest
+import aws_pricing, price_sweep
+
+
+@pytest.fixture
+def offline(fixture_path):
+    store = aws_pricing.use_offline(fixture_path('AmazonEC2.json'))
+    yield store
+    aws_pricing.use_offline()
+
+
+def test_expand_matrix(offline):
+    matrix = price_sweep.expand_matrix('AmazonEC2')
+    assert matrix == {'regions': ['eu-west-1', 'us-east-1'], 'instanceTypes': None,
+        'operations': ['RunInstances', 'RunInstances:0002'], 'current_generation': True}
+
+
+def test_sweep_shard(offline):
+    # One query per operation prices every instance type of the region. The fixture offer has no
+    # currentGeneration attribute, so the shard falls back to every instance type
+    rows = price_sweep.sweep_shard('AmazonEC2', 'us-east-1', None, ['RunInstances'])
+    assert [(row['instanceType'], row['termType']) for row in rows] == [('c5.large', 'OnDemand'),
+        ('c5.large', 'Reserved'), ('t2.micro', 'OnDemand'), ('t2.micro', 'Reserved'), ('t2.micro', 'Reserved'),
+        ('t2.micro', 'Reserved')]
+    rows = price_sweep.sweep_shard('AmazonEC2', 'eu-west-1', None, ['RunInstances'])
+    assert [(row['instanceType'], row['hr_price']) for row in rows] == [('t2.micro', 0.0126)]
+    rows = price_sweep.sweep_shard('AmazonEC2', 'us-east-1', ['c5.large'], ['RunInstances', 'RunInstances:0002'])
+    assert {row['instanceType'] for row in rows} == {'c5.large'}
+
+
+def test_sweep_output_deleted(fixture_path, tmp_path, monkeypatch):
+    # The sweep loads the offer db in this process too, restored to no offline store at teardown
+    monkeypatch.setattr(aws_pricing, 'offline_store', None)
+    out = str(tmp_path / 'prices.csv')
+    settings = {'offline': [fixture_path('AmazonEC2.json')]}
+    first = price_sweep.sweep(out, operations=['RunInstances'], processes=1, settings=settings)
+    assert first == {'shards': 2, 'resumed': 0, 'rows': 7, 'failed': []}
+    with open(out) as f:
+        expected = f.read()
+    # A checkpoint recording a size with its output gone starts over, instead of padding a new file
+    (tmp_path / 'prices.csv').unlink()
+    second = price_sweep.sweep(out, processes=1, settings=settings)
+    assert second == first
+    with open(out) as f:
+        content = f.read()
+    assert '\0' not in content and content == expected
+    assert len(list(csv.DictReader(content.splitlines()))) == 7
+    with open(out + '.ckpt') as f:
+        records = [json.loads(line) for line in f]
+    assert 'matrices' in records[0] and len(records) == 3
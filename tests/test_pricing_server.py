@@ -0,0 +1,117 @@
+""" The pricing server against stub pricing / ec2 clients: batches, coalescing and per request errors """
+import json, threading, time
+import urllib.error, urllib.request
+import pytest
+import aws_pricing, pricing_server
+
+
+class StubClient(object):
+    """ Stub pricing / ec2 client answering from the fixture offer, recording its product queries """
+
+    def __init__(self, offer, latency=0.0):
+        self.latency = latency
+        self.queries = []
+        self.products = []
+        for sku, product in offer['products'].items():
+            terms = {term_type: skus[sku] for term_type, skus in offer['terms'].items() if sku in skus}
+            self.products.append((product['attributes'], json.dumps({'product': product, 'serviceCode': offer['offerCode'],
+                'terms': terms, 'version': offer['version'], 'publicationDate': offer['publicationDate']})))
+        self.lock = threading.Lock()
+
+    def get_products(self, ServiceCode, Filters=(), MaxResults=100, NextToken=None):
+        time.sleep(self.latency)
+        if MaxResults > 1:
+            # Not the one product offer version check
+            with self.lock:
+                self.queries.append({f['Field']: f['Value'] for f in Filters})
+        matches = [price for attributes, price in self.products
+            if all(attributes.get(f['Field']) == f['Value'] for f in Filters)]
+        return {'PriceList': matches[:MaxResults], 'FormatVersion': 'aws_v1'}
+
+    def get_attribute_values(self, ServiceCode, AttributeName, NextToken=None):
+        time.sleep(self.latency)
+        values = sorted({attributes[AttributeName] for attributes, _ in self.products if AttributeName in attributes})
+        return {'AttributeValues': [{'Value': value} for value in values]}
+
+    def describe_regions(self):
+        time.sleep(self.latency)
+        return {'Regions': [{'RegionName': 'eu-west-1'}, {'RegionName': 'us-east-1'}]}
+
+
+@pytest.fixture
+def server(fixture_path):
+    """ A pricing server on a free port, with the stub client as its pricing and ec2 clients """
+    with open(fixture_path('AmazonEC2.json')) as f:
+        client = StubClient(json.load(f), latency=0.05)
+    aws_pricing.set_client(client, 'pricing')
+    aws_pricing.set_client(client, 'ec2')
+    server = pricing_server.make_server(port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.client = client
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server
+    server.shutdown()
+    server.server_close()
+    aws_pricing.use_cache()
+    aws_pricing.configure_clients()
+
+
+def post(server, body):
+    request = urllib.request.Request(server.url + '/pricing', data=json.dumps(body).encode(),
+        headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def get(server, path):
+    with urllib.request.urlopen(server.url + path) as response:
+        return json.load(response)
+
+
+request = {'service': 'AmazonEC2', 'instanceType': 't2.micro', 'operation': 'RunInstances', 'region': 'us-east-1'}
+
+
+def test_batch_shares_product_query(server):
+    status, results = post(server, {'requests': [request, dict(request, PurchaseOption='All Upfront'),
+        dict(request, LeaseContractLength='3yr', OfferingClass='convertible', PurchaseOption='Partial Upfront')]})
+    assert status == 200
+    assert [result['Reserved'].get('uf_price') for result in results] == [None, 60.0, 75.0]
+    assert results[0]['OnDemand']['hr_price'] == 0.0116
+    # The requests only differ by RI option, so they share one product query
+    assert server.client.queries == [{'instanceType': 't2.micro', 'operation': 'RunInstances',
+        'location': 'US East (N. Virginia)'}]
+
+
+def test_batch_errors(server):
+    status, results = post(server, {'requests': [request, dict(request, region='ap-south-1'),
+        dict(request, Region='us-east-1'), 'c5.large', dict(request, instanceType='c5.large')]})
+    assert status == 200
+    assert results[0]['Reserved']['hr_price'] == 0.0072
+    assert "region: 'ap-south-1' invalid" in results[1]['error']
+    assert "['Region'] invalid" in results[2]['error']
+    assert 'Must be a dict' in results[3]['error']
+    assert results[4]['OnDemand']['hr_price'] == 0.085
+
+
+def test_single_error(server):
+    status, body = post(server, dict(request, operation='RunInstances:9999'))
+    assert status == 400 and "operation" in body['error']
+    assert get(server, '/regions') == ['eu-west-1', 'us-east-1']
+
+
+def test_coalesced(server):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(post(server, request))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [status for status, _ in results] == [200] * 4
+    assert all(body == results[0][1] for _, body in results)
+    # One lookup ran, the other three waited for its result
+    assert get(server, '/stats')['coalesced'] == 3
+    assert len(server.client.queries) == 1
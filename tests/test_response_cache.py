@@ -0,0 +1,105 @@
+""" ResponseCache TTLs, LRU eviction and offer version invalidation, and the caching of paginated queries """
+import json
+import pytest
+import aws_pricing, response_cache
+
+
+class PagedClient(object):
+    """ Stub pricing client answering get_products from the fixture offer, page_size products a page """
+
+    def __init__(self, offer, page_size=1):
+        self.page_size = page_size
+        self.calls = 0
+        self.products = []
+        for sku, product in offer['products'].items():
+            terms = {term_type: skus[sku] for term_type, skus in offer['terms'].items() if sku in skus}
+            self.products.append((product['attributes'], json.dumps({'product': product, 'serviceCode': offer['offerCode'],
+                'terms': terms, 'version': offer['version'], 'publicationDate': offer['publicationDate']})))
+
+    def get_products(self, ServiceCode, Filters=(), MaxResults=100, NextToken=None):
+        self.calls += 1
+        matches = [price for attributes, price in self.products
+            if all(attributes.get(f['Field']) == f['Value'] for f in Filters)]
+        size = min(MaxResults, self.page_size)
+        start = int(NextToken or 0)
+        response = {'PriceList': matches[start:start + size], 'FormatVersion': 'aws_v1'}
+        if start + size < len(matches):
+            response['NextToken'] = str(start + size)
+        return response
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return response_cache.ResponseCache(str(tmp_path / 'cache.db'))
+
+
+@pytest.fixture
+def client(fixture_path, tmp_path):
+    with open(fixture_path('AmazonEC2.json')) as f:
+        client = PagedClient(json.load(f))
+    aws_pricing.set_client(client, 'pricing')
+    aws_pricing.use_cache(str(tmp_path / 'pages.db'))
+    yield client
+    aws_pricing.use_cache()
+    aws_pricing.configure_clients()
+
+
+def test_ttl(cache, monkeypatch):
+    params = {'ServiceCode': 'AmazonEC2'}
+    cache.put('get_products', params, {'PriceList': ['a']})
+    cache.put('describe_regions', {}, {'Regions': []})
+    assert cache.get('get_products', params) == {'PriceList': ['a']}
+    now = response_cache.time.time()
+    monkeypatch.setattr(response_cache.time, 'time', lambda: now + 2 * response_cache.day)
+    # A day old get_products response has expired, regions are kept for a week
+    assert cache.get('get_products', params) is None
+    assert cache.get('describe_regions', {}) == {'Regions': []}
+    assert cache.stats()['hits'] == {'get_products': 1, 'describe_regions': 1}
+
+
+def test_filter_order(cache):
+    filters = [{'Type': 'TERM_MATCH', 'Field': 'operation', 'Value': 'RunInstances'},
+        {'Type': 'TERM_MATCH', 'Field': 'location', 'Value': 'US East (N. Virginia)'}]
+    cache.put('get_products', {'ServiceCode': 'AmazonEC2', 'Filters': filters}, {'PriceList': ['a']})
+    assert cache.get('get_products', {'ServiceCode': 'AmazonEC2', 'Filters': filters[::-1]}) == {'PriceList': ['a']}
+
+
+def test_lru_eviction(tmp_path, monkeypatch):
+    cache = response_cache.ResponseCache(str(tmp_path / 'cache.db'), max_bytes=300)
+    clock = iter(range(100))
+    monkeypatch.setattr(response_cache.time, 'time', lambda: 1000.0 + next(clock))
+    for name in 'abc':
+        cache.put('get_products', {'ServiceCode': name}, {'PriceList': [name * 80]})
+    # a is read after b and c, so b is the least recently used response when d does not fit
+    assert cache.get('get_products', {'ServiceCode': 'a'}) is not None
+    cache.put('get_products', {'ServiceCode': 'd'}, {'PriceList': ['d' * 80]})
+    assert [cache.get('get_products', {'ServiceCode': name}) is not None for name in 'abcd'] == [True, False, True, True]
+    assert cache.stats()['bytes'] <= 300
+
+
+def test_version_invalidation(cache):
+    cache.put('get_products', {'ServiceCode': 'AmazonEC2'}, {'PriceList': ['a']})
+    cache.put('get_products', {'ServiceCode': 'AmazonRDS'}, {'PriceList': ['b']})
+    assert not cache.check_version('AmazonEC2', '20190701000000')
+    assert not cache.check_version('AmazonEC2', '20190701000000')
+    assert cache.check_version('AmazonEC2', '20190712000000')
+    assert cache.get('get_products', {'ServiceCode': 'AmazonEC2'}) is None
+    assert cache.get('get_products', {'ServiceCode': 'AmazonRDS'}) == {'PriceList': ['b']}
+
+
+def test_partial_pages(client):
+    # get_operation_description stops at the first page, which is cached as a partial response
+    for _ in range(3):
+        assert aws_pricing.get_operation_description('AmazonEC2', 'RunInstances') == 'Linux'
+    stats = aws_pricing.response_cache.stats()
+    assert stats['hits'] == {'get_products': 2} and stats['misses'] == {'get_products': 1}
+    # The offer version check and the first page
+    assert client.calls == 2
+    filters = [{'Type': 'TERM_MATCH', 'Field': 'operation', 'Value': 'RunInstances'},
+        {'Type': 'TERM_MATCH', 'Field': 'location', 'Value': 'US East (N. Virginia)'}]
+    skus = [product['product']['sku'] for product in aws_pricing.iter_products('AmazonEC2', filters)]
+    assert skus == ['SKU1', 'SKU4']
+    # Reading past the partial response fetches the query again and caches it whole
+    assert client.calls == 4
+    assert [product['product']['sku'] for product in aws_pricing.iter_products('AmazonEC2', filters)] == skus
+    assert client.calls == 4
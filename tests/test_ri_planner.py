@@ -0,0 +1,38 @@
+""" RI plans of small fleets priced from the fixture offer """
+import pytest
+import aws_pricing, fleet_cost, ri_planner
+
+np = pytest.importorskip('numpy')
+
+
+@pytest.fixture
+def offline(fixture_path):
+    aws_pricing.use_offline(fixture_path('AmazonEC2.json'))
+    yield
+    aws_pricing.use_offline()
+
+
+def plan(fleet):
+    return ri_planner.plan(fleet, region='us-east-1', operation='RunInstances')
+
+
+def test_plan(offline):
+    result = plan([{'instanceType': 't2.micro', 'count': 2}])
+    assert result['optimal']['od_monthly'] == round(0.0116 * 730 * 2, 2)
+    assert result['options']['1yr/standard/No Upfront']['monthly'] == round(0.0072 * 730 * 2, 2)
+    assert result['groups']['t2.micro']['option'] != 'OnDemand'
+
+
+def test_zero_count_and_hours(offline):
+    # 0 is a value, not a missing column
+    result = plan([{'instanceType': 't2.micro', 'count': 0}, {'instanceType': 'c5.large', 'hours': 0}])
+    assert result['optimal']['od_monthly'] == 0.0
+    assert result['optimal']['monthly'] == 0.0
+
+
+def test_agrees_with_fleet_cost(offline):
+    option = ('1yr', 'standard', 'All Upfront')
+    rows = [dict(instanceType='t2.micro', operation='RunInstances', region='us-east-1',
+        LeaseContractLength=option[0], OfferingClass=option[1], PurchaseOption=option[2])]
+    fleet_cost.estimate(rows)
+    assert plan([{'instanceType': 't2.micro'}])['options']['/'.join(option)]['monthly'] == round(rows[0]['ri_monthly'], 2)